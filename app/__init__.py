@@ -1,26 +1,69 @@
 import os
-from flask import Flask, render_template, request, jsonify
+import re
+import click
+from flask import Flask, Blueprint, Response, current_app, g, render_template, request, jsonify, stream_with_context
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
 from peewee import *
+from playhouse.pool import PooledDatabase
+import base64
 import datetime
+import hashlib
+import json
 import time
-from playhouse.shortcuts import model_to_dict
+import uuid
+from urllib.parse import urlencode
+from app.archive import ARCHIVE_BATCH_SIZE, ARCHIVE_PAUSE, Archive, ArchiveSegment, NdjsonBackend, TableBackend, \
+    merge_by_id
+from app.assets import AssetManifest, asset_url, check_templates, serve_asset
+from app.auth import admin_required
+from app.images import ImageVariants, REPORT_VIEWPORTS, page_savings, responsive_image
+from app.cache import ResponseCache, render_cached
+from app.compression import CompressionMiddleware
+from app.events import EventRelay, sse_frame
+from app.idempotency import IdempotencyKeys, idempotent, backend_from_env as idempotency_backend_from_env
+from app.jobs import PeriodicJob
+from app.metrics import MetricsSqliteDatabase, record_request, registry as metrics, start_request_timer
+from app.migrations import migrate, migration_status
+from app.pool import StatsPooledMySQLDatabase
+from app.profiling import Profiler
+from app.ratelimit import RateLimiter, backend_from_env, rate_limit
+from app.replicas import ReplicaRouter, last_write_time, remember_write, replica_read
+from app.search import RANK_WINDOW, search_posts
+from app.writebehind import QueueFull, WriteBehindQueue
+from app.serializers import format_timestamp, parse_timestamp, post_json, posts_json, posts_ndjson, posts_csv
 
-load_dotenv()
-app = Flask(__name__)
+# The database is picked in create_app(), once .env has been loaded
+db = DatabaseProxy()
 
-# Database connection
-if os.getenv("TESTING") == "true":
-    db = SqliteDatabase(':memory:')
-else:
-    db = MySQLDatabase(
+bp = Blueprint('portfolio', __name__, cli_group=None)
+
+def make_database(host=None):
+    if os.getenv("TESTING") == "true":
+        return MetricsSqliteDatabase(':memory:')
+    return StatsPooledMySQLDatabase(
         os.getenv("MYSQL_DATABASE", "myportfoliodb"),
         user=os.getenv("MYSQL_USER", "myportfolio"),
         password=os.getenv("MYSQL_PASSWORD", "mypassword"),
-        host=os.getenv("MYSQL_HOST", "localhost"),
-        port=3306
+        host=host or os.getenv("MYSQL_HOST", "localhost"),
+        port=3306,
+        max_connections=int(os.getenv("DB_POOL_MAX_CONNECTIONS", "8")),
+        stale_timeout=int(os.getenv("DB_POOL_STALE_TIMEOUT", "300")),
+        timeout=int(os.getenv("DB_POOL_TIMEOUT", "10"))
     )
 
+def make_replica_router():
+    """Route reads to MYSQL_REPLICA_HOSTS (same database and credentials), or None without replicas."""
+    hosts = [host.strip() for host in os.getenv("MYSQL_REPLICA_HOSTS", "").split(',') if host.strip()]
+    if not hosts or os.getenv("TESTING") == "true":
+        return None
+    return ReplicaRouter(db, [make_database(host) for host in hosts],
+                         read_state=replica_state,
+                         write_heartbeat=write_replica_heartbeat,
+                         max_lag=float(os.getenv("REPLICA_MAX_LAG", "5")),
+                         check_interval=float(os.getenv("REPLICA_CHECK_INTERVAL", "1")),
+                         retry_after=float(os.getenv("REPLICA_RETRY_AFTER", "30")))
+
 # TimelinePost model definition
 class TimelinePost(Model):
     id = AutoField()
@@ -28,36 +71,191 @@ class TimelinePost(Model):
     email = CharField()
     content = TextField()
     created_at = DateTimeField(default=datetime.datetime.now)
+    # Set when the post is deleted; every read path skips these tombstones
+    # until purge_deleted_posts() removes them for good
+    deleted_at = DateTimeField(null=True)
+    # sha256 of (email, content), to spot the same post submitted twice
+    content_hash = CharField(max_length=64, null=True)
+    # Write-behind mode: the id handed out in the 202 response, so the
+    # client can find the post once it has been flushed
+    provisional_id = CharField(max_length=32, null=True)
+
+    class Meta:
+        database = db
+
+# Named counters; 'timeline' is bumped by every write to TimelinePost and
+# serves as the version of the timeline API responses
+class Counter(Model):
+    name = CharField(primary_key=True, max_length=64)
+    value = BigIntegerField(default=0)
+
+    class Meta:
+        database = db
+        table_name = 'counters'
+
+# Append-only log of timeline changes, relayed to /api/timeline_post/stream
+# subscribers; the id is the SSE event id
+class TimelineEvent(Model):
+    id = AutoField()
+    kind = CharField(max_length=16)
+    data = TextField()
 
     class Meta:
         database = db
+        table_name = 'timeline_events'
+
+# Manifest of archived months (see app/archive.py), next to the posts
+ArchiveSegment.bind(db)
+
+MODELS = [TimelinePost, Counter, TimelineEvent, ArchiveSegment]
+
+# Column order of the row tuples handed to app.serializers
+POST_COLUMNS = (TimelinePost.id, TimelinePost.name, TimelinePost.email,
+                TimelinePost.content, TimelinePost.created_at)
+
+def fetch_rows(query, database=None):
+    """Run a POST_COLUMNS select and return raw row tuples, skipping peewee's conversions."""
+    return list((database or query.model._meta.database).execute(query))
+
+def post_row(post):
+    return (post.id, post.name, post.email, post.content, post.created_at)
+
+def json_response(body, status=200):
+    return Response(body, status=status, mimetype='application/json')
+
+def timeline_version(database=None):
+    return Counter.select(Counter.value).where(Counter.name == 'timeline').scalar(database) or 0
+
+def bump_timeline_version():
+    """Record a change to the timeline; call it in the same transaction as the write."""
+    bump = Counter.update(value=Counter.value + 1).where(Counter.name == 'timeline')
+    if not bump.execute():
+        Counter.insert(name='timeline', value=0).on_conflict_ignore().execute()
+        bump.execute()
+
+# Events kept for clients resuming with Last-Event-ID; older ones are pruned
+EVENT_RETENTION = 10_000
+EVENT_PRUNE_EVERY = 1000
+
+def record_timeline_event(kind, data='{}'):
+    """Log a change for the SSE feed; call it in the same transaction as the write.
+
+    `kind` is 'created' or 'deleted' with the post (or its id) as JSON, or
+    'reset' when posts were written in bulk and clients should reload.
+    """
+    event_id = TimelineEvent.insert(kind=kind, data=data).execute()
+    if event_id % EVENT_PRUNE_EVERY == 0:
+        TimelineEvent.delete().where(TimelineEvent.id <= event_id - EVENT_RETENTION).execute()
+
+def latest_timeline_event_id(database=None):
+    return TimelineEvent.select(fn.MAX(TimelineEvent.id)).scalar(database) or 0
+
+def timeline_events_after(after_id, limit):
+    """Return up to `limit` (id, SSE frame) pairs for the events after `after_id`."""
+    query = (TimelineEvent.select(TimelineEvent.id, TimelineEvent.kind, TimelineEvent.data)
+             .where(TimelineEvent.id > after_id)
+             .order_by(TimelineEvent.id)
+             .limit(limit))
+    return [(event_id, sse_frame(event_id, kind, data))
+            for event_id, kind, data in query.tuples()]
+
+def poll_timeline_events(after_id, limit):
+    """Relay thread poll: hand the pooled connection back after each poll."""
+    close = db.is_closed()
+    try:
+        return timeline_events_after(after_id, limit)
+    finally:
+        if close:
+            db.close()
+
+# Replica lag heartbeat (epoch milliseconds), see app.replicas
+HEARTBEAT_COUNTER = 'replica_heartbeat'
+
+def write_replica_heartbeat(database, now):
+    Counter.replace(name=HEARTBEAT_COUNTER, value=int(now * 1000)).execute(database)
+
+def replica_state(database):
+    """A database's (timeline version, heartbeat) for the replica router."""
+    values = dict(Counter.select(Counter.name, Counter.value)
+                  .where(Counter.name.in_(['timeline', HEARTBEAT_COUNTER]))
+                  .tuples().execute(database))
+    heartbeat = values.get(HEARTBEAT_COUNTER)
+    return values.get('timeline', 0), heartbeat / 1000 if heartbeat is not None else None
+
+VERSION_ETAG_RE = re.compile(r'timeline-(?:page-)?(\d+)')
+
+def read_database():
+    """The database this request reads the timeline from.
+
+    A replica when one is configured and fresh enough for this client:
+    caught up with the client's last write and with the timeline version
+    its If-None-Match names. The choice sticks for the rest of the request.
+    """
+    router = current_app.extensions.get('replicas')
+    if router is None:
+        return db
+    if 'read_database' not in g:
+        versions = [int(v) for v in VERSION_ETAG_RE.findall(request.headers.get('If-None-Match', ''))]
+        g.read_database = router.reader(min_version=max(versions, default=None),
+                                        written_at=last_write_time(request))
+    return g.read_database
+
+def notify_timeline_subscribers():
+    relay = current_app.extensions.get('timeline_events')
+    if relay is not None:
+        relay.notify()
 
 # Initialize database connection
 def init_db():
     try:
-        db.connect()
-        db.create_tables([TimelinePost], safe=True)
-        print(f"Database connection successful: {db}")
+        with db.connection_context():
+            db.create_tables(MODELS, safe=True)
+            print(f"Database connection successful: {db.obj}")
+            applied = migrate(db)
+            if applied:
+                print(f"Applied migrations: {', '.join(applied)}")
     except Exception as e:
         print(f"Database connection failed: {e}")
+    # Don't leave an idle pooled connection behind for forked workers to share
+    if isinstance(db.obj, PooledDatabase):
+        db.close_idle()
 
-# Only initialize database if not in testing mode
-if os.getenv("TESTING") != "true":
-    init_db()
-
-# Rate limiting storage
-rate_limit_storage = {}
+@bp.cli.command('migrate')
+def migrate_command():
+    """Apply pending database migrations."""
+    db.create_tables(MODELS, safe=True)
+    applied = migrate(db)
+    print(f"Applied migrations: {', '.join(applied)}" if applied else "No pending migrations")
 
-# Ensure db connection per request
-@app.before_request
-def _db_connect():
-    if db.is_closed():
-        db.connect()
+@bp.cli.command('migrate-status')
+def migrate_status_command():
+    """Show which database migrations have been applied."""
+    for m in migration_status(db):
+        state = f"applied {m['applied_at']}" if m['applied_at'] else "pending"
+        print(f"{m['version']:>4}  {m['name']:<40} {state}")
 
-@app.teardown_request
+# Connections are checked out of the pool lazily by the first query a
+# handler runs (peewee autoconnect), so routes that never touch the database
+# never take one. Hand it back to the pool once the request is done.
+@bp.teardown_app_request
 def _db_close(exc):
-    if not db.is_closed():
+    # Closing an in-memory SQLite database (testing) would throw away its tables
+    if not db.is_closed() and db.database != ':memory:':
         db.close()
+    router = current_app.extensions.get('replicas')
+    if router is not None:
+        router.close()
+
+# Per-route latency, status and database query metrics for /metrics
+bp.before_app_request(start_request_timer)
+bp.after_app_request(record_request)
+# Read-your-own-writes cookie for replica reads
+bp.after_app_request(remember_write)
+
+@bp.before_app_request
+def _start_background_jobs():
+    for job in current_app.extensions.get('jobs', ()):
+        job.ensure_started()
 
 base_url = "/"
 
@@ -153,9 +351,9 @@ hobbies = [
 visited_locations = [
 ]
 
-@app.route('/')
+@bp.route('/')
 def index():
-    return render_template('index.html',
+    return render_cached('index.html',
                          title="MLH Fellow",
                          url=os.getenv("URL"),
                          name="JIAHONG LIN",
@@ -168,15 +366,15 @@ def index():
                          visited_locations=visited_locations
                          )
 
-@app.route('/hobbies')
+@bp.route('/hobbies')
 def hobbies_page():
-    return render_template('hobbies.html',
+    return render_cached('hobbies.html',
                          title="My Hobbies",
                          url=os.getenv("URL"),
                          hobbies=hobbies,
                          navigation=get_navigation('/hobbies'))
 
-@app.route('/map')
+@bp.route('/map')
 def map_page():
     return render_template('map.html',
                          title="Places I've Visited",
@@ -184,75 +382,975 @@ def map_page():
                          visited_locations=visited_locations,
                          navigation=get_navigation('/map'))
 
-@app.route('/timeline')
+@bp.route('/timeline')
+@replica_read
 def timeline_page():
-    return render_template('timeline.html',
-                         title="Timeline",
-                         url=os.getenv("URL"),
-                         navigation=get_navigation('/timeline'))
+    """Render the timeline with its first page of posts already in the HTML.
+
+    The script only fetches later pages. The page is cached per timeline
+    version like the API responses, and carries the newest event id so the
+    live stream picks up exactly where the rendered page ends.
+    """
+    database = read_database()
+    version = timeline_version(database)
+    etag = f'timeline-page-{version}'
+    if request.if_none_match.contains(etag):
+        return timeline_cache_headers(Response(status=304), etag)
+
+    body = None if current_app.jinja_env.auto_reload else timeline_cache.get(version, 'page')
+    if body is None:
+        # Read before the posts, so the stream replays anything newer
+        last_event_id = latest_timeline_event_id(database)
+        rows, next_cursor = timeline_page_query(DEFAULT_PAGE_SIZE, database=database,
+                                                archive=current_app.extensions.get('archive'))
+        posts = [{'id': post_id, 'name': name, 'email': email, 'content': content,
+                  'created_at': format_timestamp(created_at)}
+                 for post_id, name, email, content, created_at in rows]
+        body = render_template('timeline.html',
+                               title="Timeline",
+                               url=os.getenv("URL"),
+                               navigation=get_navigation('/timeline'),
+                               posts=posts,
+                               next_cursor=next_cursor,
+                               page_size=DEFAULT_PAGE_SIZE,
+                               last_event_id=last_event_id).encode()
+        timeline_cache.put(version, 'page', body)
+    return timeline_cache_headers(Response(body, mimetype='text/html'), etag)
+
+# Column limits: VARCHAR(255) counts characters, MySQL's TEXT holds 65535 bytes
+NAME_MAX_LENGTH = TimelinePost.name.max_length
+EMAIL_MAX_LENGTH = TimelinePost.email.max_length
+CONTENT_MAX_BYTES = 65535
+
+def validate_post(name, email, content):
+    """Return an error message for an invalid post, or None if it is valid."""
+    if not isinstance(name, str) or name.strip() == '':
+        return 'Invalid name'
+    if len(name) > NAME_MAX_LENGTH:
+        return f'Name is too long (at most {NAME_MAX_LENGTH} characters)'
+    
+    if not isinstance(content, str) or content.strip() == '':
+        return 'Invalid content'
+    if len(content.encode()) > CONTENT_MAX_BYTES:
+        return f'Content is too long (at most {CONTENT_MAX_BYTES} bytes)'
+    
+    # Basic email validation
+    if not isinstance(email, str) or '@' not in email or '.' not in email.split('@')[-1]:
+        return 'Invalid email'
+    if len(email) > EMAIL_MAX_LENGTH:
+        return f'Email is too long (at most {EMAIL_MAX_LENGTH} characters)'
+    return None
+
+def post_content_hash(email, content):
+    return hashlib.sha256(f"{email}\0{content}".encode()).hexdigest()
+
+def recent_duplicate(content_hash):
+    """Id of a live post with this hash from the last TIMELINE_DUPLICATE_WINDOW seconds, or None."""
+    window = current_app.config['TIMELINE_DUPLICATE_WINDOW']
+    if not window:
+        return None
+    since = datetime.datetime.now() - datetime.timedelta(seconds=window)
+    return (TimelinePost.select(TimelinePost.id)
+            .where((TimelinePost.content_hash == content_hash)
+                   & (TimelinePost.created_at >= since)
+                   & TimelinePost.deleted_at.is_null())
+            .order_by(TimelinePost.created_at.desc())
+            .limit(1)
+            .scalar())
+
+def duplicate_response(post_id):
+    metrics.inc('timeline_duplicate_posts_total')
+    return jsonify({'error': 'This post was already submitted', 'id': post_id}), 409
 
 # POST endpoint to create a timeline post
-@app.route('/api/timeline_post', methods=['POST'])
+@bp.route('/api/timeline_post', methods=['POST'])
+@idempotent
+@rate_limit('timeline_post')
 def post_timeline_post():
-    # Rate limiting: 1 request per minute per IP (disabled during testing)
-    if os.getenv("TESTING") != "true":
-        global rate_limit_storage
-        client_ip = request.remote_addr
-        current_time = time.time()
-        
-        # Clean old entries (older than 1 minute)
-        rate_limit_storage = {ip: timestamp for ip, timestamp in rate_limit_storage.items() 
-                             if current_time - timestamp < 60}
-        
-        # Check if this IP has made a request in the last minute
-        if client_ip in rate_limit_storage:
-            return jsonify({
-                'error': 'Rate limit exceeded. Please wait 1 minute before making another request.',
-                'rate_limit': '1 request per minute'
-            }), 429
-        
-        # Record this request
-        rate_limit_storage[client_ip] = current_time
-    
     name = request.form.get('name')
     email = request.form.get('email')
     content = request.form.get('content')
     
     # Validate input
-    if not name or name.strip() == '':
-        return jsonify({'error': 'Invalid name'}), 400
+    error = validate_post(name, email, content)
+    if error:
+        return jsonify({'error': error}), 400
+    content_hash = post_content_hash(email, content)
     
-    if not content or content.strip() == '':
-        return jsonify({'error': 'Invalid content'}), 400
-    
-    # Basic email validation
-    if not email or '@' not in email or '.' not in email.split('@')[-1]:
-        return jsonify({'error': 'Invalid email'}), 400
-    
-    timeline_post = TimelinePost.create(
-        name=name,
-        email=email,
-        content=content
-    )
-    return model_to_dict(timeline_post), 201
+    write_queue = current_app.extensions.get('timeline_write_queue')
+    if write_queue is not None:
+        duplicate = recent_duplicate(content_hash)
+        if duplicate is not None:
+            return duplicate_response(duplicate)
+        return queue_timeline_post(write_queue, name, email, content, content_hash)
+
+    with db.atomic() as transaction:
+        # Bump first: the counter row lock makes concurrent posts queue up
+        # here, so the duplicate check below sees any twin that got in first
+        bump_timeline_version()
+        duplicate = recent_duplicate(content_hash)
+        if duplicate is not None:
+            transaction.rollback()
+            return duplicate_response(duplicate)
+        timeline_post = TimelinePost.create(
+            name=name,
+            email=email,
+            content=content,
+            content_hash=content_hash
+        )
+        body = post_json(post_row(timeline_post))
+        record_timeline_event('created', body)
+    notify_timeline_subscribers()
+    return json_response(body, 201)
+
+def queue_timeline_post(write_queue, name, email, content, content_hash):
+    """Write-behind mode: acknowledge the post now, insert it with the next batch.
+
+    The database id isn't known until the flush, so the response carries a
+    provisional id instead; it is stored with the post, and the Location
+    header points at where the post can be fetched once it is written.
+    Duplicates are only caught once the first copy has been flushed.
+    """
+    created_at = datetime.datetime.now()
+    provisional_id = uuid.uuid4().hex
+    try:
+        write_queue.submit({'name': name, 'email': email, 'content': content,
+                            'content_hash': content_hash, 'provisional_id': provisional_id,
+                            'created_at': created_at})
+    except QueueFull:
+        return jsonify({'error': 'Too many pending posts, please try again shortly'}), 503, {'Retry-After': '1'}
+    return jsonify({
+        'provisional_id': provisional_id,
+        'name': name,
+        'email': email,
+        'content': content,
+        'created_at': format_timestamp(created_at),
+    }), 202, {'Location': f'/api/timeline_post/provisional/{provisional_id}'}
+
+def write_queued_posts(posts):
+    """Flush callback for the write-behind queue."""
+    with db.connection_context():
+        insert_queued_posts(posts)
+
+def insert_queued_posts(posts):
+    """Insert a batch of queued posts with one multi-row INSERT; returns how many were written.
+
+    If the database rejects the batch, it is retried row by row and only
+    the offending posts are dropped, so one bad row doesn't cost the whole
+    batch. Other errors (a lost connection) are left to the queue's retries.
+    """
+    try:
+        with db.atomic():
+            TimelinePost.insert_many(posts).execute()
+            # Ids of a multi-row insert aren't known portably; the
+            # provisional ids find the rows again for the events
+            rows = fetch_rows(TimelinePost.select(*POST_COLUMNS)
+                              .where(TimelinePost.provisional_id.in_([post['provisional_id'] for post in posts]))
+                              .order_by(TimelinePost.id))
+            bump_timeline_version()
+            for row in rows:
+                record_timeline_event('created', post_json(row))
+        return len(posts)
+    except (IntegrityError, DataError):
+        pass
+
+    written = 0
+    for post in posts:
+        try:
+            with db.atomic():
+                timeline_post = TimelinePost.create(**post)
+                bump_timeline_version()
+                record_timeline_event('created', post_json(post_row(timeline_post)))
+            written += 1
+        except (IntegrityError, DataError) as e:
+            metrics.inc('timeline_write_behind_rejected_total')
+            print(f"Write-behind dropped post {post['provisional_id']}: {e}")
+    return written
+
+# Pagination defaults for the timeline API
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(created_at, post_id):
+    raw = f"{created_at.isoformat()}|{post_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
 
-# GET endpoint to retrieve all timeline posts
-@app.route('/api/timeline_post', methods=['GET'])
+def decode_cursor(cursor):
+    """Turn an opaque cursor back into a (created_at, id) pair."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, post_id = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.datetime.fromisoformat(created_at), int(post_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def keyset_rows(model, limit, before=None, after=None, database=None):
+    """Up to `limit` live raw rows of `model` past a cursor: newest first, or oldest first with `after`.
+
+    Pages are keyed on (created_at, id) instead of OFFSET, so the database
+    seeks straight to the cursor and deep pages cost the same as the first.
+    The leading created_at bound is redundant but lets the
+    (created_at, id) index range-scan instead of evaluating the OR per row.
+    `model` is TimelinePost or one of its monthly archive tables.
+    """
+    query = model.select(model.id, model.name, model.email, model.content, model.created_at)
+    query = query.where(model.deleted_at.is_null())
+    if after is not None:
+        created_at, post_id = after
+        query = query.where(
+            (model.created_at >= created_at) &
+            ((model.created_at > created_at) | (model.id > post_id))
+        ).order_by(model.created_at.asc(), model.id.asc())
+    else:
+        if before is not None:
+            created_at, post_id = before
+            query = query.where(
+                (model.created_at <= created_at) &
+                ((model.created_at < created_at) | (model.id < post_id))
+            )
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+    return fetch_rows(query.limit(limit), database)
+
+def timeline_page_query(limit, before=None, after=None, database=None, archive=None):
+    """Return one page of raw post rows (newest first) and the next cursor.
+
+    With an `archive`, pages that run past the hot table (or start from a
+    cursor older than it) continue into the archived months.
+    `next_cursor` continues in the direction of the request and is None once
+    there are no more posts.
+    """
+    # Fetch one extra row to know whether another page exists
+    posts = keyset_rows(TimelinePost, limit + 1, before, after, database)
+    if archive is not None:
+        posts = archive.extend_page(posts, limit + 1, before, after, database)
+    has_more = len(posts) > limit
+    posts = posts[:limit]
+    next_cursor = encode_cursor(parse_timestamp(posts[-1][4]), posts[-1][0]) if has_more else None
+    if after is not None:
+        posts.reverse()
+    return posts, next_cursor
+
+def parse_page_args(args):
+    """Validate the limit/before/after query parameters."""
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('Invalid limit')
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f'Invalid limit, must be between 1 and {MAX_PAGE_SIZE}')
+
+    before = args.get('before')
+    after = args.get('after')
+    if before and after:
+        raise ValueError('Use either before or after, not both')
+    return (limit,
+            decode_cursor(before) if before else None,
+            decode_cursor(after) if after else None)
+
+# Serialized timeline pages, reused until the timeline version changes
+timeline_cache = ResponseCache(max_entries=256)
+
+def timeline_cache_headers(response, etag):
+    response.set_etag(etag)
+    max_age = current_app.config['TIMELINE_CACHE_MAX_AGE']
+    if max_age:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+# GET endpoint to retrieve a page of timeline posts
+@bp.route('/api/timeline_post', methods=['GET'])
+@replica_read
 def get_timeline_post():
-    posts = TimelinePost.select().order_by(TimelinePost.created_at.desc())
-    return jsonify([model_to_dict(post) for post in posts])
+    try:
+        limit, before, after = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # One primary-key lookup decides whether the client (or our cache) is current
+    database = read_database()
+    version = timeline_version(database)
+    etag = f'timeline-{version}'
+    if request.if_none_match.contains(etag):
+        return timeline_cache_headers(Response(status=304), etag)
+
+    key = (limit, before, after)
+    cached = timeline_cache.get(version, key)
+    if cached is None:
+        posts, next_cursor = timeline_page_query(limit, before=before, after=after, database=database,
+                                                 archive=current_app.extensions.get('archive'))
+        headers = {}
+        if next_cursor:
+            direction = 'after' if after else 'before'
+            headers['X-Next-Cursor'] = next_cursor
+            headers['Link'] = f'</api/timeline_post?limit={limit}&{direction}={next_cursor}>; rel="next"'
+        cached = (posts_json(posts).encode(), headers)
+        timeline_cache.put(version, key, cached)
+
+    body, headers = cached
+    response = json_response(body)
+    response.headers.extend(headers)
+    return timeline_cache_headers(response, etag)
+
+# GET endpoint for a single post, archived or not
+@bp.route('/api/timeline_post/<int:post_id>', methods=['GET'])
+@replica_read
+def get_timeline_post_by_id(post_id):
+    database = read_database()
+    rows = fetch_rows(TimelinePost.select(*POST_COLUMNS)
+                      .where((TimelinePost.id == post_id) & TimelinePost.deleted_at.is_null()), database)
+    archive = current_app.extensions.get('archive')
+    row = rows[0] if rows else archive.get(post_id, database) if archive is not None else None
+    if row is None:
+        return jsonify({'error': f'Timeline post with ID {post_id} not found'}), 404
+    return json_response(post_json(row))
+
+# GET endpoint for a post accepted in write-behind mode, by its provisional id.
+# Read from the primary: the client usually asks right after posting
+@bp.route('/api/timeline_post/provisional/<provisional_id>', methods=['GET'])
+def get_timeline_post_by_provisional_id(provisional_id):
+    rows = fetch_rows(TimelinePost.select(*POST_COLUMNS)
+                      .where((TimelinePost.provisional_id == provisional_id)
+                             & TimelinePost.deleted_at.is_null()))
+    if not rows:
+        # Most likely still queued; a provisional id that was never handed
+        # out looks the same
+        return jsonify({'error': 'Timeline post not written yet'}), 404, {'Retry-After': '1'}
+    return json_response(post_json(rows[0]))
+
+# Search results are offset-paginated (ranks aren't a stable keyset) and
+# only the newest RANK_WINDOW matches are ranked, so offsets stop there
+MAX_SEARCH_OFFSET = RANK_WINDOW
+
+def parse_search_args(args):
+    """Validate the q/limit/offset query parameters."""
+    q = args.get('q', '').strip()
+    if not q:
+        raise ValueError('Missing search query')
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+        offset = int(args.get('offset', 0))
+    except ValueError:
+        raise ValueError('Invalid limit or offset')
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f'Invalid limit, must be between 1 and {MAX_PAGE_SIZE}')
+    if offset < 0 or offset > MAX_SEARCH_OFFSET:
+        raise ValueError(f'Invalid offset, must be between 0 and {MAX_SEARCH_OFFSET}')
+    return q, limit, offset
+
+# GET endpoint for ranked full-text search over post names and content
+@bp.route('/api/timeline_post/search', methods=['GET'])
+@replica_read
+def search_timeline_posts():
+    try:
+        q, limit, offset = parse_search_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    database = read_database()
+    version = timeline_version(database)
+    etag = f'timeline-{version}'
+    if request.if_none_match.contains(etag):
+        return timeline_cache_headers(Response(status=304), etag)
+
+    key = ('search', q, limit, offset)
+    cached = timeline_cache.get(version, key)
+    if cached is None:
+        # Fetch one extra row to know whether another page exists
+        posts = search_posts(database, q, limit + 1, offset)
+        headers = {}
+        if len(posts) > limit:
+            next_offset = offset + limit
+            headers['X-Next-Offset'] = str(next_offset)
+            headers['Link'] = (f'</api/timeline_post/search?{urlencode({"q": q, "limit": limit, "offset": next_offset})}>; '
+                               'rel="next"')
+        cached = (posts_json(posts[:limit]).encode(), headers)
+        timeline_cache.put(version, key, cached)
+
+    body, headers = cached
+    response = json_response(body)
+    response.headers.extend(headers)
+    return timeline_cache_headers(response, etag)
+
+# Live feed of created/deleted posts as Server-Sent Events. Every open stream
+# holds a server thread, so streams are capped per process and end after
+# TIMELINE_STREAM_MAX_SECONDS; browsers reconnect on their own and resume
+# from the Last-Event-ID they saw last. A stream refused for the cap is still
+# a 200 event stream (EventSource gives up for good on an error status): it
+# tells the browser to come back in STREAM_BUSY_RETRY_MS and sends a `busy`
+# event, on which the page polls instead.
+RESUME_LIMIT = 500
+STREAM_RETRY_MS = 3000
+STREAM_BUSY_RETRY_MS = 30000
+
+@bp.route('/api/timeline_post/stream', methods=['GET'])
+def stream_timeline_posts():
+    relay = current_app.extensions['timeline_events']
+    config = current_app.config
+    if len(relay) >= config['TIMELINE_STREAM_MAX_SUBSCRIBERS']:
+        metrics.inc('timeline_stream_refused_total')
+        # No id: the browser keeps the Last-Event-ID it had for the retry
+        response = Response(f'retry: {STREAM_BUSY_RETRY_MS}\n\nevent: busy\ndata: {{}}\n\n',
+                            mimetype='text/event-stream')
+        response.cache_control.no_cache = True
+        return response
+    heartbeat = config['TIMELINE_STREAM_HEARTBEAT']
+    max_seconds = config['TIMELINE_STREAM_MAX_SECONDS']
+
+    head = latest_timeline_event_id()
+    subscriber = relay.subscribe(head)
+    backlog = []
+    # EventSource can't send headers on its first connection, so the page
+    # passes the id it was rendered at as ?last_event_id=
+    try:
+        resume_from = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id', ''))
+    except ValueError:
+        resume_from = None
+    if resume_from is not None and resume_from < head:
+        backlog = [event for event in timeline_events_after(resume_from, RESUME_LIMIT)
+                   if event[0] <= head]
+        if not backlog or backlog[0][0] != resume_from + 1 or backlog[-1][0] != head:
+            # Too far behind, or the events were pruned: start over
+            backlog = [(head, sse_frame(head, 'reset', '{}'))]
+
+    def stream():
+        try:
+            yield f'retry: {STREAM_RETRY_MS}\n\n' + ''.join(frame for _, frame in backlog)
+            deadline = time.monotonic() + max_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                frame = subscriber.next_frame(min(heartbeat, remaining))
+                # Comments keep proxies from timing the connection out
+                yield frame if frame is not None else ': keepalive\n\n'
+        finally:
+            relay.unsubscribe(subscriber)
+
+    response = Response(stream(), mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    # Don't let nginx buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 # DELETE endpoint to delete a timeline post by id
-@app.route('/api/timeline_post/<int:post_id>', methods=['DELETE'])
+@bp.route('/api/timeline_post/<int:post_id>', methods=['DELETE'])
 def delete_timeline_post(post_id):
     try:
-        post = TimelinePost.get(TimelinePost.id == post_id)
-        post.delete_instance()
+        deleted = delete_posts('deleted', json.dumps({'id': post_id}), ids=[post_id])
+        if not deleted:
+            return jsonify({'error': f'Timeline post with ID {post_id} not found'}), 404
+        notify_timeline_subscribers()
         return jsonify({'message': f'Timeline post {post_id} deleted successfully'}), 200
-    except TimelinePost.DoesNotExist:
-        return jsonify({'error': f'Timeline post with ID {post_id} not found'}), 404
     except Exception as e:
         return jsonify({'error': f'Failed to delete timeline post: {str(e)}'}), 500
 
+def soft_delete_posts(condition):
+    """Tombstone the live posts matching `condition` in one UPDATE; returns how many."""
+    return (TimelinePost.update(deleted_at=datetime.datetime.now())
+            .where(condition & TimelinePost.deleted_at.is_null())
+            .execute())
+
+def delete_posts(event, data='{}', ids=None, email=None):
+    """Delete posts by id or by author, archived ones included; returns how many.
+
+    Archived posts are removed for good first, one segment at a time; the
+    hot table's tombstones then commit with the version bump and `event`.
+    """
+    archive = current_app.extensions.get('archive')
+    removed = len(archive.delete(ids, email)) if archive is not None else 0
+    condition = TimelinePost.id.in_(ids) if ids is not None else TimelinePost.email == email
+    with db.atomic():
+        # One statement: a missing or already deleted post matches no row
+        deleted = soft_delete_posts(condition) + removed
+        if deleted:
+            bump_timeline_version()
+            record_timeline_event(event, data)
+    return deleted
+
+MAX_BULK_DELETE_IDS = 1000
+
+def parse_bulk_delete(body):
+    """Turn a {"ids": [...]} or {"email": "..."} body into (ids, email), or raise ValueError."""
+    if not isinstance(body, dict) or ('ids' in body) == ('email' in body):
+        raise ValueError('Expected a JSON object with either ids or email')
+    if 'ids' in body:
+        ids = body['ids']
+        if (not isinstance(ids, list) or not ids
+                or not all(isinstance(post_id, int) and not isinstance(post_id, bool) for post_id in ids)):
+            raise ValueError('ids must be a non-empty list of post ids')
+        if len(ids) > MAX_BULK_DELETE_IDS:
+            raise ValueError(f'At most {MAX_BULK_DELETE_IDS} ids per request')
+        return ids, None
+    email = body['email']
+    if not isinstance(email, str) or not email.strip():
+        raise ValueError('Invalid email')
+    return None, email.strip()
+
+# POST endpoint for moderation: delete a list of posts, or everything one
+# address has posted, in a single statement on the hot table (archived
+# months are searched segment by segment)
+@bp.route('/api/timeline_post/bulk_delete', methods=['POST'])
+@admin_required
+def bulk_delete_timeline_posts():
+    try:
+        ids, email = parse_bulk_delete(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    deleted = delete_posts('reset', ids=ids, email=email)
+    if deleted:
+        notify_timeline_subscribers()
+    return jsonify({'deleted': deleted}), 200
+
+# Tombstones are kept TIMELINE_PURGE_AFTER_DAYS (deletes can be undone by
+# hand until then) and removed in small batches with a pause in between, so
+# no transaction holds row locks (or stalls replicas) for long
+PURGE_BATCH_SIZE = 500
+PURGE_PAUSE = 0.1
+
+def purge_deleted_posts(older_than, batch_size=PURGE_BATCH_SIZE, pause=PURGE_PAUSE, sleep=time.sleep):
+    """Physically delete posts soft-deleted before `older_than`; returns how many."""
+    purged = 0
+    while True:
+        with db.atomic():
+            # Range scan on the deleted_at index, then a primary-key delete
+            # that locks exactly these rows
+            ids = [post_id for post_id, in TimelinePost.select(TimelinePost.id)
+                   .where(TimelinePost.deleted_at < older_than)
+                   .order_by(TimelinePost.deleted_at)
+                   .limit(batch_size)
+                   .tuples()]
+            if ids:
+                TimelinePost.delete().where(TimelinePost.id.in_(ids)).execute()
+        purged += len(ids)
+        if len(ids) < batch_size:
+            return purged
+        sleep(pause)
+
+def purge_expired_posts(after_days, **kwargs):
+    """Purge posts deleted more than `after_days` days ago (CLI and background job)."""
+    close = db.is_closed()
+    try:
+        return purge_deleted_posts(datetime.datetime.now() - datetime.timedelta(days=after_days), **kwargs)
+    finally:
+        if close:
+            db.close()
+
+# Exports walk the table in id order, one bounded keyset query per chunk,
+# so memory stays flat however big the table is and any export can be
+# resumed from the last id it wrote. Archived months are merged in by id,
+# each segment read once the export reaches its lowest id
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+def iter_hot_posts(after_id=0, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the hot table's live raw post rows in id order, starting after `after_id`."""
+    while True:
+        rows = fetch_rows(TimelinePost.select(*POST_COLUMNS)
+                          .where((TimelinePost.id > after_id) & TimelinePost.deleted_at.is_null())
+                          .order_by(TimelinePost.id)
+                          .limit(chunk_size))
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after_id = rows[-1][0]
+
+def iter_post_chunks(after_id=0, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield lists of raw post rows in id order, archived ones included, starting after `after_id`."""
+    sources = [(after_id + 1, lambda: iter_hot_posts(after_id, chunk_size))]
+    archive = current_app.extensions.get('archive')
+    if archive is not None:
+        sources += archive.export_sources(after_id)
+    yield from chunked(merge_by_id(sources), chunk_size)
+
+def export_posts(fmt, after_id=0, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the export as text chunks in NDJSON or CSV.
+
+    The CSV header is only written when starting from the beginning, so a
+    resumed export can be appended to the first one.
+    """
+    header = fmt == 'csv' and after_id == 0
+    for rows in iter_post_chunks(after_id, chunk_size):
+        if fmt == 'csv':
+            yield posts_csv(rows, header=header)
+            header = False
+        else:
+            yield posts_ndjson(rows)
+    if header:
+        yield posts_csv([], header=True)
+
+# GET endpoint streaming every timeline post for backups and analytics
+@bp.route('/api/timeline_post/export', methods=['GET'])
+@admin_required
+def export_timeline_posts():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"Invalid format, must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        after_id = int(request.args.get('after_id', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid after_id'}), 400
+    # stream_with_context keeps the request (and its pooled connection) open
+    # until the last chunk has been sent
+    response = Response(stream_with_context(export_posts(fmt, after_id)),
+                        mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=timeline_posts.{fmt}'
+    return response
+
+@bp.cli.group('timeline')
+def timeline_cli():
+    """Manage timeline posts."""
+
+@timeline_cli.command('export')
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson')
+@click.option('--output', '-o', type=click.File('w'), default='-', help='File to write (default: stdout).')
+@click.option('--after-id', type=int, default=0, help='Resume after this post id.')
+@click.option('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+def export_command(fmt, output, after_id, chunk_size):
+    """Export timeline posts as NDJSON or CSV."""
+    for chunk in export_posts(fmt, after_id, chunk_size):
+        output.write(chunk)
+
+@timeline_cli.command('purge')
+@click.option('--after-days', type=float, default=None,
+              help='Purge posts deleted longer ago than this (default: TIMELINE_PURGE_AFTER_DAYS).')
+@click.option('--batch-size', type=int, default=PURGE_BATCH_SIZE)
+@click.option('--pause-ms', type=int, default=int(PURGE_PAUSE * 1000), help='Pause between batches.')
+def purge_command(after_days, batch_size, pause_ms):
+    """Permanently remove soft-deleted timeline posts."""
+    if after_days is None:
+        after_days = current_app.config['TIMELINE_PURGE_AFTER_DAYS']
+    purged = purge_expired_posts(after_days, batch_size=batch_size, pause=pause_ms / 1000)
+    click.echo(f"Purged {purged} deleted posts")
+
+@timeline_cli.group('archive')
+def archive_cli():
+    """Move old posts out of the hot table (see app/archive.py)."""
+
+@archive_cli.command('run')
+@click.option('--after-days', type=float, default=None,
+              help='Archive whole months older than this (default: TIMELINE_ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+@click.option('--pause-ms', type=int, default=int(ARCHIVE_PAUSE * 1000), help='Pause between batches.')
+def archive_run_command(after_days, batch_size, pause_ms):
+    """Archive every month before the cutoff, oldest first."""
+    archive = current_app.extensions['archive']
+    if after_days is not None:
+        archive.after_days = after_days
+    click.echo(f"Archiving posts before {archive.cutoff():%Y-%m-%d} ({archive.backend.name})")
+    moved = archive.run(batch_size=batch_size, pause=pause_ms / 1000)
+    for month, count in moved.items():
+        click.echo(f"{month}  {count} posts")
+    click.echo(f"Archived {sum(moved.values())} posts")
+
+@archive_cli.command('verify')
+def archive_verify_command():
+    """Check every archived month against the manifest."""
+    failed = 0
+    for month, rows, problems in current_app.extensions['archive'].verify():
+        click.echo(f"{month}  {rows:>8} posts  {'; '.join(problems) if problems else 'ok'}")
+        failed += bool(problems)
+    if failed:
+        raise click.ClickException(f"{failed} archived months failed verification")
+
+@archive_cli.command('status')
+def archive_status_command():
+    """List the archived months."""
+    for segment in current_app.extensions['archive'].segments():
+        click.echo(f"{segment.month}  {segment.rows:>8} posts  ids {segment.min_id}-{segment.max_id}  "
+                   f"{segment.backend}  archived {segment.archived_at:%Y-%m-%d %H:%M}")
+
+# Bulk imports validate every row like post_timeline_post does, then insert
+# the valid ones with insert_many, one transaction per batch
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+def parse_import_line(line):
+    """Turn one NDJSON line into insert_many row data, or raise ValueError."""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise ValueError('Invalid JSON')
+    if not isinstance(record, dict):
+        raise ValueError('Expected a JSON object')
+    error = validate_post(record.get('name'), record.get('email'), record.get('content'))
+    if error:
+        raise ValueError(error)
+
+    created_at = record.get('created_at')
+    try:
+        created_at = datetime.datetime.fromisoformat(created_at) if created_at else datetime.datetime.now()
+    except (TypeError, ValueError):
+        raise ValueError('Invalid created_at')
+    return {'name': record['name'], 'email': record['email'], 'content': record['content'],
+            'content_hash': post_content_hash(record['email'], record['content']), 'created_at': created_at}
+
+class ImportErrors:
+    """Counts failed lines, keeping only the first MAX_REPORTED_ERRORS of them."""
+
+    def __init__(self):
+        self.failed = 0
+        self.reported = []
+
+    def add(self, line_number, error):
+        self.failed += 1
+        if len(self.reported) < MAX_REPORTED_ERRORS:
+            self.reported.append({'line': line_number, 'error': error})
+
+def insert_batch(batch, errors):
+    """Insert (line_number, row) pairs in one transaction and return the rows inserted.
+
+    If the database rejects the batch (e.g. a value too long for its column),
+    it is retried row by row so only the offending rows are reported.
+    """
+    try:
+        with db.atomic():
+            TimelinePost.insert_many([row for _, row in batch]).execute()
+            bump_timeline_version()
+        return len(batch)
+    except DatabaseError:
+        pass
+
+    inserted = 0
+    for line_number, row in batch:
+        try:
+            with db.atomic():
+                TimelinePost.insert(row).execute()
+                bump_timeline_version()
+            inserted += 1
+        except DatabaseError as e:
+            errors.add(line_number, f'Database error: {e}')
+    return inserted
+
+def import_posts(lines, batch_size=IMPORT_BATCH_SIZE, archive=None):
+    """Import posts from NDJSON lines (str or bytes).
+
+    Posts dated within or before the newest archived month are moved on
+    into `archive` (an Archive, if given), so the timeline stays in order.
+    Returns (inserted, failed, errors); `errors` lists the line number and
+    reason for up to MAX_REPORTED_ERRORS failed lines.
+    """
+    inserted = 0
+    errors = ImportErrors()
+    batch = []
+    for line_number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        if not line.strip():
+            continue
+        try:
+            batch.append((line_number, parse_import_line(line)))
+        except ValueError as e:
+            errors.add(line_number, str(e))
+        if len(batch) >= batch_size:
+            inserted += insert_batch(batch, errors)
+            batch = []
+    if batch:
+        inserted += insert_batch(batch, errors)
+    if inserted and archive is not None:
+        archive.catch_up(pause=0)
+
+    if inserted:
+        with db.atomic():
+            record_timeline_event('reset')
+
+    return inserted, errors.failed, errors.reported
+
+# POST endpoint to import many timeline posts from an NDJSON body
+@bp.route('/api/timeline_post/bulk', methods=['POST'])
+@admin_required
+def bulk_import_timeline_posts():
+    inserted, failed, errors = import_posts(request.stream, archive=current_app.extensions.get('archive'))
+    return jsonify({'inserted': inserted, 'failed': failed, 'errors': errors}), 200
+
+@timeline_cli.command('import')
+@click.argument('source', type=click.File('r'))
+@click.option('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+def import_command(source, batch_size):
+    """Import timeline posts from an NDJSON file ('-' for stdin)."""
+    inserted, failed, errors = import_posts(source, batch_size, archive=current_app.extensions.get('archive'))
+    for error in errors:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Imported {inserted} posts, {failed} failed")
+
+# Fingerprinted static files, cached by browsers for a year (see app/assets.py)
+@bp.route('/assets/<path:filename>')
+def fingerprinted_asset(filename):
+    return serve_asset(filename)
+
+@bp.cli.group('images')
+def images_cli():
+    """Responsive image variants."""
+
+@images_cli.command('build')
+def build_images_command():
+    """Encode missing or outdated image variants under app/static/_variants."""
+    encoded = current_app.extensions['images'].build()
+    current_app.extensions['assets'].refresh()
+    click.echo(f"Encoded {encoded} image variants")
+
+@images_cli.command('report')
+def images_report_command():
+    """Show the image bytes each page costs with and without the variants."""
+    images = current_app.extensions['images']
+    client = current_app.test_client()
+    labels = [label for label, _, _, _ in REPORT_VIEWPORTS]
+    click.echo(f"{'page':<12}{'original':>12}" + ''.join(f'{label:>22}' for label in labels))
+    for path in ('/', '/hobbies', '/timeline'):
+        original, downloaded = page_savings(client.get(path).get_data(as_text=True), images)
+        columns = ''.join(f'{downloaded[label]:>12} (-{original - downloaded[label]:>7})'
+                          for label in labels)
+        click.echo(f'{path:<12}{original:>12}{columns}')
+
+# GET endpoint exposing connection pool occupancy and wait times
+@bp.route('/api/db_pool', methods=['GET'])
+def get_db_pool_stats():
+    if not hasattr(db, 'pool_stats'):
+        return jsonify({'error': 'Database connection pooling is not enabled'}), 404
+    return jsonify(db.pool_stats())
+
+# Prometheus scrape endpoint (metrics of this worker process)
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# GET endpoint exposing write-behind queue depth and flush latency
+@bp.route('/api/timeline_post/queue', methods=['GET'])
+def get_write_queue_stats():
+    write_queue = current_app.extensions.get('timeline_write_queue')
+    if write_queue is None:
+        return jsonify({'error': 'Write-behind mode is not enabled'}), 404
+    return jsonify(write_queue.stats())
+
+def create_app():
+    """Application factory.
+
+    Importing the package has no side effects: loading .env, choosing the
+    database and running migrations all happen here. Under gunicorn with
+    preload_app this runs once in the master before the workers fork, and
+    init_db() hands back its connections so no worker inherits a socket.
+    """
+    load_dotenv()
+    app = Flask(__name__)
+    testing = os.getenv("TESTING") == "true"
+    # Seconds browsers may reuse a timeline API response without revalidating
+    app.config['TIMELINE_CACHE_MAX_AGE'] = int(os.getenv("TIMELINE_CACHE_MAX_AGE", "0"))
+    # Bearer token for the admin endpoints; they are disabled when unset
+    app.config['ADMIN_TOKEN'] = os.getenv("ADMIN_TOKEN")
+
+    # Resized image variants first (cached on disk), so they get fingerprinted
+    # with the rest of app/static
+    app.extensions['images'] = ImageVariants(app.static_folder)
+    app.extensions['images'].build()
+    app.jinja_env.globals['responsive_image'] = responsive_image
+
+    # Hash and precompress app/static, and refuse to start if a template
+    # points at a file that isn't there
+    app.extensions['assets'] = AssetManifest(app.static_folder)
+    app.jinja_env.globals['asset_url'] = asset_url
+    check_templates(app.jinja_env, app.extensions['assets'])
+
+    if db.obj is None:
+        db.initialize(make_database())
+    # Only initialize database if not in testing mode
+    if not testing:
+        init_db()
+
+    # Read replicas: the timeline and search endpoints read from one that is
+    # no more than REPLICA_MAX_LAG seconds behind, falling back to the primary
+    router = make_replica_router()
+    if router is not None:
+        app.extensions['replicas'] = router
+
+    # gzip/brotli for text responses of at least COMPRESSION_MIN_SIZE bytes
+    if os.getenv("RESPONSE_COMPRESSION", "true") == "true":
+        app.wsgi_app = CompressionMiddleware(app.wsgi_app,
+                                             min_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")))
+
+    # Trust X-Forwarded-For from this many proxies in front of the app (nginx)
+    trusted_proxies = int(os.getenv("TRUSTED_PROXY_COUNT", "0"))
+    if trusted_proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)
+
+    # Rate limiting: 1 request per minute per client by default (disabled during testing)
+    # RATE_LIMIT_BACKEND=mmap or database makes all workers share the same counters
+    rate_limit_backend = backend_from_env(db)
+    app.extensions['rate_limiters'] = {
+        'timeline_post': RateLimiter.from_env('timeline_post', '1/minute',
+                                              backend=rate_limit_backend,
+                                              enabled=not testing),
+    }
+
+    # A repeated Idempotency-Key gets the stored response for IDEMPOTENCY_TTL
+    # seconds; IDEMPOTENCY_BACKEND=database shares the keys between workers.
+    # Independently, the same (email, content) posted again within
+    # TIMELINE_DUPLICATE_WINDOW seconds is rejected (0 turns that off).
+    app.extensions['idempotency'] = IdempotencyKeys(idempotency_backend_from_env(db),
+                                                    ttl=float(os.getenv("IDEMPOTENCY_TTL", "86400")))
+    app.config['TIMELINE_DUPLICATE_WINDOW'] = float(os.getenv("TIMELINE_DUPLICATE_WINDOW", "300"))
+
+    # Write-behind mode: POSTs are queued and inserted in batches by a
+    # background thread (started on first use, so never in a preloading master)
+    if os.getenv("TIMELINE_WRITE_BEHIND") == "true":
+        app.extensions['timeline_write_queue'] = WriteBehindQueue(
+            write_queued_posts,
+            max_size=int(os.getenv("TIMELINE_QUEUE_MAX_SIZE", "10000")),
+            batch_size=int(os.getenv("TIMELINE_FLUSH_ROWS", "500")),
+            flush_interval=int(os.getenv("TIMELINE_FLUSH_INTERVAL_MS", "50")) / 1000,
+        )
+
+    # SSE feed: one relay thread per process polls timeline_events while
+    # streams are open
+    app.config['TIMELINE_STREAM_MAX_SUBSCRIBERS'] = int(os.getenv("TIMELINE_STREAM_MAX_SUBSCRIBERS", "2"))
+    app.config['TIMELINE_STREAM_HEARTBEAT'] = float(os.getenv("TIMELINE_STREAM_HEARTBEAT", "15"))
+    app.config['TIMELINE_STREAM_MAX_SECONDS'] = float(os.getenv("TIMELINE_STREAM_MAX_SECONDS", "300"))
+    app.extensions['timeline_events'] = EventRelay(
+        poll_timeline_events,
+        interval=float(os.getenv("TIMELINE_STREAM_POLL_INTERVAL", "1")),
+        max_pending=int(os.getenv("TIMELINE_STREAM_MAX_PENDING", "100")),
+    )
+
+    # Soft-deleted posts are purged after TIMELINE_PURGE_AFTER_DAYS, by
+    # `flask timeline purge` (cron) or every TIMELINE_PURGE_INTERVAL seconds
+    # in the background when that is set
+    app.config['TIMELINE_PURGE_AFTER_DAYS'] = float(os.getenv("TIMELINE_PURGE_AFTER_DAYS", "7"))
+    app.extensions['jobs'] = []
+    purge_interval = float(os.getenv("TIMELINE_PURGE_INTERVAL", "0"))
+    if purge_interval:
+        after_days = app.config['TIMELINE_PURGE_AFTER_DAYS']
+        app.extensions['jobs'].append(PeriodicJob(lambda: purge_expired_posts(after_days),
+                                                  purge_interval, name='timeline-purge'))
+
+    # Posts older than TIMELINE_ARCHIVE_AFTER_DAYS are moved to monthly archive
+    # tables (or NDJSON files in TIMELINE_ARCHIVE_DIR) by `flask timeline archive run`
+    if os.getenv("TIMELINE_ARCHIVE_BACKEND", "table") == "ndjson":
+        archive_backend = NdjsonBackend(os.getenv("TIMELINE_ARCHIVE_DIR", "archive"))
+    else:
+        archive_backend = TableBackend(db, keyset_rows)
+    app.extensions['archive'] = Archive(db, TimelinePost, archive_backend,
+                                        after_days=float(os.getenv("TIMELINE_ARCHIVE_AFTER_DAYS", "365")))
+
+    # Opt-in: PROFILE_SAMPLE_RATE of requests get their queries (and with
+    # PROFILE_CPROFILE=true a cProfile dump) written to PROFILE_DIR, and
+    # queries slower than SLOW_QUERY_MS are logged
+    Profiler.from_env().init_app(app)
+
+    # Point-in-time values reported alongside the counters on /metrics
+    metrics.gauge('db_pool_connections_in_use', 'Pooled database connections checked out.',
+                  lambda: db.pool_stats()['in_use'] if hasattr(db, 'pool_stats') else None)
+    metrics.gauge('timeline_stream_subscribers', 'Open /api/timeline_post/stream connections.',
+                  lambda: len(app.extensions['timeline_events']))
+    metrics.gauge('timeline_write_queue_depth', 'Posts waiting in the write-behind queue.',
+                  lambda: app.extensions['timeline_write_queue'].stats()['depth']
+                  if 'timeline_write_queue' in app.extensions else None)
+    metrics.gauge('db_replicas_usable', 'Read replicas within REPLICA_MAX_LAG and not marked down.',
+                  lambda: app.extensions['replicas'].usable()
+                  if 'replicas' in app.extensions else None)
+
+    app.register_blueprint(bp)
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5001, host='0.0.0.0')
+    create_app().run(debug=True, port=5001, host='0.0.0.0')
@@ -0,0 +1,541 @@
+import bisect
+import contextlib
+import datetime
+import fcntl
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from peewee import BigIntegerField, CharField, DateTimeField, IntegerField, Model, TextField, chunked
+from app.dbutil import lock_for_update
+from app.serializers import parse_timestamp, post_json, posts_ndjson
+
+# Monthly archival of old timeline posts.
+#
+# Posts older than TIMELINE_ARCHIVE_AFTER_DAYS are moved out of timelinepost,
+# one calendar month at a time, into either a table per month
+# (timelinepost_archive_YYYYMM, same columns) or a gzipped NDJSON segment per
+# month on disk (TIMELINE_ARCHIVE_DIR/timeline-YYYY-MM.ndjson.gz, the export
+# format). The hot table then only holds recent posts, so its indexes, the
+# search index and every listing stay small however old the site gets.
+#
+# Only whole months move, oldest first, so the hot table always covers one
+# contiguous stretch of time and each archived month is one segment. Every
+# segment has a row in timeline_archive_segments (the manifest) with its row
+# count, id range and checksum. Each batch is moved in one transaction:
+# rows are written to the archive, deleted from the hot table and counted
+# in the manifest together. NDJSON segments are appended to (one gzip member
+# per batch) before that transaction and the manifest records how many bytes
+# are committed, so a crashed run leaves at most a tail that readers ignore
+# and the next run truncates.
+#
+# Reads stay transparent: a page that runs past the end of the hot table, or
+# starts from a cursor older than it, carries on into the archived months,
+# single posts are looked up in the segment whose id range covers them, and
+# exports merge the segments into the hot table's id order. Search only
+# covers the hot table. Tombstoned posts are left for the purge rather than
+# archived.
+#
+# Deleting archived posts (by id or by author) removes them for good, with
+# the segment's manifest row updated in the same transaction; there is no
+# tombstone to undo. An NDJSON segment is rewritten to a staged file that
+# replaces the segment once the manifest has committed. Every change to a
+# segment holds its lock file, and a staged file left by a crash is renamed
+# into place or dropped, whichever the committed manifest agrees with.
+
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_PAUSE = 0.05
+# Decompressed NDJSON segments kept in memory per process
+SEGMENT_CACHE_SIZE = 4
+
+
+class ArchiveSegment(Model):
+    """Manifest entry for one archived month."""
+    month = CharField(primary_key=True, max_length=7)
+    backend = CharField(max_length=8)
+    rows = IntegerField(default=0)
+    min_id = IntegerField(null=True)
+    max_id = IntegerField(null=True)
+    # Sum of per-row hashes (mod 2**64), so every batch can add to it
+    checksum = CharField(max_length=16, default='0' * 16)
+    # NDJSON: bytes of the segment file that are committed
+    size = BigIntegerField(default=0)
+    archived_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = 'timeline_archive_segments'
+
+
+def month_of(moment):
+    return parse_timestamp(moment).strftime('%Y-%m')
+
+
+def month_bounds(month):
+    start = datetime.datetime.strptime(month, '%Y-%m')
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def row_hash(row):
+    return int(hashlib.sha256(post_json(row).encode()).hexdigest()[:16], 16)
+
+
+def add_checksum(checksum, rows, sign=1):
+    """Add the hashes of `rows` to a checksum, or take them out with sign=-1."""
+    total = int(checksum, 16) + sign * sum(map(row_hash, rows))
+    return f'{total % 2 ** 64:016x}'
+
+
+def merge_by_id(sources):
+    """Merge row iterators that are each in id order into one.
+
+    `sources` are (lowest id it can yield, function returning the iterator).
+    A source is only started once the merge gets to its lowest id, so
+    archived months are read one after another unless their ids overlap.
+    """
+    pending = sorted(sources, key=lambda source: source[0])
+    heap = []
+    order = itertools.count()
+
+    def push(rows):
+        row = next(rows, None)
+        if row is not None:
+            heapq.heappush(heap, (row[0], next(order), row, rows))
+
+    start = 0
+    while start < len(pending) or heap:
+        while start < len(pending) and (not heap or pending[start][0] <= heap[0][0]):
+            push(iter(pending[start][1]()))
+            start += 1
+        if heap:
+            _, _, row, rows = heapq.heappop(heap)
+            yield row
+            push(rows)
+
+
+def gzip_members(data):
+    """Decompress the complete gzip members at the start of `data`.
+
+    A reader holding an outdated manifest may cut the file in the middle of
+    a member; it gets the members before the cut.
+    """
+    chunks = []
+    while data:
+        decompressor = zlib.decompressobj(31)
+        try:
+            chunk = decompressor.decompress(data)
+        except zlib.error:
+            break
+        if not decompressor.eof:
+            break
+        chunks.append(chunk)
+        data = decompressor.unused_data
+    return b''.join(chunks)
+
+
+class TableBackend:
+    """A table per month, with the same columns and (created_at, id) index as the hot table."""
+    name = 'table'
+
+    def __init__(self, db, keyset):
+        self.db = db
+        self.keyset = keyset
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def model(self, month):
+        with self._lock:
+            model = self._models.get(month)
+            if model is None:
+                suffix = month.replace('-', '')
+                meta = type('Meta', (), {'database': self.db,
+                                         'table_name': f'timelinepost_archive_{suffix}',
+                                         'indexes': ((('created_at', 'id'), False),
+                                                     (('email',), False))})
+                model = self._models[month] = type(f'ArchivedPost{suffix}', (Model,), {
+                    'id': IntegerField(primary_key=True),
+                    'name': CharField(),
+                    'email': CharField(),
+                    'content': TextField(),
+                    'created_at': DateTimeField(),
+                    'deleted_at': DateTimeField(null=True),
+                    'Meta': meta,
+                    '__module__': __name__,
+                })
+            return model
+
+    def prepare(self, month):
+        # Outside the batch transactions: MySQL commits implicitly on DDL
+        self.model(month).create_table(safe=True)
+
+    def lock(self, month):
+        # The manifest row lock is enough
+        return contextlib.nullcontext()
+
+    def store(self, segment, rows):
+        fields = ('id', 'name', 'email', 'content', 'created_at')
+        self.model(segment.month).insert_many([dict(zip(fields, row)) for row in rows]).execute()
+        return segment.size
+
+    def matching(self, segment, ids=None, email=None):
+        model = self.model(segment.month)
+        condition = model.id.in_(ids) if ids is not None else model.email == email
+        query = model.select(model.id, model.name, model.email, model.content, model.created_at).where(condition)
+        return list(self.db.execute(query))
+
+    def remove(self, segment, rows):
+        model = self.model(segment.month)
+        model.delete().where(model.id.in_([row[0] for row in rows])).execute()
+        return segment.size
+
+    def publish(self, segment):
+        pass
+
+    def by_id(self, segment, after_id, database, chunk_size=1000):
+        model = self.model(segment.month)
+        while True:
+            query = (model.select(model.id, model.name, model.email, model.content, model.created_at)
+                     .where(model.id > after_id).order_by(model.id).limit(chunk_size))
+            rows = list((database or self.db).execute(query))
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            after_id = rows[-1][0]
+
+    def page(self, segment, limit, before, after, database):
+        return self.keyset(self.model(segment.month), limit, before, after, database)
+
+    def get(self, segment, post_id, database):
+        model = self.model(segment.month)
+        query = (model.select(model.id, model.name, model.email, model.content, model.created_at)
+                 .where(model.id == post_id))
+        rows = list((database or self.db).execute(query))
+        return rows[0] if rows else None
+
+    def read(self, segment, database=None):
+        return self.keyset(self.model(segment.month), segment.rows + 1, None,
+                           (datetime.datetime.min, 0), database)
+
+
+class NdjsonBackend:
+    """A gzipped NDJSON file per month, in the export format."""
+    name = 'ndjson'
+
+    def __init__(self, directory, cache_size=SEGMENT_CACHE_SIZE):
+        self.directory = directory
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, month):
+        return os.path.join(self.directory, f'timeline-{month}.ndjson.gz')
+
+    def staged(self, month):
+        return self.path(month) + '.rewrite'
+
+    def prepare(self, month):
+        os.makedirs(self.directory, exist_ok=True)
+
+    @contextlib.contextmanager
+    def lock(self, month):
+        """Exclusive access to a segment file, across threads and processes."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(month) + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._recover(month)
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _recover(self, month):
+        # A rewrite that died after committing the manifest is finished,
+        # one that died before is dropped
+        staged = self.staged(month)
+        if not os.path.exists(staged):
+            return
+        segment = ArchiveSegment.get_or_none(ArchiveSegment.month == month)
+        with open(staged, 'rb') as f:
+            data = f.read()
+        rows = self._parse(gzip_members(data))
+        if segment is not None and segment.size == len(data) and add_checksum('0' * 16, rows) == segment.checksum:
+            os.replace(staged, self.path(month))
+        else:
+            os.remove(staged)
+
+    def store(self, segment, rows):
+        """Append a batch after the committed part of the file; returns the new committed size."""
+        with open(self.path(segment.month), 'ab') as f:
+            # Drop whatever a crashed run wrote past the manifest
+            f.truncate(segment.size)
+            f.write(gzip.compress(posts_ndjson(rows).encode(), mtime=0))
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def matching(self, segment, ids=None, email=None):
+        rows = self.load(segment)[0]
+        if ids is not None:
+            ids = set(ids)
+            return [row for row in rows if row[0] in ids]
+        return [row for row in rows if row[2] == email]
+
+    def remove(self, segment, rows):
+        """Stage the segment without `rows`; returns its size. publish() puts it in place."""
+        removed = {row[0] for row in rows}
+        kept = [row for row in self.load(segment)[0] if row[0] not in removed]
+        with open(self.staged(segment.month), 'wb') as f:
+            if kept:
+                f.write(gzip.compress(posts_ndjson(kept).encode(), mtime=0))
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def publish(self, segment):
+        os.replace(self.staged(segment.month), self.path(segment.month))
+
+    def by_id(self, segment, after_id, database):
+        return sorted((row for row in self.load(segment)[0] if row[0] > after_id), key=lambda row: row[0])
+
+    @staticmethod
+    def _parse(data):
+        rows = []
+        for line in data.decode().splitlines():
+            post = json.loads(line)
+            rows.append((post['id'], post['name'], post['email'], post['content'], post['created_at']))
+        return rows
+
+    def load(self, segment):
+        """(rows, keys, by id) for the committed part of a segment, oldest first."""
+        key = (segment.month, segment.size, segment.checksum)
+        with self._lock:
+            loaded = self._cache.get(key)
+            if loaded is not None:
+                self._cache.move_to_end(key)
+                return loaded
+        if os.path.exists(self.staged(segment.month)):
+            # Wait for the rewrite to finish, or clean up after a crashed one
+            with self.lock(segment.month):
+                pass
+        with open(self.path(segment.month), 'rb') as f:
+            data = gzip_members(f.read(segment.size)) if segment.size else b''
+        rows = self._parse(data)
+        rows.sort(key=lambda row: (row[4], row[0]))
+        keys = [(parse_timestamp(row[4]), row[0]) for row in rows]
+        loaded = (rows, keys, {row[0]: row for row in rows})
+        with self._lock:
+            self._cache[key] = loaded
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return loaded
+
+    def page(self, segment, limit, before, after, database):
+        rows, keys, _ = self.load(segment)
+        if after is not None:
+            start = bisect.bisect_right(keys, after)
+            return rows[start:start + limit]
+        end = bisect.bisect_left(keys, before) if before is not None else len(rows)
+        return rows[max(0, end - limit):end][::-1]
+
+    def get(self, segment, post_id, database):
+        return self.load(segment)[2].get(post_id)
+
+    def read(self, segment, database=None):
+        return self.load(segment)[0]
+
+
+class Archive:
+    """Moves old posts out of `posts` (the hot model) and reads them back."""
+
+    def __init__(self, db, posts, backend, after_days=365):
+        self.db = db
+        self.posts = posts
+        self.backend = backend
+        self.after_days = after_days
+
+    def segments(self, database=None):
+        """Manifest entries, oldest month first."""
+        query = ArchiveSegment.select().order_by(ArchiveSegment.month)
+        return list(query.execute(database or self.db))
+
+    def cutoff(self, now=None):
+        """Posts before this (the start of a month) are due for archival."""
+        moment = (now or datetime.datetime.now()) - datetime.timedelta(days=self.after_days)
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    def boundary(self, database=None):
+        """End of the newest archived month, or None; the hot table holds only newer posts."""
+        segments = self.segments(database)
+        return month_bounds(segments[-1].month)[1] if segments else None
+
+    def run(self, now=None, batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_PAUSE, sleep=time.sleep):
+        """Archive every whole month before cutoff(); returns {month: posts moved}."""
+        return self.archive_before(self.cutoff(now), batch_size, pause, sleep)
+
+    def catch_up(self, batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_PAUSE, sleep=time.sleep):
+        """Move posts written behind the archive (imported with an old created_at) into it.
+
+        Pages continue from the hot table into the archive on the
+        assumption that every archived post is older than every hot one.
+        """
+        boundary = self.boundary()
+        return self.archive_before(boundary, batch_size, pause, sleep) if boundary is not None else {}
+
+    def archive_before(self, cutoff, batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_PAUSE, sleep=time.sleep):
+        """Archive every live post created before `cutoff`, a month start; returns {month: posts moved}."""
+        posts = self.posts
+        live = posts.deleted_at.is_null()
+        moved = {}
+        while True:
+            oldest = posts.select(posts.created_at).where(live & (posts.created_at < cutoff)) \
+                          .order_by(posts.created_at).limit(1).scalar()
+            if oldest is None:
+                return moved
+            month = month_of(oldest)
+            start, end = month_bounds(month)
+            in_month = live & (posts.created_at >= start) & (posts.created_at < min(end, cutoff))
+            self.backend.prepare(month)
+            while True:
+                count = self._move_batch(month, in_month, batch_size)
+                if count is None:
+                    # A post in the batch was deleted meanwhile; pick the batch again
+                    continue
+                moved[month] = moved.get(month, 0) + count
+                if count < batch_size:
+                    break
+                sleep(pause)
+
+    def _segment_for_update(self, month):
+        query = ArchiveSegment.select().where(ArchiveSegment.month == month)
+        return lock_for_update(self.db, query).get_or_none()
+
+    def _move_batch(self, month, condition, batch_size):
+        posts = self.posts
+        with self.backend.lock(month), self.db.atomic() as transaction:
+            query = (posts.select(posts.id, posts.name, posts.email, posts.content, posts.created_at)
+                     .where(condition)
+                     .order_by(posts.created_at, posts.id)
+                     .limit(batch_size))
+            rows = list(self.db.execute(query))
+            if not rows:
+                return 0
+            segment = self._segment_for_update(month)
+            created = segment is None
+            if created:
+                segment = ArchiveSegment(month=month, backend=self.backend.name)
+            segment.size = self.backend.store(segment, rows)
+            ids = [row[0] for row in rows]
+            deleted = posts.delete().where(posts.id.in_(ids) & posts.deleted_at.is_null()).execute()
+            if deleted != len(rows):
+                transaction.rollback()
+                return None
+            segment.rows += len(rows)
+            segment.min_id = min([*ids, segment.min_id] if segment.min_id is not None else ids)
+            segment.max_id = max([*ids, segment.max_id] if segment.max_id is not None else ids)
+            segment.checksum = add_checksum(segment.checksum, rows)
+            segment.archived_at = datetime.datetime.now()
+            segment.save(force_insert=created)
+        return len(rows)
+
+    def extend_page(self, rows, want, before=None, after=None, database=None):
+        """Continue a page of hot rows into the archive, up to `want` rows.
+
+        `rows` are newest first, or oldest first when paging `after` a
+        cursor; archived months are all older than the hot table, so they
+        come after the hot rows, or before them going forwards.
+        """
+        if after is None:
+            if len(rows) >= want:
+                return rows
+            segments = [segment for segment in reversed(self.segments(database))
+                        if before is None or segment.month <= month_of(before[0])]
+            for segment in segments:
+                rows = rows + self.backend.page(segment, want - len(rows), before, None, database)
+                if len(rows) >= want:
+                    break
+            return rows
+
+        older = []
+        for segment in self.segments(database):
+            if segment.month < month_of(after[0]):
+                continue
+            older += self.backend.page(segment, want - len(older), None, after, database)
+            if len(older) >= want:
+                break
+        return (older + rows)[:want]
+
+    def get(self, post_id, database=None):
+        """An archived post's raw row, or None."""
+        for segment in self.segments(database):
+            if segment.rows and segment.min_id <= post_id <= segment.max_id:
+                row = self.backend.get(segment, post_id, database)
+                if row is not None:
+                    return row
+        return None
+
+    def delete(self, ids=None, email=None):
+        """Remove archived posts by id or by author; returns the ids removed."""
+        removed = []
+        for segment in self.segments():
+            if not segment.rows or (ids is not None and
+                                    not any(segment.min_id <= post_id <= segment.max_id for post_id in ids)):
+                continue
+            with self.backend.lock(segment.month):
+                with self.db.atomic():
+                    segment = self._segment_for_update(segment.month)
+                    rows = self.backend.matching(segment, ids, email)
+                    if not rows:
+                        continue
+                    segment.size = self.backend.remove(segment, rows)
+                    segment.rows -= len(rows)
+                    segment.checksum = add_checksum(segment.checksum, rows, sign=-1)
+                    segment.save()
+                self.backend.publish(segment)
+            removed += [row[0] for row in rows]
+        return removed
+
+    def export_sources(self, after_id=0, database=None):
+        """merge_by_id() sources for every archived post with an id above `after_id`."""
+        return [(max(segment.min_id, after_id + 1),
+                 lambda segment=segment: self.backend.by_id(segment, after_id, database))
+                for segment in self.segments(database)
+                if segment.rows and segment.max_id > after_id]
+
+    def verify(self, database=None):
+        """Check every segment against the manifest; returns (month, rows, problems) per segment."""
+        posts = self.posts
+        report = []
+        for segment in self.segments(database):
+            problems = []
+            if segment.backend != self.backend.name:
+                report.append((segment.month, segment.rows, [f'written by the {segment.backend} backend']))
+                continue
+            try:
+                rows = self.backend.read(segment, database)
+            except (OSError, ValueError) as e:
+                report.append((segment.month, segment.rows, [f'unreadable: {e}']))
+                continue
+            ids = [row[0] for row in rows]
+            if len(rows) != segment.rows:
+                problems.append(f'{len(rows)} rows, manifest says {segment.rows}')
+            if len(set(ids)) != len(ids):
+                problems.append('duplicate ids')
+            if add_checksum('0' * 16, rows) != segment.checksum:
+                problems.append('checksum mismatch')
+            if any(month_of(row[4]) != segment.month for row in rows):
+                problems.append('posts from another month')
+            if ids and (min(ids) < segment.min_id or max(ids) > segment.max_id):
+                problems.append('ids outside the manifest range')
+            for batch in chunked(ids, 500):
+                query = posts.select(posts.id).where(posts.id.in_(batch)).limit(1)
+                if list((database or self.db).execute(query)):
+                    problems.append('posts also still in the hot table')
+                    break
+            report.append((segment.month, len(rows), problems))
+        return report
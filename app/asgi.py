@@ -0,0 +1,206 @@
+import asyncio
+import itertools
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Async (ASGI) serving mode.
+#
+# The handlers and peewee stay synchronous; what changes is who waits on the
+# network. Under a WSGI server a worker thread is held while a slow client
+# uploads its request and while it downloads the response. Here the event
+# loop reads the whole request body (spooled to disk past
+# SPOOL_MAX_MEMORY), then the unchanged Flask app runs in a bounded thread
+# pool, and the loop sends the response at whatever pace the client reads
+# it. A thread is only busy while Python code or a query is running, so a
+# handful of threads can serve many slow connections.
+#
+# Responses without a Content-Length (exports, the SSE feed) are streamed:
+# the generator runs on one pool thread from start to end (request contexts
+# and peewee connections are per thread) and hands chunks to the loop
+# through a small queue, so a slow reader holds that thread like it would
+# under WSGI.
+#
+# Every request goes through the same WSGI app (and middleware) as in sync
+# mode, so responses are identical. Requests beyond `max_pending` in flight
+# are turned away with 503 rather than queueing without bound.
+
+SPOOL_MAX_MEMORY = 1024 * 1024
+# Chunks a streamed response may run ahead of the client
+STREAM_QUEUE_SIZE = 8
+
+
+class AsgiAdapter:
+    def __init__(self, wsgi_app, max_workers=8, max_pending=1000):
+        self.wsgi_app = wsgi_app
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='asgi')
+        self.pending = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+        if self.pending >= self.max_pending:
+            await send({'type': 'http.response.start', 'status': 503,
+                        'headers': [(b'content-type', b'application/json'), (b'retry-after', b'1')]})
+            await send({'type': 'http.response.body', 'body': b'{"error": "Server is busy"}'})
+            return
+        self.pending += 1
+        try:
+            await self.handle(scope, receive, send)
+        finally:
+            self.pending -= 1
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, scope, receive, send):
+        body = await read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(STREAM_QUEUE_SIZE)
+        cancelled = threading.Event()
+        worker = loop.run_in_executor(self.executor, self.run_app,
+                                      wsgi_environ(scope, body), loop, queue, cancelled)
+        watcher = asyncio.ensure_future(watch_disconnect(receive, cancelled))
+        try:
+            kind, *item = await queue.get()
+            if kind == 'error':
+                await send({'type': 'http.response.start', 'status': 500,
+                            'headers': [(b'content-type', b'text/plain')]})
+                await send({'type': 'http.response.body', 'body': b'Internal Server Error'})
+                return
+            status, headers = item
+            await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                    for name, value in headers]})
+            while True:
+                kind, *item = await queue.get()
+                if kind != 'chunk':
+                    # An error once the response has started can only cut it short
+                    break
+                if not cancelled.is_set():
+                    await send({'type': 'http.response.body', 'body': item[0], 'more_body': True})
+            if not cancelled.is_set():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Let the worker finish: it stops at the next chunk, and any put it
+            # is blocked on has to be taken off the queue
+            cancelled.set()
+            watcher.cancel()
+            while not worker.done():
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait([getter, worker], return_when=asyncio.FIRST_COMPLETED)
+                getter.cancel()
+            body.close()
+
+    def run_app(self, environ, loop, queue, cancelled):
+        """Run the WSGI app on a pool thread, handing the response to the loop."""
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [status, headers]
+            # Apps that write() do so before returning their iterable
+            return written.append
+
+        response = []
+        written = []
+        app_iter = None
+        started = False
+        try:
+            app_iter = self.wsgi_app(environ, start_response)
+            if any(name.lower() == 'content-length' for name, _ in response[1]):
+                # Bounded body: build it here, let the loop send it at leisure
+                data = b''.join(itertools.chain(written, app_iter))
+                put(('start', *response))
+                started = True
+                put(('chunk', data))
+            else:
+                put(('start', *response))
+                started = True
+                for data in itertools.chain(written, app_iter):
+                    if cancelled.is_set():
+                        break
+                    if data:
+                        put(('chunk', data))
+            put(('end',))
+        except Exception as e:
+            print(f"ASGI request failed: {e}", file=sys.stderr)
+            put(('error',) if not started else ('end',))
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+async def read_body(receive):
+    """Read the request body without holding a thread; None if the client went away."""
+    body = tempfile.SpooledTemporaryFile(SPOOL_MAX_MEMORY)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body
+
+
+async def watch_disconnect(receive, cancelled):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            cancelled.set()
+            return
+
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    body.seek(0, 2)
+    length = body.tell()
+    body.seek(0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
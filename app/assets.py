@@ -0,0 +1,154 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from flask import Response, abort, current_app, request, send_file
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional, gzip only without it
+    brotli = None
+
+# Fingerprinted static assets.
+#
+# At startup every file under app/static is hashed and given a URL with the
+# hash in its name (styles/main.css -> /assets/styles/main.1a2b3c4d5e.css).
+# Templates get these URLs from asset_url(), so a changed file gets a new URL
+# and the old one can be cached by browsers for a year without revalidating.
+# Text assets are compressed once, with gzip and (if the brotli package is
+# installed) brotli, and the smallest variant the client accepts is served.
+#
+# asset_url() raises MissingAssetError for a file that doesn't exist, and
+# check_templates() runs at startup so a typo in a template stops the app
+# from booting instead of shipping a broken link.
+
+ASSET_URL_PREFIX = '/assets'
+HASH_LENGTH = 10
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+                      'image/svg+xml', 'image/x-icon', 'image/vnd.microsoft.icon')
+# Keep a compressed variant only if it saves at least this fraction
+MIN_SAVINGS = 0.1
+
+ASSET_URL_RE = re.compile(r"""(?:asset_url|responsive_image)\(\s*['"]([^'"]+)['"]""")
+
+
+class MissingAssetError(LookupError):
+    pass
+
+
+class Asset:
+    def __init__(self, path, digest, mimetype):
+        self.path = path
+        self.digest = digest
+        self.mimetype = mimetype
+        # Content-Encoding -> compressed bytes
+        self.variants = {}
+
+
+def fingerprint(name, digest):
+    root, ext = os.path.splitext(name)
+    return f'{root}.{digest}{ext}'
+
+
+def compress_variants(data):
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items()
+            if len(body) <= len(data) * (1 - MIN_SAVINGS)}
+
+
+class AssetManifest:
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._by_name = {}
+        self._by_fingerprint = {}
+        self._signature = None
+        self.build()
+
+    def _scan(self):
+        files = []
+        for root, _, names in os.walk(self.static_folder):
+            for name in names:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                files.append((path, stat.st_mtime_ns, stat.st_size))
+        return sorted(files)
+
+    def build(self):
+        files = self._scan()
+        by_name, by_fingerprint = {}, {}
+        for path, _, _ in files:
+            name = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            asset = Asset(path, hashlib.sha256(data).hexdigest()[:HASH_LENGTH], mimetype)
+            if mimetype.startswith(COMPRESSIBLE_TYPES):
+                asset.variants = compress_variants(data)
+            by_name[name] = asset
+            by_fingerprint[fingerprint(name, asset.digest)] = asset
+        self._by_name, self._by_fingerprint = by_name, by_fingerprint
+        self._signature = files
+
+    def refresh(self):
+        """Rebuild if any file changed (used while templates auto-reload)."""
+        if self._scan() != self._signature:
+            self.build()
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def url(self, name):
+        asset = self._by_name.get(name)
+        if asset is None:
+            raise MissingAssetError(f"Static asset not found: {name}")
+        return f'{ASSET_URL_PREFIX}/{fingerprint(name, asset.digest)}'
+
+    def lookup(self, fingerprinted_name):
+        return self._by_fingerprint.get(fingerprinted_name)
+
+
+def asset_url(name):
+    """Jinja global: the fingerprinted URL of a file under app/static."""
+    manifest = current_app.extensions['assets']
+    if current_app.jinja_env.auto_reload:
+        manifest.refresh()
+    return manifest.url(name)
+
+
+def check_templates(jinja_env, manifest):
+    """Raise MissingAssetError listing every asset_url('...') (or responsive_image) that doesn't exist."""
+    missing = []
+    for template in jinja_env.list_templates():
+        source = jinja_env.loader.get_source(jinja_env, template)[0]
+        missing.extend(f'{template}: {name}' for name in ASSET_URL_RE.findall(source)
+                       if name not in manifest)
+    if missing:
+        raise MissingAssetError("Templates reference missing static assets: " + ', '.join(missing))
+
+
+def serve_asset(fingerprinted_name):
+    asset = current_app.extensions['assets'].lookup(fingerprinted_name)
+    if asset is None:
+        abort(404)
+
+    # Smallest variant the client accepts
+    accepted = [(len(body), encoding, body) for encoding, body in asset.variants.items()
+                if request.accept_encodings[encoding]]
+    if accepted:
+        _, encoding, body = min(accepted)
+        response = Response(body, mimetype=asset.mimetype)
+        response.content_encoding = encoding
+        response.set_etag(f'{asset.digest}-{encoding}')
+    else:
+        response = send_file(asset.path, mimetype=asset.mimetype, etag=False, conditional=False)
+        response.set_etag(asset.digest)
+    if asset.variants:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
@@ -0,0 +1,20 @@
+import functools
+import hmac
+from flask import current_app, request, jsonify
+
+# Token check for admin endpoints (exports, bulk imports, moderation).
+# Requests must send `Authorization: Bearer <ADMIN_TOKEN>`; when ADMIN_TOKEN
+# is not configured those endpoints are switched off entirely.
+
+
+def admin_required(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = current_app.config.get('ADMIN_TOKEN')
+        if not token:
+            return jsonify({'error': 'Admin API is disabled (ADMIN_TOKEN is not set)'}), 403
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return fn(*args, **kwargs)
+    return wrapper
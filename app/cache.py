@@ -0,0 +1,115 @@
+import datetime
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from flask import Response, current_app, render_template, request
+from werkzeug.http import generate_etag
+
+# In-process cache of rendered pages.
+#
+# The portfolio pages are rendered from module-level data that only changes
+# between deploys, so each page is rendered once per process and the bytes
+# are served from memory with a strong ETag and Last-Modified. The cache key
+# includes a digest of the template context, so changing the data (or the
+# URL env var, which is part of the context) invalidates the page on the next
+# request without a restart.
+
+
+class CachedPage:
+    def __init__(self, version, body):
+        self.version = version
+        self.body = body
+        self.etag = generate_etag(body)
+        self.last_modified = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+
+
+class PageCache:
+    def __init__(self):
+        # One entry per endpoint; a new version replaces the old one
+        self._pages = {}
+
+    def clear(self):
+        self._pages.clear()
+
+    def get(self, endpoint, version):
+        page = self._pages.get(endpoint)
+        return page if page is not None and page.version == version else None
+
+    def put(self, endpoint, version, body):
+        page = CachedPage(version, body)
+        self._pages[endpoint] = page
+        return page
+
+
+page_cache = PageCache()
+
+
+def content_version(template_name, context):
+    payload = json.dumps([template_name, context], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def render_cached(template_name, **context):
+    """render_template() that serves a cached copy and answers conditional GETs."""
+    if current_app.jinja_env.auto_reload:
+        # Templates may change on disk while debugging; always render
+        return render_template(template_name, **context)
+
+    version = content_version(template_name, context)
+    page = page_cache.get(request.endpoint, version)
+    if page is None:
+        body = render_template(template_name, **context).encode()
+        page = page_cache.put(request.endpoint, version, body)
+
+    response = Response(page.body, mimetype='text/html')
+    response.set_etag(page.etag)
+    response.last_modified = page.last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+class ResponseCache:
+    """Small LRU of serialized responses, valid for one data version.
+
+    Callers pass the current version (e.g. the timeline write counter) with
+    every lookup and store. Lookups for any other version miss, and the first
+    store under a newer version empties the cache, so writers never have to
+    reach into it.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._entries.clear()
+
+    def get(self, version, key):
+        with self._lock:
+            if version != self._version:
+                return None
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, version, key, value):
+        with self._lock:
+            if version != self._version:
+                if self._version is not None and version < self._version:
+                    # A slow request that read an older version; don't store it
+                    return
+                self._version = version
+                self._entries.clear()
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
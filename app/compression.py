@@ -0,0 +1,215 @@
+import gzip
+import itertools
+import threading
+import zlib
+from collections import OrderedDict
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional, gzip only without it
+    brotli = None
+
+# gzip/brotli compression of dynamic responses.
+#
+# Neither the app nor nginx compressed responses, so the rendered pages and
+# timeline JSON went out as is. This middleware compresses text-like
+# responses of at least `min_size` bytes for clients that accept it, and
+# stream-compresses responses without a Content-Length (exports) chunk by
+# chunk, flushing after each one so nothing is held back.
+#
+# A compressed response is a different representation, so its ETag gets an
+# encoding suffix ("abc" -> "abc+gzip"; "+" rather than "-", which the app's
+# own pre-compressed assets already use). The suffix for the encoding
+# negotiated for this request is stripped from If-None-Match before the app
+# sees it, so the app's conditional GET handling keeps working unchanged,
+# and put back on the ETag of the 304. A tag for another encoding is left
+# alone and doesn't match, so a client that cached the gzip body and now
+# asks for br gets the br body rather than a 304.
+#
+# Bodies of responses with a strong ETag are kept compressed in a small LRU
+# keyed by URL, ETag and encoding, so cached pages are compressed once
+# rather than on every request.
+#
+# Server-Sent Events are left alone: every event has to reach the browser
+# as soon as it is written.
+
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'text/plain', 'text/csv', 'text/xml',
+                      'application/json', 'application/javascript', 'application/x-ndjson',
+                      'application/xml', 'image/svg+xml')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+MAX_CACHED_BODY = 1024 * 1024
+
+
+def choose_encoding(accept_encoding):
+    accepted = parse_accept_header(accept_encoding or '')
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class StreamCompressor:
+    """Compress chunk by chunk, flushing each so the client can decode it right away."""
+
+    def __init__(self, encoding):
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._compress = self._compressor.process
+            self._flush = self._compressor.flush
+            self._finish = self._compressor.finish
+        else:
+            # wbits=31: a gzip container instead of a raw zlib stream
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._compress = self._compressor.compress
+            self._flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._compressor.flush
+
+    def chunk(self, data):
+        return self._compress(data) + self._flush()
+
+    def finish(self):
+        return self._finish()
+
+
+class CompressedBodyCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_size=1024, cache_entries=256):
+        self.app = app
+        self.min_size = min_size
+        self.cache = CompressedBodyCache(cache_entries)
+
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        # Only a client that got a body compressed here gets a re-tagged 304
+        retag_304 = False
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        suffix = f'+{encoding}"'
+        if if_none_match and encoding is not None and suffix in if_none_match:
+            environ['HTTP_IF_NONE_MATCH'] = if_none_match.replace(suffix, '"')
+            retag_304 = True
+
+        captured = []
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            if exc_info is not None and captured:
+                raise exc_info[1].with_traceback(exc_info[2])
+            captured[:] = [status, headers]
+            # Apps that write() do so before returning their iterable; the
+            # data goes out ahead of it, compressed with the rest
+            return written.append
+
+        app_iter = self.app(environ, capture)
+        if written:
+            app_iter = ClosingIterator(itertools.chain(written, app_iter), getattr(app_iter, 'close', None))
+        status, headers = captured
+        headers = Headers(headers)
+
+        if not self._eligible(environ, status, headers):
+            if retag_304 and status.startswith('304') and 'ETag' in headers:
+                headers['ETag'] = self._tag(headers['ETag'], encoding)
+            start_response(status, headers.to_wsgi_list())
+            return app_iter
+
+        # Compressed or not, the body depends on Accept-Encoding
+        headers['Vary'] = add_vary(headers.get('Vary', ''))
+        if encoding is None:
+            start_response(status, headers.to_wsgi_list())
+            return app_iter
+
+        headers['Content-Encoding'] = encoding
+        etag = headers.get('ETag')
+        if etag:
+            headers['ETag'] = self._tag(etag, encoding)
+
+        if 'Content-Length' not in headers:
+            start_response(status, headers.to_wsgi_list())
+            return self._stream(app_iter, encoding)
+
+        try:
+            body = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        key = None
+        if etag and not etag.startswith('W/') and len(body) <= MAX_CACHED_BODY:
+            key = (environ.get('PATH_INFO'), environ.get('QUERY_STRING'), etag, encoding)
+        compressed = self.cache.get(key) if key else None
+        if compressed is None:
+            compressed = compress(body, encoding)
+            if key:
+                self.cache.put(key, compressed)
+        headers['Content-Length'] = str(len(compressed))
+        start_response(status, headers.to_wsgi_list())
+        return [compressed]
+
+    def _eligible(self, environ, status, headers):
+        if environ.get('REQUEST_METHOD') == 'HEAD' or not status.startswith('200'):
+            return False
+        if 'Content-Encoding' in headers or 'no-transform' in headers.get('Cache-Control', ''):
+            return False
+        mimetype = headers.get('Content-Type', '').split(';')[0].strip()
+        if mimetype not in COMPRESSIBLE_TYPES:
+            return False
+        length = headers.get('Content-Length')
+        return length is None or int(length) >= self.min_size
+
+    @staticmethod
+    def _tag(etag, encoding):
+        if etag.endswith('"'):
+            return f'{etag[:-1]}+{encoding}"'
+        return etag
+
+    @staticmethod
+    def _stream(app_iter, encoding):
+        compressor = StreamCompressor(encoding)
+        try:
+            for data in app_iter:
+                if data:
+                    yield compressor.chunk(data)
+            yield compressor.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+def add_vary(vary):
+    values = [value.strip() for value in vary.split(',') if value.strip()]
+    if 'accept-encoding' not in (value.lower() for value in values):
+        values.append('Accept-Encoding')
+    return ', '.join(values)
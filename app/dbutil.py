@@ -0,0 +1,25 @@
+from peewee import Proxy, SqliteDatabase
+
+# Small database helpers shared by the feature modules. Each of them accepts
+# the app's DatabaseProxy as well as a database.
+
+
+def is_sqlite(db):
+    if isinstance(db, Proxy):
+        db = db.obj
+    return isinstance(db, SqliteDatabase)
+
+
+def locked_transaction(db):
+    """Transaction for a read-modify-write of one row that workers race on.
+
+    Select the row with lock_for_update() inside it. SQLite has no
+    SELECT ... FOR UPDATE, so the write lock is taken up front instead.
+    """
+    if is_sqlite(db):
+        return db.atomic('IMMEDIATE')
+    return db.atomic()
+
+
+def lock_for_update(db, query):
+    return query.for_update() if db.for_update else query
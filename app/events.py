@@ -0,0 +1,124 @@
+import threading
+from collections import deque
+from app.jobs import BackgroundThread
+
+# Fan-out of timeline changes to Server-Sent Events subscribers.
+#
+# Writers append events to the `timeline_events` table in the same
+# transaction as the change, so every worker process sees every write, and
+# the table ids double as SSE event ids that a reconnecting client can resume
+# from (Last-Event-ID). Each process runs one relay thread that polls the
+# table while it has subscribers and copies new events into every
+# subscriber's buffer; request threads never touch the database while they
+# stream. A subscriber that falls `max_pending` events behind has its buffer
+# replaced by a single `reset` event, which tells the page to reload, so a
+# stalled client costs a bounded amount of memory.
+
+
+def sse_frame(event_id, event, data):
+    return f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'
+
+
+class Subscriber:
+    def __init__(self, last_id, max_pending=100):
+        self.max_pending = max_pending
+        # Events up to this id were already sent (or are older than the stream)
+        self.last_id = last_id
+        self._events = deque()
+        self._cond = threading.Condition()
+
+    def push(self, event_id, frame):
+        with self._cond:
+            if len(self._events) >= self.max_pending:
+                self._events.clear()
+                frame = sse_frame(event_id, 'reset', '{}')
+            self._events.append((event_id, frame))
+            self._cond.notify()
+
+    def next_frame(self, timeout):
+        """Return the next unsent frame, or None if nothing arrived within `timeout`."""
+        with self._cond:
+            while True:
+                while self._events:
+                    event_id, frame = self._events.popleft()
+                    if event_id > self.last_id:
+                        self.last_id = event_id
+                        return frame
+                if not self._cond.wait(timeout):
+                    return None
+
+
+class EventRelay:
+    """Polls `poll_fn(after_id, limit) -> [(id, frame)]` and fans events out.
+
+    With `interval=None` no thread is started and poll() has to be called by
+    hand.
+    """
+
+    def __init__(self, poll_fn, interval=1.0, max_pending=100, batch_size=500):
+        self.poll_fn = poll_fn
+        self.interval = interval
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.last_id = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._background = BackgroundThread(self._run, 'timeline-events', self.stop)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, last_id):
+        """Register a subscriber for the events after `last_id`."""
+        subscriber = Subscriber(last_id, self.max_pending)
+        with self._lock:
+            # Start from here when idle (nothing older is owed to anyone), or
+            # rewind if the relay already moved past the new subscriber
+            if self.last_id is None or not self._subscribers or last_id < self.last_id:
+                self.last_id = last_id
+            self._subscribers.add(subscriber)
+        self._ensure_started()
+        self._wake.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def notify(self):
+        """Poll now instead of at the next interval (after a local write)."""
+        self._wake.set()
+
+    def poll(self):
+        """Fetch new events and hand them to every subscriber."""
+        while True:
+            after_id = self.last_id
+            events = self.poll_fn(after_id, self.batch_size)
+            with self._lock:
+                for event_id, frame in events:
+                    for subscriber in self._subscribers:
+                        subscriber.push(event_id, frame)
+                if events and self.last_id == after_id:
+                    self.last_id = events[-1][0]
+            if len(events) < self.batch_size:
+                return
+
+    def stop(self):
+        self._background.stopping.set()
+        self._wake.set()
+
+    def _ensure_started(self):
+        if self.interval is not None:
+            self._background.start()
+
+    def _run(self):
+        while not self._background.stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._subscribers:
+                continue
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Polling timeline events failed: {e}")
@@ -0,0 +1,235 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import Response, current_app, jsonify, request
+from peewee import CharField, DoubleField, IntegerField, Model, TextField
+from app.metrics import registry as metrics
+from app.dbutil import lock_for_update, locked_transaction
+
+# Idempotency-Key support for POST endpoints.
+#
+# A client that sends `Idempotency-Key: <unique value>` with a POST can retry
+# it safely: the first request runs and its response is stored for `ttl`
+# seconds, and a repeat with the same key gets that response back (with
+# `Idempotent-Replayed: true`) without running the view again. A repeat that
+# arrives while the first is still running gets 409, and reusing a key for a
+# different request body gets 422. Server errors and 429s are not stored, so
+# those can be retried for real.
+#
+# Where the stored responses live is up to the backend:
+#
+#   memory    per-process OrderedDict (default; a retry that lands on another
+#             worker runs again)
+#   database  the `idempotency_keys` table, shared by every worker
+#
+# Both stay bounded: the memory backend drops expired keys as it goes and
+# evicts the oldest past max_keys, and the database backend periodically
+# purges expired rows.
+
+KEY_MAX_LENGTH = 255
+# Headers of the original response that are replayed with it
+REPLAYED_HEADERS = ('Content-Type', 'Location', 'Retry-After')
+
+# status is None while the first request is still running
+Entry = namedtuple('Entry', 'fingerprint status headers body expires_at')
+
+
+class MemoryBackend:
+    def __init__(self, max_keys=10_000):
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def begin(self, key, fingerprint, now, lock_timeout):
+        """Claim `key` and return None, or return the entry that already holds it."""
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+            self._store(key, Entry(fingerprint, None, {}, b'', now + lock_timeout))
+            return None
+
+    def finish(self, key, status, headers, body, now, ttl):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._store(key, Entry(entry.fingerprint, status, headers, body, now + ttl))
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.status is None:
+                del self._entries[key]
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+    def _expire(self, now):
+        # Entries are kept in the order they were last written, which is
+        # expiry order apart from in-flight ones, so stop at the first key
+        # that is still live
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now:
+                break
+            del self._entries[key]
+
+
+class IdempotencyEntry(Model):
+    key = CharField(primary_key=True, max_length=64)
+    fingerprint = CharField(max_length=64)
+    status = IntegerField(null=True)
+    headers = TextField(default='{}')
+    body = TextField(default='')
+    expires_at = DoubleField()
+
+    class Meta:
+        table_name = 'idempotency_keys'
+
+
+class DatabaseBackend:
+    """Entries stored in the `idempotency_keys` table (created by a migration)."""
+
+    def __init__(self, db, purge_every=1000):
+        self.db = db
+        self.purge_every = purge_every
+        self._begins = 0
+        db.bind([IdempotencyEntry], bind_refs=False, bind_backrefs=False)
+
+    def __len__(self):
+        return IdempotencyEntry.select().where(IdempotencyEntry.expires_at > time.time()).count()
+
+    def begin(self, key, fingerprint, now, lock_timeout):
+        # Make sure the row exists so SELECT ... FOR UPDATE locks it; an
+        # expired row is free for the taking
+        IdempotencyEntry.insert(key=key, fingerprint=fingerprint, expires_at=0).on_conflict_ignore().execute()
+        with locked_transaction(self.db):
+            row = lock_for_update(self.db, IdempotencyEntry.select().where(IdempotencyEntry.key == key)).get()
+            if row.expires_at > now:
+                return Entry(row.fingerprint, row.status, json.loads(row.headers),
+                             row.body.encode(), row.expires_at)
+            IdempotencyEntry.update(fingerprint=fingerprint, status=None, headers='{}', body='',
+                                    expires_at=now + lock_timeout) \
+                            .where(IdempotencyEntry.key == key).execute()
+
+        self._begins += 1
+        if self._begins % self.purge_every == 0:
+            IdempotencyEntry.delete().where(IdempotencyEntry.expires_at <= now).execute()
+        return None
+
+    def finish(self, key, status, headers, body, now, ttl):
+        IdempotencyEntry.update(status=status, headers=json.dumps(headers), body=body.decode(),
+                                expires_at=now + ttl) \
+                        .where(IdempotencyEntry.key == key).execute()
+
+    def release(self, key):
+        IdempotencyEntry.delete().where((IdempotencyEntry.key == key)
+                                        & IdempotencyEntry.status.is_null()).execute()
+
+    def reset(self):
+        IdempotencyEntry.delete().execute()
+
+
+def backend_from_env(db=None):
+    """Build the backend named by IDEMPOTENCY_BACKEND (memory or database)."""
+    name = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+    if name == 'memory':
+        return MemoryBackend(max_keys=int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000")))
+    if name == 'database':
+        if db is None:
+            raise ValueError("The database idempotency backend needs a database")
+        return DatabaseBackend(db)
+    raise ValueError(f"Unknown idempotency backend: {name}")
+
+
+class IdempotencyKeys:
+    def __init__(self, backend=None, ttl=86400, lock_timeout=60, clock=time.time):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        # An entry whose request never finished (the worker died) is freed after this
+        self.lock_timeout = lock_timeout
+        self.clock = clock
+
+    def __len__(self):
+        return len(self.backend)
+
+    @staticmethod
+    def scoped(endpoint, key):
+        # Fixed length whatever the client sent, and keys are per endpoint
+        return hashlib.sha256(f"{endpoint}\0{key}".encode()).hexdigest()
+
+    def begin(self, key, fingerprint):
+        return self.backend.begin(key, fingerprint, self.clock(), self.lock_timeout)
+
+    def finish(self, key, response):
+        headers = {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+        self.backend.finish(key, response.status_code, headers, response.get_data(),
+                            self.clock(), self.ttl)
+
+    def release(self, key):
+        self.backend.release(key)
+
+    def reset(self):
+        self.backend.reset()
+
+
+def request_fingerprint():
+    payload = json.dumps([request.method, request.path, sorted(request.form.items(multi=True))])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def idempotent(fn):
+    """Replay the stored response for a repeated Idempotency-Key.
+
+    Keys are stored in app.extensions['idempotency'] (an IdempotencyKeys).
+    Requests without the header run as usual.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        keys = current_app.extensions.get('idempotency')
+        if key is None or keys is None:
+            return fn(*args, **kwargs)
+        if not key or len(key) > KEY_MAX_LENGTH:
+            return jsonify({'error': 'Invalid Idempotency-Key'}), 400
+
+        key = keys.scoped(request.endpoint, key)
+        fingerprint = request_fingerprint()
+        entry = keys.begin(key, fingerprint)
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+            if entry.status is None:
+                return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), \
+                    409, {'Retry-After': '1'}
+            metrics.inc('idempotent_replays_total', (('endpoint', request.endpoint),))
+            response = Response(entry.body, status=entry.status, headers=entry.headers)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = current_app.make_response(fn(*args, **kwargs))
+        except BaseException:
+            keys.release(key)
+            raise
+        if response.status_code >= 500 or response.status_code == 429 or response.is_streamed:
+            keys.release(key)
+        else:
+            keys.finish(key, response)
+        return response
+    return wrapper
@@ -0,0 +1,249 @@
+import io
+import json
+import os
+import re
+from markupsafe import Markup, escape
+from flask import current_app
+from app.assets import asset_url
+
+try:
+    from PIL import Image, ImageCms, ImageOps, features
+    PIL_AVAILABLE = True
+except ImportError:  # pragma: no cover - optional, images are served as-is without it
+    PIL_AVAILABLE = False
+
+# Responsive variants of the raster images under app/static.
+#
+# Each JPEG/PNG is resized to the widths in IMAGE_WIDTHS (never upscaled,
+# plus the original width) and encoded as AVIF, WebP and JPEG into
+# app/static/_variants. The variants are plain static files, so the asset
+# manifest fingerprints them like everything else. Encoding happens at
+# startup (or with `flask images build`), only for variants older than their
+# source. The mtime, size and dimensions of every source are kept in
+# _variants/variants.json, so while a source is unchanged and its variants
+# exist, startup stats the files and decodes nothing.
+#
+# responsive_image() writes a <picture> with one <source> per format and a
+# srcset per width, letting the browser download the smallest file that
+# fills the slot. The <img> carries the display width and height, so the
+# browser reserves the space before the file arrives. Without Pillow it
+# falls back to a plain <img>.
+
+VARIANT_DIR = '_variants'
+# Sources seen by the last build: name -> [mtime_ns, size, width, height]
+STATE_FILE = 'variants.json'
+IMAGE_WIDTHS = (160, 320, 640, 960, 1280)
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Preferred first; <source> order decides what the browser picks
+FORMATS = (
+    ('avif', 'image/avif', {'quality': 55}),
+    ('webp', 'image/webp', {'quality': 78, 'method': 6}),
+    ('jpeg', 'image/jpeg', {'quality': 80, 'optimize': True, 'progressive': True}),
+)
+
+PICTURE_RE = re.compile(r'<picture data-image="([^"]+)" data-max-width="(\d+)">')
+
+
+class Variant:
+    def __init__(self, name, width, height, mimetype, size):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.mimetype = mimetype
+        self.size = size
+
+
+class ResponsiveImage:
+    def __init__(self, name, width, height, size):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.size = size
+        # mimetype -> variants, narrowest first
+        self.variants = {}
+
+
+def available_formats():
+    if not PIL_AVAILABLE:
+        return ()
+    return tuple(fmt for fmt in FORMATS if fmt[0] == 'jpeg' or features.check(fmt[0]))
+
+
+def to_srgb(image):
+    """Convert from an embedded colour profile to sRGB, so variants can drop it."""
+    icc = image.info.get('icc_profile')
+    if icc:
+        try:
+            image = ImageCms.profileToProfile(image, ImageCms.ImageCmsProfile(io.BytesIO(icc)),
+                                              ImageCms.createProfile('sRGB'))
+        except ImageCms.PyCMSError:
+            pass
+    return image
+
+
+def variant_name(name, width, fmt):
+    root, _ = os.path.splitext(name)
+    return f'{VARIANT_DIR}/{root}-{width}w.{fmt}'
+
+
+class ImageVariants:
+    def __init__(self, static_folder, widths=IMAGE_WIDTHS):
+        self.static_folder = static_folder
+        self.widths = widths
+        self.images = {}
+
+    def sources(self):
+        for root, dirs, names in os.walk(self.static_folder):
+            if os.path.relpath(root, self.static_folder).split(os.sep)[0] == VARIANT_DIR:
+                continue
+            for name in names:
+                if name.lower().endswith(SOURCE_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, self.static_folder).replace(os.sep, '/'), path
+
+    def build(self):
+        """Create missing or outdated variants; return how many were encoded."""
+        formats = available_formats()
+        if not formats:
+            return 0
+        state = self.read_state()
+        seen = {}
+        encoded = 0
+        for name, path in self.sources():
+            stat = os.stat(path)
+            known = state.get(name)
+            image = None
+            if known is not None and known[:2] == [stat.st_mtime_ns, stat.st_size]:
+                image = self.existing(name, known[2], known[3], stat.st_size, formats)
+            if image is None:
+                image, count = self.encode(name, path, formats)
+                encoded += count
+            seen[name] = [stat.st_mtime_ns, stat.st_size, image.width, image.height]
+            self.images[name] = image
+        if seen != state:
+            self.write_state(seen)
+        return encoded
+
+    def widths_for(self, width):
+        # Never upscaled, plus the original width
+        return sorted({w for w in self.widths if w < width} | {width})
+
+    def existing(self, name, width, height, size, formats):
+        """The variants of an unchanged source, without opening it; None if any are missing."""
+        image = ResponsiveImage(name, width, height, size)
+        for fmt, mimetype, _ in formats:
+            variants = image.variants[mimetype] = []
+            for w in self.widths_for(width):
+                vname = variant_name(name, w, fmt)
+                try:
+                    vsize = os.path.getsize(os.path.join(self.static_folder, vname))
+                except OSError:
+                    return None
+                variants.append(Variant(vname, w, round(height * w / width), mimetype, vsize))
+        return image
+
+    def encode(self, name, path, formats):
+        """Decode a source and write its outdated variants; returns (image, variants written)."""
+        encoded = 0
+        with Image.open(path) as source:
+            source = to_srgb(ImageOps.exif_transpose(source))
+            image = ResponsiveImage(name, source.width, source.height, os.path.getsize(path))
+            mtime = os.path.getmtime(path)
+            for fmt, mimetype, options in formats:
+                variants = image.variants[mimetype] = []
+                for width in self.widths_for(source.width):
+                    height = round(source.height * width / source.width)
+                    vname = variant_name(name, width, fmt)
+                    vpath = os.path.join(self.static_folder, vname)
+                    if not os.path.exists(vpath) or os.path.getmtime(vpath) < mtime:
+                        mode = 'RGBA' if fmt != 'jpeg' and source.mode in ('RGBA', 'LA', 'P') else 'RGB'
+                        resized = source.convert(mode).resize((width, height), Image.LANCZOS)
+                        # Metadata (EXIF, colour profiles) is often bigger than a thumbnail
+                        resized.info = {}
+                        os.makedirs(os.path.dirname(vpath), exist_ok=True)
+                        # Write then rename, so a worker never serves half a file
+                        tmp = f'{vpath}.{os.getpid()}.tmp'
+                        resized.save(tmp, fmt.upper(), **options)
+                        os.replace(tmp, vpath)
+                        encoded += 1
+                    variants.append(Variant(vname, width, height, mimetype, os.path.getsize(vpath)))
+        return image, encoded
+
+    def state_path(self):
+        return os.path.join(self.static_folder, VARIANT_DIR, STATE_FILE)
+
+    def read_state(self):
+        try:
+            with open(self.state_path()) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return state if isinstance(state, dict) else {}
+
+    def write_state(self, state):
+        path = self.state_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f, sort_keys=True)
+        os.replace(tmp, path)
+
+    def best_variant(self, name, slot_width, mimetypes):
+        """The file a browser supporting `mimetypes` downloads for a slot of `slot_width` px."""
+        image = self.images[name]
+        for mimetype, variants in image.variants.items():
+            if mimetype in mimetypes:
+                return next((v for v in variants if v.width >= slot_width), variants[-1])
+        return None
+
+
+def responsive_image(name, max_width, alt='', loading='lazy', **attrs):
+    """Jinja global: a <picture> for a static image shown at most `max_width` CSS px wide.
+
+    Pass loading='eager' for images that are visible without scrolling.
+    """
+    attrs['loading'] = loading
+    # class_ -> class, data_x -> data-x
+    extra = ''.join(f' {key.rstrip("_").replace("_", "-")}="{escape(value)}"'
+                    for key, value in attrs.items())
+    image = current_app.extensions['images'].images.get(name)
+    if image is None:
+        return Markup(f'<img src="{asset_url(name)}" alt="{escape(alt)}"{extra}>')
+
+    sizes = f'(max-width: {max_width}px) 100vw, {max_width}px'
+    parts = [f'<picture data-image="{escape(name)}" data-max-width="{max_width}">']
+    for mimetype, variants in image.variants.items():
+        srcset = ', '.join(f'{asset_url(v.name)} {v.width}w' for v in variants)
+        if mimetype == 'image/jpeg':
+            # Fallback <img>: the variant closest to the display width
+            fallback = next((v for v in variants if v.width >= max_width), variants[-1])
+            # Displayed size, in the image's aspect ratio
+            width = min(max_width, image.width)
+            height = round(image.height * width / image.width)
+            parts.append(f'<img src="{asset_url(fallback.name)}" srcset="{srcset}" sizes="{sizes}" '
+                         f'width="{width}" height="{height}" '
+                         f'alt="{escape(alt)}" decoding="async"{extra}>')
+        else:
+            parts.append(f'<source type="{mimetype}" srcset="{srcset}" sizes="{sizes}">')
+    parts.append('</picture>')
+    return Markup(''.join(parts))
+
+
+# Viewports for the savings report: (label, CSS px wide, device pixel ratio, formats)
+REPORT_VIEWPORTS = (
+    ('mobile', 390, 3, ('image/avif', 'image/webp', 'image/jpeg')),
+    ('desktop', 1440, 1, ('image/webp', 'image/jpeg')),
+)
+
+
+def page_savings(html, images):
+    """Bytes of the original images on a rendered page vs. what each viewport downloads."""
+    original = 0
+    downloaded = {label: 0 for label, _, _, _ in REPORT_VIEWPORTS}
+    for name, max_width in PICTURE_RE.findall(html):
+        max_width = int(max_width)
+        original += images.images[name].size
+        for label, viewport, dpr, mimetypes in REPORT_VIEWPORTS:
+            slot = min(viewport, max_width) * dpr
+            downloaded[label] += images.best_variant(name, slot, mimetypes).size
+    return original, downloaded
@@ -0,0 +1,78 @@
+import atexit
+import os
+import threading
+
+# Periodic maintenance in the background (e.g. purging deleted posts).
+#
+# The thread is started on first use (the first request a worker serves),
+# so a preloading gunicorn master never runs one and every worker runs its
+# own. Jobs must therefore be safe to run concurrently from several
+# processes, which batched deletes are: a row removed by one worker simply
+# isn't found by the next.
+
+
+class BackgroundThread:
+    """A daemon thread running `target`, started on first use in each process.
+
+    Threads don't survive a fork, so start() starts a new one when the
+    current one belongs to another process (or has ended) and does nothing
+    otherwise. `target` should return once `stopping` is set; `on_exit` is
+    registered with atexit when the first thread starts.
+    """
+
+    def __init__(self, target, name, on_exit):
+        self.target = target
+        self.name = name
+        self.on_exit = on_exit
+        self.stopping = threading.Event()
+        self.thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._exit_hooked = False
+
+    def running(self):
+        """Whether the thread is alive in this process."""
+        return self._pid == os.getpid() and self.thread.is_alive()
+
+    def start(self):
+        if self.running():
+            return
+        with self._lock:
+            if self.running():
+                return
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+            self._pid = os.getpid()
+            self.thread.start()
+            if not self._exit_hooked:
+                atexit.register(self.on_exit)
+                self._exit_hooked = True
+
+
+class PeriodicJob:
+    def __init__(self, fn, interval, name='job'):
+        self.fn = fn
+        self.interval = interval
+        self.name = name
+        self.runs = 0
+        self.last_result = None
+        self._background = BackgroundThread(self._run, name, self.stop)
+
+    def ensure_started(self):
+        self._background.start()
+
+    def stop(self):
+        self._background.stopping.set()
+
+    def run_once(self):
+        try:
+            self.last_result = self.fn()
+        except Exception as e:
+            print(f"Background {self.name} failed: {e}")
+        self.runs += 1
+        return self.last_result
+
+    def _run(self):
+        # Wait first: the job has no business slowing down startup
+        while not self._background.stopping.wait(self.interval):
+            self.run_once()
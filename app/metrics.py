@@ -0,0 +1,244 @@
+import bisect
+import threading
+import time
+from flask import g, request
+from peewee import SqliteDatabase
+
+# Request, database and rate limiter metrics in the Prometheus text format.
+#
+# Every thread records into its own shard (plain dicts that only that thread
+# writes to), so recording a request or a query never takes a lock or
+# contends with other threads. /metrics sums the shards when it is scraped;
+# copying a dict is atomic under the GIL, so a scrape sees each shard as of
+# some recent moment. Shards of threads that have exited are folded into a
+# single retired shard, so a server that starts a thread per request doesn't
+# grow the list without bound.
+#
+# Metrics are per process: behind gunicorn each scrape is answered by one
+# of the workers.
+
+# Seconds; the prometheus_client defaults plus finer steps at the low end
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+# Fold exited threads' shards into the retired one every this many new threads
+SWEEP_EVERY = 64
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests by method, route and status.', None),
+    'http_request_duration_seconds': (
+        'histogram', 'Time until the handler returned its response (streamed bodies excluded).',
+        DURATION_BUCKETS),
+    'http_request_db_queries': ('histogram', 'Database queries run by one request.', QUERY_COUNT_BUCKETS),
+    'http_request_db_seconds_total': ('counter', 'Time requests spent in database queries.', None),
+    'db_queries_total': ('counter', 'Database queries, background threads included.', None),
+    'db_query_duration_seconds': ('histogram', 'Duration of single database queries.', DURATION_BUCKETS),
+    'rate_limit_rejections_total': ('counter', 'Requests rejected with 429, by limiter.', None),
+    'db_replica_failovers_total': ('counter', 'Reads retried on the primary after a replica failed.', None),
+    'idempotent_replays_total': ('counter', 'Stored responses replayed for a repeated Idempotency-Key.', None),
+    'timeline_duplicate_posts_total': ('counter', 'Posts rejected as a repeat of one just submitted.', None),
+}
+
+
+class Shard:
+    def __init__(self, thread=None):
+        self.thread = thread
+        self.counters = {}
+        # (name, labels) -> [count per bucket..., +Inf count, sum, count]
+        self.histograms = {}
+        # Running totals of this thread's queries; requests diff them
+        self.query_count = 0
+        self.query_seconds = 0.0
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        values = self.histograms.get(key)
+        if values is None:
+            values = self.histograms[key] = [0] * (len(buckets) + 3)
+        values[bisect.bisect_left(buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def merge(self, other):
+        for key, value in other.counters.copy().items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, values in other.histograms.copy().items():
+            values = list(values)
+            mine = self.histograms.get(key)
+            if mine is None:
+                self.histograms[key] = values
+            else:
+                for i, value in enumerate(values):
+                    mine[i] += value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._retired = Shard()
+        self._lock = threading.Lock()
+        self._registered = 0
+        self._gauges = {}
+        # Called with (sql, params, seconds) for every query when set (profiling)
+        self.query_listener = None
+
+    def shard(self):
+        """This thread's shard."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            pass
+        shard = self._local.shard = Shard(threading.current_thread())
+        # Taken once per thread, never on the recording path
+        with self._lock:
+            self._shards.append(shard)
+            self._registered += 1
+            if self._registered % SWEEP_EVERY == 0:
+                self._sweep()
+        return shard
+
+    def _sweep(self):
+        alive = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                alive.append(shard)
+            else:
+                self._retired.merge(shard)
+        self._shards = alive
+
+    def reset(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.counters.clear()
+                shard.histograms.clear()
+            self._retired = Shard()
+
+    def inc(self, name, labels=(), value=1):
+        self.shard().inc(name, labels, value)
+
+    def observe_query(self, seconds, sql=None, params=None):
+        shard = self.shard()
+        shard.query_count += 1
+        shard.query_seconds += seconds
+        shard.inc('db_queries_total')
+        shard.observe('db_query_duration_seconds', (), seconds)
+        if self.query_listener is not None:
+            self.query_listener(sql, params, seconds)
+
+    def gauge(self, name, help_text, fn):
+        """Report `fn()` as a gauge at scrape time (skipped when it returns None)."""
+        self._gauges[name] = (help_text, fn)
+
+    def snapshot(self):
+        """Every shard summed up, as a Shard."""
+        total = Shard()
+        with self._lock:
+            self._sweep()
+            shards = [self._retired, *self._shards]
+        for shard in shards:
+            total.merge(shard)
+        return total
+
+    def value(self, name, **labels):
+        """A counter's value, or a histogram's number of observations."""
+        total = self.snapshot()
+        key = (name, tuple(sorted(labels.items())))
+        if key in total.histograms:
+            return total.histograms[key][-1]
+        return total.counters.get(key, 0)
+
+    def render(self):
+        total = self.snapshot()
+        series = {}
+        for (name, labels), value in sorted(total.counters.items()):
+            series.setdefault(name, []).append(f'{name}{format_labels(labels)} {format_value(value)}')
+        for (name, labels), values in sorted(total.histograms.items()):
+            lines = series.setdefault(name, [])
+            bounds = [format_value(bound) for bound in METRICS[name][2]] + ['+Inf']
+            cumulative = 0
+            for le, count in zip(bounds, values):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels((*labels, ("le", le)))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(values[-2])}')
+            lines.append(f'{name}_count{format_labels(labels)} {values[-1]}')
+
+        out = []
+        for name, lines in series.items():
+            kind, help_text, _ = METRICS[name]
+            out.append(f'# HELP {name} {help_text}\n# TYPE {name} {kind}\n')
+            out.extend(line + '\n' for line in lines)
+        for name, (help_text, fn) in self._gauges.items():
+            value = fn()
+            if value is not None:
+                out.append(f'# HELP {name} {help_text}\n# TYPE {name} gauge\n{name} {format_value(value)}\n')
+        return ''.join(out)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+
+
+class QueryMetricsMixin:
+    """Database mixin timing every query into the registry."""
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params, *args, **kwargs)
+        finally:
+            registry.observe_query(time.perf_counter() - start, sql, params)
+
+
+class MetricsSqliteDatabase(QueryMetricsMixin, SqliteDatabase):
+    pass
+
+
+def start_request_timer():
+    """before_request hook."""
+    shard = registry.shard()
+    g.metrics_start = (time.perf_counter(), shard.query_count, shard.query_seconds)
+
+
+def record_request(response):
+    """after_request hook: count the request and add a Server-Timing header."""
+    started = g.pop('metrics_start', None)
+    if started is None:
+        return response
+    start, query_count, query_seconds = started
+    elapsed = time.perf_counter() - start
+    shard = registry.shard()
+    queries = shard.query_count - query_count
+    db_seconds = shard.query_seconds - query_seconds
+
+    # The rule, not the path, so /api/timeline_post/<id> is one series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (('method', request.method), ('route', route))
+    shard.inc('http_requests_total', (*labels, ('status', str(response.status_code))))
+    shard.observe('http_request_duration_seconds', labels, elapsed)
+    shard.observe('http_request_db_queries', labels, queries)
+    shard.inc('http_request_db_seconds_total', labels, db_seconds)
+
+    # Shown in the browser's network panel; whatever isn't db is Python
+    # (serialization, rendering)
+    response.headers['Server-Timing'] = (f'db;dur={db_seconds * 1000:.2f};desc="{queries} queries", '
+                                         f'app;dur={elapsed * 1000:.2f}')
+    return response
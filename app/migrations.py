@@ -0,0 +1,199 @@
+import datetime
+from peewee import SQL, Model, IntegerField, CharField, DateTimeField, Index, Table
+from app.dbutil import is_sqlite
+from app.idempotency import IdempotencyEntry
+from app.ratelimit import RateLimitEntry
+from app.search import create_search_index
+
+# Versioned schema migrations.
+#
+# `create_tables(safe=True)` only creates missing tables, it never changes an
+# existing one, so anything added after the first deploy (indexes, columns)
+# lives here. Each migration runs once per database and is recorded in the
+# `schema_migrations` table. Migrations must also be safe on a fresh database
+# where the table was just created, so they check before they change things.
+
+MIGRATIONS = []
+
+
+class SchemaMigration(Model):
+    version = IntegerField(primary_key=True)
+    name = CharField()
+    applied_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = 'schema_migrations'
+
+
+def migration(version, name, atomic=True):
+    """Register a migration function, called as fn(db).
+
+    It runs in one transaction unless atomic=False, for migrations that
+    commit their own batches; those must be safe to run again after a crash.
+    """
+    def decorator(fn):
+        if any(m[0] == version for m in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        fn.atomic = atomic
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def create_index_if_missing(db, table_name, index_name, columns):
+    """Create an index unless one with that name already exists.
+
+    `columns` are column nodes, e.g. Table(...).c.created_at.desc().
+    """
+    if index_name in {index.name for index in db.get_indexes(table_name)}:
+        return False
+    db.execute(Index(index_name, Table(table_name), columns))
+    return True
+
+
+def drop_index_if_exists(db, table_name, index_name):
+    if index_name not in {index.name for index in db.get_indexes(table_name)}:
+        return False
+    db.execute_sql(f"DROP INDEX {index_name}" + ('' if is_sqlite(db) else f" ON {table_name}"))
+    return True
+
+
+def add_column_if_missing(db, table_name, column_name, ddl):
+    """Add a column (`ddl` is its SQL type and constraints) unless it exists."""
+    if column_name in {column.name for column in db.get_columns(table_name)}:
+        return False
+    db.execute_sql(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {ddl}")
+    return True
+
+
+@migration(1, 'timelinepost_created_at_id_index')
+def add_created_at_id_index(db):
+    # Serves the newest-first listing and keyset pagination without a filesort
+    posts = Table('timelinepost')
+    create_index_if_missing(db, 'timelinepost', 'timelinepost_created_at_id',
+                            [posts.c.created_at.desc(), posts.c.id.desc()])
+
+
+@migration(2, 'timelinepost_email_index')
+def add_email_index(db):
+    posts = Table('timelinepost')
+    create_index_if_missing(db, 'timelinepost', 'timelinepost_email',
+                            [posts.c.email])
+
+
+@migration(3, 'rate_limits_table')
+def add_rate_limits_table(db):
+    # Shared counters for the database rate limit backend
+    with db.bind_ctx([RateLimitEntry]):
+        db.create_tables([RateLimitEntry], safe=True)
+
+
+@migration(4, 'timelinepost_search_index')
+def add_search_index(db):
+    # FTS5 table on SQLite, FULLTEXT index on MariaDB/MySQL
+    create_search_index(db)
+
+
+@migration(5, 'timelinepost_deleted_at')
+def add_deleted_at(db):
+    # Soft deletes. Listing filters on deleted_at IS NULL and walks
+    # (created_at, id) within it; the purge range-scans the tombstones.
+    add_column_if_missing(db, 'timelinepost', 'deleted_at', 'DATETIME NULL')
+    posts = Table('timelinepost')
+    create_index_if_missing(db, 'timelinepost', 'timelinepost_deleted_at_created_at_id',
+                            [posts.c.deleted_at, posts.c.created_at.desc(), posts.c.id.desc()])
+    # Moderating by email filters on both; without deleted_at in this index
+    # the planner may walk every live post through the one above instead
+    create_index_if_missing(db, 'timelinepost', 'timelinepost_email_deleted_at',
+                            [posts.c.email, posts.c.deleted_at])
+    drop_index_if_exists(db, 'timelinepost', 'timelinepost_email')
+
+
+# Posts hashed per transaction while backfilling content_hash
+BACKFILL_BATCH_SIZE = 5000
+
+
+def backfill_content_hash(db, batch_size=BACKFILL_BATCH_SIZE):
+    """Hash the posts that have no content_hash yet, one id range per transaction."""
+    from app import post_content_hash  # app imports this module
+    posts = Table('timelinepost')
+    missing = posts.c.content_hash.is_null()
+    low, high = db.execute(posts.select(SQL('MIN(id)'), SQL('MAX(id)')).where(missing)).fetchone()
+    if low is None:
+        return
+    for start in range(low, high + 1, batch_size):
+        in_range = missing & posts.c.id.between(start, start + batch_size - 1)
+        with db.atomic():
+            if not is_sqlite(db):
+                # Same bytes as post_content_hash(): utf8mb4 email, NUL, content
+                db.execute(posts.update({posts.c.content_hash: SQL(
+                    "SHA2(CONCAT(email, CHAR(0 USING utf8mb4), content), 256)")}).where(in_range))
+                continue
+            # SQLite has no SHA2(): hash in Python, one statement per batch
+            rows = db.execute(posts.select(posts.c.id, posts.c.email, posts.c.content).where(in_range))
+            db.cursor().executemany("UPDATE timelinepost SET content_hash = ? WHERE id = ?",
+                                    [(post_content_hash(email, content), post_id)
+                                     for post_id, email, content in rows])
+
+
+@migration(6, 'timelinepost_content_hash', atomic=False)
+def add_content_hash(db):
+    # Duplicate suppression looks for the same (email, content) hash posted
+    # within the last few minutes. Existing posts are hashed too, so every
+    # row carries a hash and the index covers the whole table. The backfill
+    # commits one id range at a time rather than holding a transaction over
+    # the whole table; a run cut short picks up the rows still missing.
+    add_column_if_missing(db, 'timelinepost', 'content_hash', 'CHAR(64) NULL')
+    backfill_content_hash(db)
+    posts = Table('timelinepost')
+    create_index_if_missing(db, 'timelinepost', 'timelinepost_content_hash_created_at',
+                            [posts.c.content_hash, posts.c.created_at])
+
+
+@migration(7, 'idempotency_keys_table')
+def add_idempotency_keys_table(db):
+    # Stored responses for the database idempotency backend
+    with db.bind_ctx([IdempotencyEntry]):
+        db.create_tables([IdempotencyEntry], safe=True)
+
+
+@migration(8, 'timelinepost_provisional_id')
+def add_provisional_id(db):
+    # Posts accepted in write-behind mode are looked up by the id their
+    # 202 response carried
+    add_column_if_missing(db, 'timelinepost', 'provisional_id', 'CHAR(32) NULL')
+    posts = Table('timelinepost')
+    create_index_if_missing(db, 'timelinepost', 'timelinepost_provisional_id',
+                            [posts.c.provisional_id])
+
+
+def migrate(db):
+    """Apply all pending migrations in order and return their names."""
+    applied = []
+    with db.bind_ctx([SchemaMigration]):
+        db.create_tables([SchemaMigration], safe=True)
+        done = {row.version for row in SchemaMigration.select(SchemaMigration.version)}
+        for version, name, fn in MIGRATIONS:
+            if version in done:
+                continue
+            if fn.atomic:
+                with db.atomic():
+                    fn(db)
+                    SchemaMigration.create(version=version, name=name)
+            else:
+                fn(db)
+                SchemaMigration.create(version=version, name=name)
+            applied.append(name)
+    return applied
+
+
+def migration_status(db):
+    """Return every known migration with the time it was applied (or None)."""
+    with db.bind_ctx([SchemaMigration]):
+        db.create_tables([SchemaMigration], safe=True)
+        applied = {row.version: row.applied_at for row in SchemaMigration.select()}
+    return [
+        {'version': version, 'name': name, 'applied_at': applied.get(version)}
+        for version, name, _ in MIGRATIONS
+    ]
@@ -0,0 +1,56 @@
+import threading
+import time
+from playhouse.pool import PooledMySQLDatabase, PooledSqliteDatabase
+from app.metrics import QueryMetricsMixin
+
+# Bounded connection pools for the app database.
+#
+# peewee's pool already caps the number of open connections (max_connections),
+# recycles connections idle for longer than stale_timeout, waits up to
+# `timeout` seconds for a free slot and, for MySQL, pings a connection before
+# handing it out again. The mixin below adds the occupancy and wait-time
+# numbers we want to watch in production.
+
+
+class PoolStatsMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def connect(self, reuse_if_open=False):
+        if not self.is_closed():
+            return super().connect(reuse_if_open)
+        start = time.perf_counter()
+        result = super().connect(reuse_if_open)
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return result
+
+    def pool_stats(self):
+        """Snapshot of pool occupancy and checkout wait times."""
+        with self._stats_lock:
+            checkouts = self._checkouts
+            total_wait = self._total_wait
+            max_wait = self._max_wait
+        return {
+            'max_connections': self._max_connections,
+            'in_use': len(self._in_use),
+            'idle': len(self._connections),
+            'checkouts': checkouts,
+            'avg_wait_ms': round(total_wait / checkouts * 1000, 3) if checkouts else 0.0,
+            'max_wait_ms': round(max_wait * 1000, 3),
+        }
+
+
+class StatsPooledMySQLDatabase(QueryMetricsMixin, PoolStatsMixin, PooledMySQLDatabase):
+    pass
+
+
+class StatsPooledSqliteDatabase(QueryMetricsMixin, PoolStatsMixin, PooledSqliteDatabase):
+    pass
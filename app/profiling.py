@@ -0,0 +1,157 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from flask import g, request
+from app.metrics import registry
+
+# Opt-in request profiling and slow-query logging.
+#
+# Nothing here runs unless it is switched on: with PROFILE_SAMPLE_RATE=0 and
+# no SLOW_QUERY_MS, no request hooks are registered and the query listener
+# on app.metrics stays None, so requests and queries cost exactly what they
+# did before.
+#
+# A profiled request (a PROFILE_SAMPLE_RATE fraction of all requests; 1
+# profiles every request) records every query it runs with its parameters
+# and duration, and writes them to PROFILE_DIR as
+# <time>-<method>-<route>.json. With PROFILE_CPROFILE=true the request also
+# runs under cProfile and gets a .pstats file next to it, to be read with
+# `python -m pstats` or snakeviz. Queries slower than SLOW_QUERY_MS are
+# logged to the app.slow_queries logger (and SLOW_QUERY_LOG, if set) from
+# every request and background thread, profiled or not.
+
+slow_query_log = logging.getLogger('app.slow_queries')
+
+SLUG_RE = re.compile(r'[^A-Za-z0-9]+')
+
+
+class RequestProfile:
+    def __init__(self, cprofile=False):
+        self.start = time.perf_counter()
+        # (sql, params, seconds)
+        self.queries = []
+        self.profiler = cProfile.Profile() if cprofile else None
+        # Set by after_request; a request whose view raised has neither
+        self.name = None
+        self.status = None
+
+
+class Profiler:
+    def __init__(self, sample_rate=0.0, slow_query_ms=None, directory='profiles',
+                 cprofile=False, slow_query_file=None, sample=random.random):
+        self.sample_rate = sample_rate
+        self.slow_query_seconds = slow_query_ms / 1000 if slow_query_ms is not None else None
+        self.slow_query_file = slow_query_file
+        self.directory = directory
+        self.cprofile = cprofile
+        self.sample = sample
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls):
+        slow_query_ms = os.getenv("SLOW_QUERY_MS")
+        return cls(sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+                   slow_query_ms=float(slow_query_ms) if slow_query_ms else None,
+                   directory=os.getenv("PROFILE_DIR", "profiles"),
+                   cprofile=os.getenv("PROFILE_CPROFILE") == "true",
+                   slow_query_file=os.getenv("SLOW_QUERY_LOG"))
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or self.slow_query_seconds is not None
+
+    def init_app(self, app):
+        registry.query_listener = self.on_query if self.enabled else None
+        if not self.enabled:
+            return
+        app.extensions['profiler'] = self
+        if self.slow_query_file:
+            add_log_file(slow_query_log, self.slow_query_file)
+        if self.sample_rate > 0:
+            app.before_request(self.start_request)
+            app.after_request(self.tag_response)
+            # Teardown runs even when the view raises, so the profiler is
+            # never left running on the thread
+            app.teardown_request(self.finish_request)
+
+    def on_query(self, sql, params, seconds):
+        profile = getattr(self._local, 'profile', None)
+        if profile is not None:
+            profile.queries.append((sql, params, seconds))
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            slow_query_log.warning('slow query (%.1f ms): %s %s', seconds * 1000, sql,
+                                   json.dumps(plain_params(params)))
+
+    def start_request(self):
+        self._local.profile = None
+        if self.sample() >= self.sample_rate:
+            return
+        profile = self._local.profile = RequestProfile(self.cprofile)
+        g.profile = profile
+        if profile.profiler is not None:
+            try:
+                profile.profiler.enable()
+            except ValueError:
+                # Python 3.12+ allows one active profiler per process; another
+                # request already has it, so this one records queries only
+                profile.profiler = None
+
+    @staticmethod
+    def report_name():
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        return f'{time.time_ns()}-{request.method}-{SLUG_RE.sub("_", route).strip("_") or "index"}'
+
+    def tag_response(self, response):
+        profile = g.get('profile')
+        if profile is not None:
+            profile.name = self.report_name()
+            profile.status = response.status_code
+            response.headers['X-Profile'] = profile.name
+        return response
+
+    def finish_request(self, exc=None):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        if profile.profiler is not None:
+            profile.profiler.disable()
+        self._local.profile = None
+        elapsed = time.perf_counter() - profile.start
+
+        name = profile.name or self.report_name()
+        os.makedirs(self.directory, exist_ok=True)
+        report = {
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'route': request.url_rule.rule if request.url_rule else 'unmatched',
+            'status': profile.status if profile.status is not None else 500,
+            'duration_ms': round(elapsed * 1000, 3),
+            'db_ms': round(sum(seconds for _, _, seconds in profile.queries) * 1000, 3),
+            'queries': [{'sql': sql, 'params': plain_params(params), 'ms': round(seconds * 1000, 3)}
+                        for sql, params, seconds in profile.queries],
+        }
+        if exc is not None:
+            report['error'] = repr(exc)
+        with open(os.path.join(self.directory, f'{name}.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+        if profile.profiler is not None:
+            profile.profiler.dump_stats(os.path.join(self.directory, f'{name}.pstats'))
+
+
+def plain_params(params):
+    """Query parameters as JSON-friendly values (dates and bytes as strings)."""
+    return [p if p is None or isinstance(p, (str, int, float)) else str(p) for p in params or ()]
+
+
+def add_log_file(logger, path):
+    path = os.path.abspath(path)
+    if any(getattr(handler, 'baseFilename', None) == path for handler in logger.handlers):
+        return
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    logger.addHandler(handler)
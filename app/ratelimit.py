@@ -0,0 +1,287 @@
+import fcntl
+import functools
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, request, jsonify
+from peewee import Model, CharField, DoubleField
+from app.metrics import registry as metrics
+from app.dbutil import lock_for_update, locked_transaction
+
+# Per-key rate limiting using the generic cell rate algorithm (GCRA).
+#
+# Each key stores a single number, its "theoretical arrival time" (TAT), so a
+# check is O(1) no matter how many clients we have seen. Where the TATs live
+# is up to the backend:
+#
+#   memory    per-process OrderedDict (default, one limit per worker)
+#   mmap      fixed-size hash table in a shared file, agreed on by every
+#             worker process on the node
+#   database  a table in the app database, agreed on by every worker that
+#             uses it
+#
+# Every backend keeps memory bounded: the memory backend evicts the least
+# recently seen key past max_keys, the mmap table has a fixed number of
+# slots, and the database backend periodically purges expired rows.
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_rate(rate):
+    """Parse '5/60' or '5/minute' into (limit, period_seconds)."""
+    try:
+        limit, period = rate.split('/')
+        period = PERIODS[period] if period in PERIODS else float(period)
+        limit = int(limit)
+    except (ValueError, KeyError):
+        raise ValueError(f"Invalid rate limit: {rate}")
+    if limit < 1 or period <= 0:
+        raise ValueError(f"Invalid rate limit: {rate}")
+    return limit, period
+
+
+def gcra(tat, now, interval, tolerance):
+    """One GCRA step: return (allowed, new_tat, retry_after_seconds)."""
+    tat = max(tat or now, now)
+    if tat - now > tolerance:
+        return False, tat, tat - now - tolerance
+    return True, tat + interval, 0.0
+
+
+class MemoryBackend:
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tats)
+
+    def hit(self, key, now, interval, tolerance):
+        with self._lock:
+            self._expire(now)
+            allowed, tat, retry_after = gcra(self._tats.get(key), now, interval, tolerance)
+            if allowed:
+                self._tats[key] = tat
+                self._tats.move_to_end(key)
+                if len(self._tats) > self.max_keys:
+                    self._tats.popitem(last=False)
+            return allowed, retry_after
+
+    def reset(self):
+        with self._lock:
+            self._tats.clear()
+
+    def _expire(self, now):
+        # Update order tracks expiry order closely (exactly, for bursts of 1),
+        # so stop at the first key that is still live. Each key is removed at
+        # most once, which keeps this amortized O(1) per hit.
+        while self._tats:
+            key, tat = next(iter(self._tats.items()))
+            if tat > now:
+                break
+            del self._tats[key]
+
+
+class MmapBackend:
+    """Open-addressing hash table of (key hash, TAT) slots in a shared file.
+
+    Workers map the same file, so they all see the same counters. Updates are
+    serialized across processes with a POSIX record lock (per process, so it
+    still works after fork) and across threads with a regular lock. A key is
+    looked for in `probes` consecutive slots; if it is not there it takes the
+    first expired slot, or evicts the one that expires soonest.
+    """
+    SLOT = struct.Struct('<Qd')
+
+    def __init__(self, path, slots=65536, probes=8):
+        self.path = path
+        self.slots = slots
+        self.probes = min(probes, slots)
+        size = self.SLOT.size * slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        now = time.time()
+        return sum(1 for i in range(self.slots) if self._read(i)[1] > now)
+
+    @staticmethod
+    def _hash(key):
+        # 0 marks an empty slot
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def _read(self, index):
+        return self.SLOT.unpack_from(self._mm, index * self.SLOT.size)
+
+    def hit(self, key, now, interval, tolerance):
+        key_hash = self._hash(key)
+        start = key_hash % self.slots
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                slot = stored = None
+                free = victim = None
+                for i in range(self.probes):
+                    index = (start + i) % self.slots
+                    slot_hash, tat = self._read(index)
+                    if slot_hash == key_hash:
+                        slot, stored = index, tat
+                        break
+                    if free is None and (slot_hash == 0 or tat <= now):
+                        free = index
+                    if victim is None or tat < victim[1]:
+                        victim = (index, tat)
+                if slot is None:
+                    slot = free if free is not None else victim[0]
+
+                allowed, tat, retry_after = gcra(stored, now, interval, tolerance)
+                if allowed:
+                    self.SLOT.pack_into(self._mm, slot * self.SLOT.size, key_hash, tat)
+                return allowed, retry_after
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def reset(self):
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                self._mm[:] = bytes(len(self._mm))
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+
+class RateLimitEntry(Model):
+    key = CharField(primary_key=True, max_length=191)
+    tat = DoubleField()
+
+    class Meta:
+        table_name = 'rate_limits'
+
+
+class DatabaseBackend:
+    """TATs stored in the `rate_limits` table (created by a migration)."""
+
+    def __init__(self, db, purge_every=1000):
+        self.db = db
+        self.purge_every = purge_every
+        self._hits = 0
+        db.bind([RateLimitEntry], bind_refs=False, bind_backrefs=False)
+
+    def __len__(self):
+        return RateLimitEntry.select().where(RateLimitEntry.tat > time.time()).count()
+
+    def hit(self, key, now, interval, tolerance):
+        # Make sure the row exists so SELECT ... FOR UPDATE locks it
+        RateLimitEntry.insert(key=key, tat=0).on_conflict_ignore().execute()
+        with locked_transaction(self.db):
+            query = RateLimitEntry.select(RateLimitEntry.tat).where(RateLimitEntry.key == key)
+            stored = lock_for_update(self.db, query).scalar()
+            allowed, tat, retry_after = gcra(stored, now, interval, tolerance)
+            if allowed:
+                RateLimitEntry.update(tat=tat).where(RateLimitEntry.key == key).execute()
+
+        self._hits += 1
+        if self._hits % self.purge_every == 0:
+            RateLimitEntry.delete().where(RateLimitEntry.tat <= now).execute()
+        return allowed, retry_after
+
+    def reset(self):
+        RateLimitEntry.delete().execute()
+
+
+def backend_from_env(db=None):
+    """Build the backend named by RATE_LIMIT_BACKEND (memory, mmap or database)."""
+    name = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    max_keys = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+    if name == 'memory':
+        return MemoryBackend(max_keys=max_keys)
+    if name == 'mmap':
+        path = os.getenv("RATE_LIMIT_MMAP_PATH",
+                         os.path.join(tempfile.gettempdir(), 'myportfolio-ratelimit'))
+        return MmapBackend(path, slots=max_keys)
+    if name == 'database':
+        if db is None:
+            raise ValueError("The database rate limit backend needs a database")
+        return DatabaseBackend(db)
+    raise ValueError(f"Unknown rate limit backend: {name}")
+
+
+class RateLimiter:
+    def __init__(self, limit, period, name='default', backend=None, enabled=True, clock=time.time):
+        self.limit = limit
+        self.period = period
+        self.name = name
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.enabled = enabled
+        self.clock = clock
+        # One request "costs" interval seconds; up to `limit` can burst at once
+        self.interval = period / limit
+        self.tolerance = period - self.interval
+
+    @classmethod
+    def from_env(cls, name, default, **kwargs):
+        """Build a limiter from RATE_LIMIT_<NAME> (e.g. '1/minute')."""
+        limit, period = parse_rate(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+        return cls(limit, period, name=name, **kwargs)
+
+    def __len__(self):
+        return len(self.backend)
+
+    def describe(self):
+        unit = next((name for name, seconds in PERIODS.items() if seconds == self.period), None)
+        per = unit if unit else f"{self.period:g} seconds"
+        return f"{self.limit} request{'s' if self.limit != 1 else ''} per {per}"
+
+    def hit(self, key):
+        """Count a request for `key`; return (allowed, retry_after_seconds)."""
+        # Limiters can share a backend, so namespace the key by limiter
+        return self.backend.hit(f"{self.name}:{key}", self.clock(),
+                                self.interval, self.tolerance)
+
+    def reset(self):
+        self.backend.reset()
+
+
+def client_key():
+    # remote_addr already honours X-Forwarded-For when the app is wrapped in
+    # ProxyFix (see TRUSTED_PROXY_COUNT), and is never taken from it otherwise.
+    return request.remote_addr
+
+
+def rate_limit(name, key_func=client_key):
+    """Reject requests over the named limiter's rate with 429 and a Retry-After header.
+
+    Limiters are built by create_app() and looked up in
+    app.extensions['rate_limiters'].
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            limiter = current_app.extensions['rate_limiters'][name]
+            if limiter.enabled:
+                allowed, retry_after = limiter.hit(key_func())
+                if not allowed:
+                    metrics.inc('rate_limit_rejections_total', (('limiter', name),))
+                    wait = max(1, math.ceil(retry_after))
+                    return jsonify({
+                        'error': f'Rate limit exceeded. Please wait {wait} seconds before making another request.',
+                        'rate_limit': limiter.describe()
+                    }), 429, {'Retry-After': str(wait)}
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
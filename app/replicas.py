@@ -0,0 +1,188 @@
+import functools
+import itertools
+import time
+from flask import current_app, g, request
+from peewee import InterfaceError, OperationalError
+from app.jobs import BackgroundThread
+from app.metrics import registry
+
+# Read/write splitting across a primary and read replicas.
+#
+# Writes always go to the primary. Read-only endpoints (marked with
+# @replica_read) ask read_database() for a database and get one replica for
+# the whole request, picked round-robin among the healthy ones, or the
+# primary when none qualifies.
+#
+# Replica lag is measured with a heartbeat: a monitor thread per process
+# writes the current time into a row on the primary every `check_interval`
+# seconds and reads it back from every replica, along with the replica's
+# timeline version. A replica whose heartbeat is more than `max_lag`
+# seconds old is skipped. Since the heartbeat is only written that often,
+# the estimate errs on the high side, never the low one.
+#
+# A client that just wrote gets a cookie with the time of the write, and its
+# reads stay on the primary until a replica's heartbeat has passed that
+# time, i.e. the replica has replicated the write. A conditional GET whose
+# ETag names timeline version N only goes to a replica that has reached N,
+# so a client never sees the timeline go back in time.
+#
+# A replica that fails a query is marked down for `retry_after` seconds and
+# the request is retried on the primary.
+
+REPLICA_ERRORS = (OperationalError, InterfaceError)
+WRITE_COOKIE = 'last_write'
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class Replica:
+    def __init__(self, database):
+        self.database = database
+        # From the last check: timeline version and heartbeat (epoch seconds)
+        self.version = None
+        self.heartbeat = None
+        self.down_until = 0.0
+
+
+class ReplicaRouter:
+    """Picks the database for reads.
+
+    `read_state(database) -> (timeline_version, heartbeat)` reads a
+    database's position and `write_heartbeat(database, now)` stamps the
+    primary. With `check_interval=None` no monitor thread is started and
+    check() has to be called by hand.
+    """
+
+    def __init__(self, primary, replicas, read_state, write_heartbeat, max_lag=5.0,
+                 check_interval=1.0, retry_after=30.0, clock=time.time):
+        self.primary = primary
+        self.replicas = [Replica(database) for database in replicas]
+        self.read_state = read_state
+        self.write_heartbeat = write_heartbeat
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.clock = clock
+        self._next = itertools.count()
+        self._background = BackgroundThread(self._run, 'replica-monitor', self.stop)
+
+    def check(self):
+        """Stamp the primary, then read every replica's position."""
+        now = self.clock()
+        try:
+            self.write_heartbeat(self.primary, now)
+        except REPLICA_ERRORS as e:
+            print(f"Writing the replica heartbeat failed: {e}")
+        for replica in self.replicas:
+            if replica.down_until > now:
+                continue
+            try:
+                replica.version, replica.heartbeat = self.read_state(replica.database)
+            except REPLICA_ERRORS as e:
+                print(f"Replica check failed: {e}")
+                self.mark_down(replica.database)
+            finally:
+                replica.database.close()
+
+    def mark_down(self, database):
+        for replica in self.replicas:
+            if replica.database is database:
+                replica.down_until = self.clock() + self.retry_after
+                replica.heartbeat = None
+
+    def lag(self, replica):
+        """Seconds of writes the replica may be missing (None if unknown)."""
+        if replica.heartbeat is None:
+            return None
+        return max(0.0, self.clock() - replica.heartbeat)
+
+    def healthy(self, replica, now):
+        lag = self.lag(replica)
+        return replica.down_until <= now and lag is not None and lag <= self.max_lag
+
+    def usable(self):
+        now = self.clock()
+        return sum(1 for replica in self.replicas if self.healthy(replica, now))
+
+    def reader(self, min_version=None, written_at=None):
+        """A replica that has `min_version` and the client's write at `written_at`, else the primary."""
+        self._ensure_started()
+        now = self.clock()
+        eligible = []
+        for replica in self.replicas:
+            if not self.healthy(replica, now):
+                continue
+            if min_version is not None and replica.version < min_version:
+                continue
+            if written_at is not None and replica.heartbeat < written_at:
+                continue
+            eligible.append(replica)
+        if not eligible:
+            return self.primary
+        return eligible[next(self._next) % len(eligible)].database
+
+    def close(self):
+        """Hand back this thread's replica connections (end of request)."""
+        for replica in self.replicas:
+            if not replica.database.is_closed():
+                replica.database.close()
+
+    def stop(self):
+        self._background.stopping.set()
+
+    def _ensure_started(self):
+        if self.check_interval is not None:
+            self._background.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Replica monitor failed: {e}")
+            finally:
+                if not self.primary.is_closed():
+                    self.primary.close()
+            if self._background.stopping.wait(self.check_interval):
+                return
+
+
+def replica_read(fn):
+    """Mark a read-only view as safe to serve from a replica.
+
+    If the replica fails mid-request it is marked down and the view runs
+    again on the primary.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except REPLICA_ERRORS:
+            router = current_app.extensions.get('replicas')
+            database = g.get('read_database')
+            if router is None or database is None or database is router.primary:
+                raise
+            router.mark_down(database)
+            registry.inc('db_replica_failovers_total')
+            g.read_database = router.primary
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def remember_write(response):
+    """after_request hook: stamp clients that wrote with the time of the write."""
+    router = current_app.extensions.get('replicas')
+    if router is None or request.method not in UNSAFE_METHODS or response.status_code >= 400:
+        return response
+    # Any replica fresh enough to serve reads has replicated the write once
+    # max_lag has passed, so the cookie can expire then
+    response.set_cookie(WRITE_COOKIE, str(int(router.clock() * 1000)),
+                        max_age=int(router.max_lag) + 1, httponly=True, samesite='Lax')
+    return response
+
+
+def last_write_time(request):
+    """When this client last wrote (epoch seconds), from its cookie."""
+    try:
+        return int(request.cookies[WRITE_COOKIE]) / 1000
+    except (KeyError, ValueError):
+        return None
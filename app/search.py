@@ -0,0 +1,118 @@
+import re
+from app.dbutil import is_sqlite
+
+# Full-text search over timeline post names and content.
+#
+# SQLite (tests, small deployments) gets an FTS5 table over timelinepost,
+# MariaDB/MySQL a FULLTEXT index on the table itself. Both are created by a
+# migration. The FTS5 table is an external-content index kept in sync by
+# triggers, so every write path (the API, bulk imports, the write-behind
+# flusher) updates it in the same transaction as the post; a FULLTEXT index
+# is maintained by InnoDB without help.
+#
+# User input never reaches the match syntax directly: it is split into word
+# tokens, every token is required and the last one is a prefix match, so
+# results can follow a search box as the user types.
+#
+# Ranking every match of a common word means scoring a large part of the
+# table, so only the newest RANK_WINDOW matches are ranked. On SQLite the
+# FTS5 index walks matches in rowid order and stops after the window, which
+# keeps a search for a common word as cheap as one for a rare word. MySQL
+# does not stop early: MATCH ... AGAINST collects and scores every matching
+# row before the ORDER BY id ... LIMIT applies, so the window there only
+# bounds the rows fetched and sorted by rank, and a common word still costs
+# time proportional to its matches. Rare words (fewer matches than the
+# window) are ranked in full on both.
+#
+# Soft-deleted posts stay in the index until they are purged and are
+# filtered out of the results (on SQLite after the window is taken, so they
+# can crowd a few live matches out of it in the meantime).
+
+FTS_TABLE = 'timelinepost_fts'
+FULLTEXT_INDEX = 'timelinepost_fulltext'
+MAX_QUERY_TERMS = 8
+RANK_WINDOW = 1000
+
+TERM_RE = re.compile(r'\w+')
+
+SQLITE_SCHEMA = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, content, content='timelinepost', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON timelinepost BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, content) VALUES (new.id, new.name, new.content); "
+    "END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON timelinepost BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, content) "
+    "VALUES ('delete', old.id, old.name, old.content); "
+    "END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE ON timelinepost BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, content) "
+    "VALUES ('delete', old.id, old.name, old.content); "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, content) VALUES (new.id, new.name, new.content); "
+    "END",
+]
+
+SQLITE_SEARCH = (
+    "SELECT p.id, p.name, p.email, p.content, p.created_at FROM ("
+    f"SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? "
+    "ORDER BY rowid DESC LIMIT ?"
+    ") AS hits JOIN timelinepost AS p ON p.id = hits.rowid "
+    "WHERE p.deleted_at IS NULL "
+    "ORDER BY hits.rank, p.id DESC LIMIT ? OFFSET ?"
+)
+
+MYSQL_SEARCH = (
+    "SELECT id, name, email, content, created_at FROM ("
+    "SELECT id, name, email, content, created_at, "
+    "MATCH(name, content) AGAINST (%s IN BOOLEAN MODE) AS score FROM timelinepost "
+    "WHERE MATCH(name, content) AGAINST (%s IN BOOLEAN MODE) AND deleted_at IS NULL "
+    "ORDER BY id DESC LIMIT %s"
+    ") AS hits ORDER BY score DESC, id DESC LIMIT %s OFFSET %s"
+)
+
+
+def create_search_index(db):
+    if is_sqlite(db):
+        for sql in SQLITE_SCHEMA:
+            db.execute_sql(sql)
+        # Index any posts that existed before the triggers
+        db.execute_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    elif FULLTEXT_INDEX not in {index.name for index in db.get_indexes('timelinepost')}:
+        db.execute_sql(f"ALTER TABLE timelinepost ADD FULLTEXT INDEX {FULLTEXT_INDEX} (name, content)")
+
+
+def drop_search_index(db):
+    if is_sqlite(db):
+        for suffix in ('insert', 'delete', 'update'):
+            db.execute_sql(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        db.execute_sql(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif FULLTEXT_INDEX in {index.name for index in db.get_indexes('timelinepost')}:
+        db.execute_sql(f"ALTER TABLE timelinepost DROP INDEX {FULLTEXT_INDEX}")
+
+
+def match_expression(q, sqlite=True):
+    """Turn free text into a match expression, or None if it has no words."""
+    terms = TERM_RE.findall(q)[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    if sqlite:
+        # Quoted, so words like OR/NOT/NEAR are searched for, not operators
+        return ' '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+    return ' '.join([f'+{term}' for term in terms[:-1]] + [f'+{terms[-1]}*'])
+
+
+def search_posts(db, q, limit, offset=0):
+    """Return raw post rows matching `q`, best match first.
+
+    Only the newest RANK_WINDOW matches are considered, so pages past that
+    offset are empty.
+    """
+    sqlite = is_sqlite(db)
+    expression = match_expression(q, sqlite)
+    if expression is None:
+        return []
+    if sqlite:
+        cursor = db.execute_sql(SQLITE_SEARCH, (expression, RANK_WINDOW, limit, offset))
+    else:
+        cursor = db.execute_sql(MYSQL_SEARCH, (expression, expression, RANK_WINDOW, limit, offset))
+    return cursor.fetchall()
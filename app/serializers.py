@@ -0,0 +1,57 @@
+import csv
+import datetime
+import io
+from json.encoder import encode_basestring_ascii as quote
+
+# Fast-path JSON for timeline posts.
+#
+# Rows are plain (id, name, email, content, created_at) tuples straight from
+# the database cursor, instead of hydrated model instances reflected over
+# with model_to_dict. created_at is left as the driver returns it (a datetime
+# from MySQL, a 'YYYY-MM-DD HH:MM:SS[.ffffff]' string from SQLite) because
+# peewee's strptime-based conversion costs more than the rest of the work.
+# Each row is written straight into a string template; `quote` is the json
+# module's C string encoder, so there is no per-row dict and no generic
+# encoder dispatch.
+
+POST_JSON = '{"id":%d,"name":%s,"email":%s,"content":%s,"created_at":"%s"}'
+
+
+def format_timestamp(value):
+    """ISO-8601 to the second, the precision MySQL DATETIME columns keep."""
+    if isinstance(value, str):
+        return value[:19].replace(' ', 'T')
+    return value.isoformat(sep='T', timespec='seconds')
+
+
+def parse_timestamp(value):
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+def post_json(row):
+    post_id, name, email, content, created_at = row
+    return POST_JSON % (post_id, quote(name), quote(email), quote(content),
+                        format_timestamp(created_at))
+
+
+def posts_json(rows):
+    return '[' + ','.join(map(post_json, rows)) + ']'
+
+
+def posts_ndjson(rows):
+    return ''.join([post_json(row) + '\n' for row in rows])
+
+
+CSV_HEADER = ('id', 'name', 'email', 'content', 'created_at')
+
+
+def posts_csv(rows, header=False):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(CSV_HEADER)
+    writer.writerows((post_id, name, email, content, format_timestamp(created_at))
+                     for post_id, name, email, content, created_at in rows)
+    return out.getvalue()
@@ -0,0 +1,152 @@
+import queue
+import threading
+import time
+from app.jobs import BackgroundThread
+
+# Write-behind queue for timeline posts.
+#
+# With TIMELINE_WRITE_BEHIND=true, POST /api/timeline_post only validates the
+# post and puts it on a bounded in-process queue; a background thread writes
+# queued posts in batches, every `flush_interval` seconds or `batch_size`
+# rows, whichever comes first. A full queue is reported to the caller
+# (QueueFull) so the handler can push back with 503 instead of piling up
+# threads. Pending posts are flushed when the process exits; posts still
+# queued when a worker is killed outright are lost, which is the trade-off
+# of this mode.
+
+
+class QueueFull(Exception):
+    pass
+
+
+# Queued by stop() behind the pending posts to wake the flusher and end it
+_STOP = object()
+
+
+class WriteBehindQueue:
+    def __init__(self, flush_fn, max_size=10_000, batch_size=500, flush_interval=0.05,
+                 retries=3, retry_delay=0.5):
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max_size)
+        self._background = BackgroundThread(self._run, 'timeline-write-behind', self.stop)
+        self._stats_lock = threading.Lock()
+        self._enqueued = 0
+        self._rejected = 0
+        self._flushed = 0
+        self._dropped = 0
+        self._flushes = 0
+        self._flush_time = 0.0
+        self._max_flush = 0.0
+        self._last_flush = 0.0
+
+    def submit(self, item):
+        """Queue `item` for writing; raise QueueFull when there is no room."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            raise QueueFull()
+        with self._stats_lock:
+            self._enqueued += 1
+
+    def stop(self, timeout=None):
+        """Wait for the flusher to write everything queued so far, then end it."""
+        background = self._background
+        if background.stopping.is_set():
+            return
+        background.stopping.set()
+        if background.running():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                return
+            background.thread.join(timeout)
+        else:
+            # The flusher isn't running in this process; drain inline
+            self._drain_inline()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'depth': self._queue.qsize(),
+                'max_size': self._queue.maxsize,
+                'enqueued': self._enqueued,
+                'rejected': self._rejected,
+                'flushed': self._flushed,
+                'dropped': self._dropped,
+                'flushes': self._flushes,
+                'last_flush_ms': round(self._last_flush * 1000, 3),
+                'avg_flush_ms': round(self._flush_time / self._flushes * 1000, 3) if self._flushes else 0.0,
+                'max_flush_ms': round(self._max_flush * 1000, 3),
+            }
+
+    def _ensure_started(self):
+        # Started lazily in the process that uses it, never in a gunicorn
+        # master before fork
+        self._background.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            # Gather more posts until the batch is full or the interval is up
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            if stopping:
+                return
+
+    def _drain_inline(self):
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.batch_size:
+                    item = self._queue.get_nowait()
+                    if item is not _STOP:
+                        batch.append(item)
+            except queue.Empty:
+                pass
+            if not batch:
+                return
+            self._flush(batch)
+
+    def _flush(self, batch):
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                self.flush_fn(batch)
+            except Exception as e:
+                print(f"Write-behind flush of {len(batch)} posts failed (attempt {attempt + 1}): {e}")
+                if attempt < self.retries:
+                    time.sleep(self.retry_delay)
+                continue
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self._flushed += len(batch)
+                self._flushes += 1
+                self._flush_time += elapsed
+                self._max_flush = max(self._max_flush, elapsed)
+                self._last_flush = elapsed
+            return
+        with self._stats_lock:
+            self._dropped += len(batch)
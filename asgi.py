@@ -0,0 +1,11 @@
+# ASGI entry point for the async serving mode, e.g. `uvicorn asgi:app`
+# (APP_SERVER=uvicorn in entrypoint.sh)
+
+import os
+
+from app import create_app
+from app.asgi import AsgiAdapter
+
+app = AsgiAdapter(create_app(),
+                  max_workers=int(os.getenv("ASGI_THREADS", "8")),
+                  max_pending=int(os.getenv("ASGI_MAX_PENDING", "1000")))
@@ -0,0 +1,96 @@
+"""Hot-query latency before and after archiving old timeline posts.
+
+Usage:
+    python benchmarks/bench_archive.py [rows] [table|ndjson]
+
+Builds a throwaway SQLite file with `rows` posts (default 500,000) spread
+evenly over five years, with the migrations applied, and times the hot
+queries, then archives everything older than a year and times them again.
+Pages from an old cursor, which now come from the archive, are timed too.
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+os.environ['TESTING'] = 'true'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from peewee import SqliteDatabase, chunked
+from app import TimelinePost, db, keyset_rows, timeline_page_query, MODELS
+from app.archive import Archive, NdjsonBackend, TableBackend
+from app.migrations import migrate
+from app.search import search_posts
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+BACKEND = sys.argv[2] if len(sys.argv) > 2 else 'table'
+REPEAT = 20
+NOW = datetime.datetime(2025, 1, 1)
+SPAN = datetime.timedelta(days=5 * 365)
+
+
+def populate(rows):
+    step = SPAN / rows
+    data = ({'name': f'User {i}', 'email': f'user{i % 5000}@example.com',
+             'content': f'Post number {i} about engines' if i % 100 == 0 else f'Post number {i}',
+             'created_at': NOW - SPAN + step * i}
+            for i in range(rows))
+    with db.atomic():
+        for batch in chunked(data, 5000):
+            TimelinePost.insert_many(batch).execute()
+
+
+def timed(fn):
+    best = float('inf')
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def inserts(count=200):
+    t0 = time.perf_counter()
+    for i in range(count):
+        with db.atomic():
+            TimelinePost.create(name='Bench', email='bench@example.com', content=f'New post {i}')
+    return (time.perf_counter() - t0) / count * 1000
+
+
+def run(label, archive):
+    month_ago = (NOW - datetime.timedelta(days=30), 0)
+    three_years_ago = (NOW - datetime.timedelta(days=3 * 365), 0)
+    print(f'--- {label} ({TimelinePost.select().count()} posts in the hot table) ---')
+    print(f'first page:            {timed(lambda: timeline_page_query(20, archive=archive)):8.3f} ms')
+    print(f'page a month back:     {timed(lambda: timeline_page_query(20, before=month_ago, archive=archive)):8.3f} ms')
+    print(f'search "engines":      {timed(lambda: search_posts(db, "engines", 21)):8.3f} ms')
+    print(f'insert (with indexes): {inserts():8.3f} ms')
+    print(f'page three years back: '
+          f'{timed(lambda: timeline_page_query(20, before=three_years_ago, archive=archive)):8.3f} ms')
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db.initialize(SqliteDatabase(os.path.join(tmp, 'bench.db')))
+        db.create_tables(MODELS)
+        migrate(db)
+        print(f'Populating {ROWS} rows...')
+        populate(ROWS)
+        if BACKEND == 'ndjson':
+            backend = NdjsonBackend(os.path.join(tmp, 'archive'))
+        else:
+            backend = TableBackend(db, keyset_rows)
+        archive = Archive(db, TimelinePost, backend, after_days=365)
+
+        run('before archiving', archive)
+        t0 = time.perf_counter()
+        moved = archive.run(now=NOW, batch_size=5000, pause=0)
+        print(f'\nArchived {sum(moved.values())} posts into {len(moved)} {BACKEND} segments '
+              f'in {time.perf_counter() - t0:.1f} s\n')
+        run('after archiving', archive)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
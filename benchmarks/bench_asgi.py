@@ -0,0 +1,168 @@
+"""Concurrent-connection capacity: gunicorn (gthread) vs. uvicorn with the ASGI adapter.
+
+Usage:
+    python benchmarks/bench_asgi.py [threads]
+
+Serves the app from a subprocess both ways, each with `threads` request
+threads (default 8) in one process, against a SQLite file of 1,000 posts.
+For each number of slow clients (each holding a POST open and uploading
+its body one byte every 200 ms, like a phone on a bad connection), a fast
+client sends GET /api/timeline_post requests one after another, each with
+a 5 second timeout, and the median latency and number of timeouts are
+reported. A row gives up after GIVE_UP_AFTER timeouts.
+"""
+import datetime
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+os.environ['TESTING'] = 'true'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from peewee import SqliteDatabase
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1] != '--serve' else 8
+SLOW_CLIENTS = (0, 4, 16, 64, 256)
+FAST_REQUESTS = 30
+TIMEOUT = 5
+GIVE_UP_AFTER = 3
+
+
+def serve(mode, port, path, threads):
+    from app import create_app, db
+    db.initialize(SqliteDatabase(path))
+    app = create_app()
+    if mode == 'sync':
+        from gunicorn.app.base import BaseApplication
+
+        class Server(BaseApplication):
+            def load_config(self):
+                for key, value in {'bind': f'127.0.0.1:{port}', 'workers': 1, 'threads': threads,
+                                   'worker_class': 'gthread', 'loglevel': 'warning'}.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                return app
+        Server().run()
+    else:
+        import uvicorn
+        from app.asgi import AsgiAdapter
+        uvicorn.run(AsgiAdapter(app, max_workers=threads), host='127.0.0.1', port=port,
+                    log_level='warning')
+
+
+def populate(path):
+    from app import TimelinePost, Counter, MODELS, db
+    db.initialize(SqliteDatabase(path))
+    db.create_tables(MODELS)
+    start = datetime.datetime(2020, 1, 1)
+    with db.atomic():
+        TimelinePost.insert_many({'name': f'User {i}', 'email': f'user{i}@example.com',
+                                  'content': f'Post {i}', 'created_at': start + datetime.timedelta(seconds=i)}
+                                 for i in range(1000)).execute()
+        Counter.create(name='timeline', value=1)
+    db.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port):
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+class SlowClients:
+    """Connections uploading a request body one byte at a time."""
+
+    def __init__(self, port, count):
+        self.sockets = []
+        for _ in range(count):
+            s = socket.create_connection(('127.0.0.1', port))
+            s.sendall(b'POST /api/timeline_post HTTP/1.1\r\nHost: localhost\r\n'
+                      b'Content-Type: application/x-www-form-urlencoded\r\nContent-Length: 10000\r\n\r\n')
+            self.sockets.append(s)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.trickle, daemon=True)
+        self.thread.start()
+
+    def trickle(self):
+        while not self.stopping.wait(0.2):
+            for s in self.sockets:
+                try:
+                    s.send(b'a')
+                except OSError:
+                    pass
+
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
+        for s in self.sockets:
+            s.close()
+
+
+def fast_requests(port):
+    latencies, timeouts = [], 0
+    for _ in range(FAST_REQUESTS):
+        if timeouts == GIVE_UP_AFTER:
+            break
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=TIMEOUT)
+        start = time.perf_counter()
+        try:
+            conn.request('GET', '/api/timeline_post')
+            response = conn.getresponse()
+            response.read()
+            assert response.status == 200, response.status
+            latencies.append((time.perf_counter() - start) * 1000)
+        except (socket.timeout, TimeoutError):
+            timeouts += 1
+        finally:
+            conn.close()
+    return latencies, timeouts, len(latencies) + timeouts
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        populate(path)
+        print(f'{THREADS} request threads, {FAST_REQUESTS} fast requests per row ({TIMEOUT}s timeout)')
+        print(f'{"server":28} {"slow clients":>12} {"median ms":>10} {"timeouts":>9}')
+        for mode, label in (('sync', 'gunicorn gthread'), ('async', 'uvicorn + AsgiAdapter')):
+            port = free_port()
+            server = subprocess.Popen([sys.executable, __file__, '--serve', mode, str(port), path, str(THREADS)])
+            try:
+                wait_for(port)
+                for count in SLOW_CLIENTS:
+                    slow = SlowClients(port, count)
+                    time.sleep(0.5)
+                    try:
+                        latencies, timeouts, attempted = fast_requests(port)
+                    finally:
+                        slow.close()
+                    median = f'{statistics.median(latencies):10.2f}' if latencies else f'{"-":>10}'
+                    print(f'{label:28} {count:12} {median} {f"{timeouts}/{attempted}":>9}')
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve(sys.argv[2], int(sys.argv[3]), sys.argv[4], int(sys.argv[5]))
+    else:
+        main()
@@ -0,0 +1,64 @@
+"""Bulk import throughput (rows/sec) versus one INSERT per post.
+
+Usage:
+    python benchmarks/bench_bulk_import.py [rows]
+
+Generates `rows` NDJSON posts (default 100,000) and imports them into a
+SQLite file with app.import_posts at a few batch sizes. The per-row baseline
+(TimelinePost.create with autocommit, what POST /api/timeline_post does) is
+measured on a smaller sample because it is so much slower.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ['TESTING'] = 'true'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from peewee import SqliteDatabase
+from app import db as app_db, import_posts, MODELS, TimelinePost
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+BASELINE_ROWS = min(ROWS, 2_000)
+
+
+def make_lines(rows):
+    return [json.dumps({'name': f'Guest {i}', 'email': f'guest{i}@example.com',
+                        'content': f'Legacy guestbook entry {i}',
+                        'created_at': '2015-06-01T12:00:00'})
+            for i in range(rows)]
+
+
+def fresh_db(tmp, name):
+    db = SqliteDatabase(os.path.join(tmp, name))
+    app_db.initialize(db)
+    db.connect()
+    db.create_tables(MODELS)
+    return db
+
+
+def main():
+    lines = make_lines(ROWS)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = fresh_db(tmp, 'baseline.db')
+        start = time.perf_counter()
+        for line in lines[:BASELINE_ROWS]:
+            TimelinePost.create(**json.loads(line))
+        elapsed = time.perf_counter() - start
+        print(f'one INSERT per row     {BASELINE_ROWS / elapsed:10.0f} rows/s  ({BASELINE_ROWS} rows)')
+        db.close()
+
+        for batch_size in (100, 1000, 5000):
+            db = fresh_db(tmp, f'bulk-{batch_size}.db')
+            start = time.perf_counter()
+            inserted, failed, _ = import_posts(lines, batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+            assert inserted == ROWS and not failed
+            print(f'import_posts batch={batch_size:<5} {ROWS / elapsed:10.0f} rows/s  ({ROWS} rows)')
+            db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""CPU cost of response compression vs. bytes saved.
+
+Usage:
+    python benchmarks/bench_compression.py [posts]
+
+Renders a few typical responses from the app (the home page, the timeline
+page, a page of timeline JSON and a full NDJSON export of `posts` posts,
+default 1,000) and, for each, times gzip and brotli at a few levels and
+reports the compressed size. The middleware's defaults (gzip 6, brotli 4)
+are marked with *. The last table shows what a compressed response costs
+through the middleware when the compressed body is cached vs. not.
+"""
+import datetime
+import gzip
+import os
+import sys
+import time
+
+os.environ['TESTING'] = 'true'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import brotli
+from peewee import chunked
+from app import create_app, db, MODELS, TimelinePost
+from app.compression import BROTLI_QUALITY, GZIP_LEVEL
+
+POSTS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000
+REPEAT = 20
+
+CODECS = [('gzip', level, lambda data, level=level: gzip.compress(data, compresslevel=level, mtime=0))
+          for level in (1, 6, 9)]
+CODECS += [('br', quality, lambda data, quality=quality: brotli.compress(data, quality=quality))
+           for quality in (1, 4, 11)]
+
+
+def populate(posts):
+    start = datetime.datetime(2020, 1, 1)
+    data = ({'name': f'User {i}', 'email': f'user{i}@example.com',
+             'content': f'Post number {i}: went hiking today, the view from the top was great!',
+             'created_at': start + datetime.timedelta(seconds=i)}
+            for i in range(posts))
+    with db.atomic():
+        for batch in chunked(data, 5000):
+            TimelinePost.insert_many(batch).execute()
+
+
+def best_of(fn, *args):
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    app = create_app()
+    app.config['ADMIN_TOKEN'] = 'bench'
+    client = app.test_client()
+    db.connect(reuse_if_open=True)
+    db.create_tables(MODELS)
+    populate(POSTS)
+
+    responses = [
+        ('/', {}),
+        ('/timeline', {}),
+        ('/api/timeline_post?limit=100', {}),
+        ('/api/timeline_post/export', {'Authorization': 'Bearer bench'}),
+    ]
+    print(f'{"response":32} {"codec":8} {"bytes":>9} {"ratio":>6} {"ms":>8} {"MB/s":>7}')
+    for path, headers in responses:
+        body = client.get(path, headers=headers).get_data()
+        print(f'{path:32} {"none":8} {len(body):9}')
+        for name, level, fn in CODECS:
+            ms, compressed = best_of(fn, body)
+            default = '*' if (name, level) in (('gzip', GZIP_LEVEL), ('br', BROTLI_QUALITY)) else ' '
+            print(f'{"":32} {f"{name}-{level}{default}":8} {len(compressed):9} '
+                  f'{len(compressed) / len(body):6.1%} {ms:8.3f} {len(body) / ms / 1000:7.1f}')
+
+    print('\nthrough the middleware (Accept-Encoding: br, gzip), median request time')
+    for path in ('/', '/timeline'):
+        for label, clear in (('compressed per request', True), ('compressed body cached', False)):
+            times = []
+            for _ in range(REPEAT):
+                if clear:
+                    app.wsgi_app.cache.clear()
+                start = time.perf_counter()
+                client.get(path, headers={'Accept-Encoding': 'br, gzip'}).get_data()
+                times.append(time.perf_counter() - start)
+            times.sort()
+            print(f'{path:12} {label:24} {times[len(times) // 2] * 1000:7.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Cost of a retried POST /api/timeline_post with and without an Idempotency-Key.
+
+Usage:
+    python benchmarks/bench_idempotency.py [rows] [requests]
+
+Builds a throwaway SQLite file with `rows` posts (default 200,000) and the
+migrations applied, then times through the test client:
+
+- a new post (the duplicate check plus the INSERT)
+- a retry carrying the same Idempotency-Key, replayed from the memory and
+  the database backends
+- a retry without a key, turned away by the duplicate check
+- before this change a retry was simply another INSERT, which the first
+  row stands in for
+"""
+import os
+import sys
+import tempfile
+import time
+
+os.environ['TESTING'] = 'true'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from peewee import SqliteDatabase, chunked
+from app import TimelinePost, create_app, db, MODELS
+from app.idempotency import DatabaseBackend, IdempotencyKeys, MemoryBackend
+from app.migrations import migrate
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+REQUESTS = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+
+def populate(rows):
+    data = ({'name': f'User {i}', 'email': f'user{i % 5000}@example.com', 'content': f'Post number {i}'}
+            for i in range(rows))
+    with db.atomic():
+        for batch in chunked(data, 5000):
+            TimelinePost.insert_many(batch).execute()
+
+
+def per_request(client, make_request, expected_status):
+    t0 = time.perf_counter()
+    for i in range(REQUESTS):
+        data, headers = make_request(i)
+        response = client.post('/api/timeline_post', data=data, headers=headers)
+        assert response.status_code == expected_status, response.get_data()
+    return (time.perf_counter() - t0) / REQUESTS * 1000
+
+
+def post(prefix, key=False):
+    def make_request(i):
+        data = {'name': 'Bench', 'email': 'bench@example.com', 'content': f'{prefix} {i}'}
+        return data, {'Idempotency-Key': f'{prefix}-{i}'} if key else {}
+    return make_request
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db.initialize(SqliteDatabase(os.path.join(tmp, 'bench.db')))
+        db.create_tables(MODELS)
+        migrate(db)
+        print(f'Populating {ROWS} rows...')
+        populate(ROWS)
+        app = create_app()
+        client = app.test_client()
+
+        print(f'{"new post:":32}{per_request(client, post("new"), 201):7.3f} ms')
+        for name, backend in (('memory', MemoryBackend()), ('database', DatabaseBackend(db))):
+            app.extensions['idempotency'] = IdempotencyKeys(backend)
+            first = per_request(client, post(name, key=True), 201)
+            replay = per_request(client, post(name, key=True), 201)
+            print(f'{f"new post with a key, {name}:":32}{first:7.3f} ms')
+            print(f'{f"retry replayed from {name}:":32}{replay:7.3f} ms')
+        print(f'{"retry without a key (409):":32}{per_request(client, post("new"), 409):7.3f} ms')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Cost of recording metrics: per-thread shards vs. one lock-protected registry.
+
+Usage:
+    python benchmarks/bench_metrics.py [observations]
+
+Each of 1, 4 and 16 threads records `observations` (default 200,000)
+requests' worth of metrics split between them (a counter increment and
+a histogram observation per request) into app.metrics' sharded registry and
+into a registry guarded by a single lock, the obvious alternative. Then
+times a /metrics render with a realistic number of series.
+"""
+import bisect
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.metrics import DURATION_BUCKETS, MetricsRegistry
+
+OBSERVATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+LABELS = (('method', 'GET'), ('route', '/api/timeline_post'))
+STATUS_LABELS = (*LABELS, ('status', '200'))
+
+
+class LockedRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def record(self, value):
+        with self.lock:
+            key = ('http_requests_total', STATUS_LABELS)
+            self.counters[key] = self.counters.get(key, 0) + 1
+            key = ('http_request_duration_seconds', LABELS)
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * (len(DURATION_BUCKETS) + 3)
+            values[bisect.bisect_left(DURATION_BUCKETS, value)] += 1
+            values[-2] += value
+            values[-1] += 1
+
+
+def sharded_record(registry):
+    def record(value):
+        shard = registry.shard()
+        shard.inc('http_requests_total', STATUS_LABELS)
+        shard.observe('http_request_duration_seconds', LABELS, value)
+    return record
+
+
+def run(record, threads):
+    per_thread = OBSERVATIONS // threads
+
+    def work():
+        for i in range(per_thread):
+            record((i % 100) / 1000)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (per_thread * threads) * 1e9
+
+
+def main():
+    print(f'{OBSERVATIONS} requests recorded, ns per request')
+    for threads in (1, 4, 16):
+        sharded = run(sharded_record(MetricsRegistry()), threads)
+        locked = run(LockedRegistry().record, threads)
+        print(f'{threads:3} threads   sharded {sharded:7.0f}   single lock {locked:7.0f}')
+
+    registry = MetricsRegistry()
+    # ~20 routes x 2 methods x 3 statuses, plus query histograms
+    for route in range(20):
+        for method in ('GET', 'POST'):
+            labels = (('method', method), ('route', f'/route/{route}'))
+            for status in ('200', '304', '400'):
+                registry.inc('http_requests_total', (*labels, ('status', status)))
+            registry.shard().observe('http_request_duration_seconds', labels, 0.01)
+            registry.shard().observe('http_request_db_queries', labels, 2)
+    for _ in range(10):
+        threading.Thread(target=registry.observe_query, args=(0.001,)).start()
+    start = time.perf_counter()
+    for _ in range(100):
+        text = registry.render()
+    elapsed = (time.perf_counter() - start) / 100
+    print(f'render: {len(text.splitlines())} lines, {len(text)} bytes in {elapsed * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Overhead of request profiling on GET /api/timeline_post.
+
+Usage:
+    python benchmarks/bench_profiling.py [requests]
+
+Builds the app with profiling off, sampling 1% of requests, profiling every
+request, and profiling every request under cProfile, then times `requests`
+(default 2,000) uncached timeline requests through the test client against
+an in-memory database of 1,000 posts. Profiles go to a temporary directory.
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+os.environ['TESTING'] = 'true'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app, db, MODELS, Counter, TimelinePost
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+
+CONFIGS = [
+    ('off', {}),
+    ('1% sampled', {'PROFILE_SAMPLE_RATE': '0.01'}),
+    ('every request', {'PROFILE_SAMPLE_RATE': '1'}),
+    ('every request + cProfile', {'PROFILE_SAMPLE_RATE': '1', 'PROFILE_CPROFILE': 'true'}),
+]
+
+
+def main():
+    create_app()
+    db.connect(reuse_if_open=True)
+    db.create_tables(MODELS)
+    Counter.create(name='timeline', value=1)
+    start = datetime.datetime(2020, 1, 1)
+    TimelinePost.insert_many({'name': f'User {i}', 'email': f'user{i}@example.com',
+                              'content': f'Post {i}', 'created_at': start + datetime.timedelta(seconds=i)}
+                             for i in range(1000)).execute()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['PROFILE_DIR'] = tmp
+        for label, env in CONFIGS:
+            os.environ.update(env)
+            client = create_app().test_client()
+            for name in env:
+                del os.environ[name]
+            begin = time.perf_counter()
+            for _ in range(REQUESTS):
+                # A write between requests, so every request runs its queries
+                Counter.update(value=Counter.value + 1).where(Counter.name == 'timeline').execute()
+                client.get('/api/timeline_post')
+            elapsed = (time.perf_counter() - begin) / REQUESTS
+            print(f'{label:26} {elapsed * 1e6:8.0f} us per request')
+
+
+if __name__ == '__main__':
+    main()
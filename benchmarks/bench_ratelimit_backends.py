@@ -0,0 +1,83 @@
+"""Per-check latency of the rate limit backends under concurrent load.
+
+Usage:
+    python benchmarks/bench_ratelimit_backends.py [workers] [checks_per_worker]
+
+Forks `workers` processes (default 4) that each run `checks_per_worker`
+limiter checks (default 20,000) against random client keys, like gunicorn
+workers handling POSTs from many clients. The memory backend is per process
+and only shown as a baseline; mmap and database share state across workers.
+The database backend uses a SQLite file here.
+"""
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ['TESTING'] = 'true'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from peewee import SqliteDatabase
+from app.ratelimit import (RateLimiter, MemoryBackend, MmapBackend,
+                           DatabaseBackend, RateLimitEntry)
+
+WORKERS = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+CHECKS = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+CLIENTS = 5_000
+
+
+def make_backend(kind, tmp):
+    if kind == 'memory':
+        return MemoryBackend()
+    if kind == 'mmap':
+        return MmapBackend(os.path.join(tmp, 'ratelimit'), slots=100_000)
+    db = SqliteDatabase(os.path.join(tmp, 'ratelimit.db'), pragmas={'journal_mode': 'wal'})
+    return DatabaseBackend(db)
+
+
+def worker(args):
+    kind, tmp, seed = args
+    rng = random.Random(seed)
+    limiter = RateLimiter(5, 60, name='bench', backend=make_backend(kind, tmp))
+    timings = []
+    allowed = 0
+    for _ in range(CHECKS):
+        key = f'client-{rng.randrange(CLIENTS)}'
+        start = time.perf_counter()
+        allowed += limiter.hit(key)[0]
+        timings.append(time.perf_counter() - start)
+    return timings, allowed
+
+
+def run(kind):
+    with tempfile.TemporaryDirectory() as tmp:
+        if kind == 'database':
+            db = SqliteDatabase(os.path.join(tmp, 'ratelimit.db'), pragmas={'journal_mode': 'wal'})
+            with db.bind_ctx([RateLimitEntry]):
+                db.create_tables([RateLimitEntry])
+            db.close()
+
+        start = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(WORKERS) as pool:
+            results = pool.map(worker, [(kind, tmp, seed) for seed in range(WORKERS)])
+        elapsed = time.perf_counter() - start
+
+    timings = sorted(t for worker_timings, _ in results for t in worker_timings)
+    allowed = sum(a for _, a in results)
+    p = lambda q: timings[int(q * (len(timings) - 1))] * 1e6
+    print(f'{kind:<9} p50 {p(0.50):8.1f} us  p99 {p(0.99):8.1f} us  '
+          f'mean {statistics.mean(timings) * 1e6:8.1f} us  '
+          f'{len(timings) / elapsed:10.0f} checks/s  allowed {allowed}')
+
+
+def main():
+    print(f'{WORKERS} workers x {CHECKS} checks')
+    for kind in ('memory', 'mmap', 'database'):
+        run(kind)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Timeline search: LIKE '%term%' table scan vs the FTS5 index.
+
+Usage:
+    python benchmarks/bench_search.py [rows]
+
+Builds a throwaway SQLite file with `rows` posts (default 1,000,000) of
+random words, applies the migrations (which build the FTS5 index) and times
+a few searches both ways: a rare word, a common word and a two-word prefix
+query like the ones a search box sends while the user types.
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ['TESTING'] = 'true'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from peewee import SqliteDatabase, chunked
+from app import TimelinePost, POST_COLUMNS, fetch_rows
+from app.migrations import migrate
+from app.search import search_posts
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REPEAT = 5
+LIMIT = 20
+
+WORDS = [f'word{i}' for i in range(20_000)]
+QUERIES = ['zanzibar', 'hello', 'hello zanz']
+
+
+def populate(db, rows):
+    rng = random.Random(42)
+    start = datetime.datetime(2020, 1, 1)
+
+    def content(i):
+        words = rng.choices(WORDS, k=12)
+        # A rare word in one post out of ten thousand, a common one everywhere
+        if i % 10_000 == 0:
+            words.append('zanzibar')
+        if i % 3 == 0:
+            words.append('hello')
+        return ' '.join(words)
+
+    data = ({'name': f'User {i}', 'email': f'user{i % 5000}@example.com',
+             'content': content(i), 'created_at': start + datetime.timedelta(seconds=i)}
+            for i in range(rows))
+    with db.atomic():
+        for batch in chunked(data, 5000):
+            TimelinePost.insert_many(batch).execute()
+
+
+def like_search(q):
+    terms = q.split()
+    query = TimelinePost.select(*POST_COLUMNS)
+    for term in terms[:-1]:
+        query = query.where(TimelinePost.content.contains(term) | TimelinePost.name.contains(term))
+    last = terms[-1]
+    query = query.where(TimelinePost.content.contains(last) | TimelinePost.name.contains(last))
+    return fetch_rows(query.order_by(TimelinePost.created_at.desc()).limit(LIMIT))
+
+
+def best_of(fn, *args):
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        rows = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, len(rows)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SqliteDatabase(os.path.join(tmp, 'search.db'))
+        with db.bind_ctx([TimelinePost]):
+            db.create_tables([TimelinePost])
+            start = time.perf_counter()
+            populate(db, ROWS)
+            print(f'inserted {ROWS} posts in {time.perf_counter() - start:.1f}s')
+            start = time.perf_counter()
+            migrate(db)
+            print(f'migrations (FTS5 build) took {time.perf_counter() - start:.1f}s')
+
+            for q in QUERIES:
+                like_ms, like_rows = best_of(like_search, q)
+                fts_ms, fts_rows = best_of(search_posts, db, q, LIMIT)
+                print(f'{q!r:14} LIKE {like_ms:9.1f} ms ({like_rows:2} rows)   '
+                      f'FTS5 {fts_ms:8.2f} ms ({fts_rows:2} rows)')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
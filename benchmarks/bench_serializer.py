@@ -0,0 +1,73 @@
+"""Timeline JSON serialization: model_to_dict + jsonify vs app.serializers.
+
+Usage:
+    python benchmarks/bench_serializer.py [rows ...]
+
+For each row count (default 10,000 and 100,000) it times query + serialize
+for the old path (hydrated models, model_to_dict, jsonify) and the fast path
+(raw column tuples, posts_json), against an in-memory SQLite table.
+"""
+import datetime
+import os
+import sys
+import time
+
+os.environ['TESTING'] = 'true'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import jsonify
+from peewee import SqliteDatabase, chunked
+from playhouse.shortcuts import model_to_dict
+from app import create_app, fetch_rows, TimelinePost, POST_COLUMNS
+from app.serializers import posts_json
+
+SIZES = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000]
+REPEAT = 5
+
+
+def populate(rows):
+    start = datetime.datetime(2024, 1, 1)
+    data = ({'name': f'User {i}', 'email': f'user{i}@example.com',
+             'content': f'Hello world, this is post number {i} "quoted" é',
+             'created_at': start + datetime.timedelta(seconds=i)}
+            for i in range(rows))
+    for batch in chunked(data, 5000):
+        TimelinePost.insert_many(batch).execute()
+
+
+def old_path():
+    posts = TimelinePost.select().order_by(TimelinePost.created_at.desc())
+    return jsonify([model_to_dict(post) for post in posts]).get_data()
+
+
+def new_path():
+    rows = fetch_rows(TimelinePost.select(*POST_COLUMNS)
+                      .order_by(TimelinePost.created_at.desc()))
+    return posts_json(rows).encode()
+
+
+def best_of(fn):
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    app = create_app()
+    for rows in SIZES:
+        db = SqliteDatabase(':memory:')
+        with db.bind_ctx([TimelinePost]), app.app_context():
+            db.create_tables([TimelinePost])
+            populate(rows)
+            old_ms = best_of(old_path)
+            new_ms = best_of(new_path)
+        db.close()
+        print(f'{rows:>8} rows  model_to_dict {old_ms:9.1f} ms   '
+              f'posts_json {new_ms:9.1f} ms   {old_ms / new_ms:5.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
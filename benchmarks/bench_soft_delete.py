@@ -0,0 +1,119 @@
+"""Cost of deleting posts, and of purging tombstones in batches.
+
+Usage:
+    python benchmarks/bench_soft_delete.py [rows]
+
+Builds a throwaway SQLite file with `rows` posts (default 200,000) and the
+migrations applied, then compares:
+
+- the old DELETE path (get + delete_instance, two statements) with the
+  single-statement soft delete
+- moderating one address's posts in one UPDATE
+- the first timeline page with 10% of the table tombstoned
+- purging every tombstone in one DELETE versus in batches: the longest
+  single transaction is how long writers queue behind the purge
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+os.environ['TESTING'] = 'true'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from peewee import OP, Expression, SqliteDatabase, chunked
+from app import TimelinePost, db, purge_deleted_posts, soft_delete_posts, timeline_page_query, MODELS
+from app.migrations import migrate
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+DELETES = 1000
+
+
+def populate(rows):
+    start = datetime.datetime(2020, 1, 1)
+    data = ({'name': f'User {i}', 'email': f'user{i % 5000}@example.com',
+             'content': f'Post number {i}', 'created_at': start + datetime.timedelta(seconds=i)}
+            for i in range(rows))
+    with db.atomic():
+        for batch in chunked(data, 5000):
+            TimelinePost.insert_many(batch).execute()
+
+
+def per_delete(fn, ids):
+    t0 = time.perf_counter()
+    for post_id in ids:
+        with db.atomic():
+            fn(post_id)
+    return (time.perf_counter() - t0) / len(ids) * 1000
+
+
+def hard_delete(post_id):
+    TimelinePost.get(TimelinePost.id == post_id).delete_instance()
+
+
+def soft_delete(post_id):
+    soft_delete_posts(TimelinePost.id == post_id)
+
+
+def tombstone_every_tenth(offset=0):
+    TimelinePost.update(deleted_at=datetime.datetime(2020, 1, 1)).where(
+        # Expression rather than %, which peewee turns into LIKE
+        (Expression(TimelinePost.id, OP.MOD, 10) == offset) & TimelinePost.deleted_at.is_null()).execute()
+
+
+def timed_page():
+    t0 = time.perf_counter()
+    timeline_page_query(20)
+    return (time.perf_counter() - t0) * 1000
+
+
+def purge(batch_size):
+    """Purge all tombstones; return (total ms, longest transaction ms)."""
+    marks = [time.perf_counter()]
+    batches = []
+
+    def pause(seconds):
+        now = time.perf_counter()
+        batches.append(now - marks[-1])
+        marks.append(now)
+
+    purge_deleted_posts(datetime.datetime(2021, 1, 1), batch_size=batch_size, pause=0, sleep=pause)
+    end = time.perf_counter()
+    batches.append(end - marks[-1])
+    return (end - marks[0]) * 1000, max(batches) * 1000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db.initialize(SqliteDatabase(os.path.join(tmp, 'bench.db')))
+        db.create_tables(MODELS)
+        migrate(db)
+        print(f'Populating {ROWS} rows...')
+        populate(ROWS)
+
+        hard = per_delete(hard_delete, range(1, DELETES + 1))
+        soft = per_delete(soft_delete, range(DELETES + 1, 2 * DELETES + 1))
+        print(f'delete, get + delete_instance: {hard:6.3f} ms')
+        print(f'delete, one UPDATE:            {soft:6.3f} ms')
+
+        t0 = time.perf_counter()
+        with db.atomic():
+            moderated = soft_delete_posts(TimelinePost.email == 'user42@example.com')
+        print(f'moderate one address ({moderated} posts): {(time.perf_counter() - t0) * 1000:.2f} ms')
+
+        tombstone_every_tenth()
+        best = min(timed_page() for _ in range(20))
+        print(f'first page, 10% tombstones:    {best:6.3f} ms')
+
+        for offset, batch_size in enumerate((ROWS, 5000, 500)):
+            # A fresh tenth each round; the previous one has been purged
+            tombstone_every_tenth(offset)
+            total, longest = purge(batch_size)
+            print(f'purge in batches of {batch_size:>7}: {total:8.1f} ms total, '
+                  f'longest transaction {longest:7.2f} ms')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
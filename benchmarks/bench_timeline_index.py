@@ -0,0 +1,94 @@
+"""Query plan and latency of timeline listings before/after the index migrations.
+
+Usage:
+    python benchmarks/bench_timeline_index.py [rows]
+
+Builds a throwaway SQLite file with `rows` posts (default 1,000,000), then
+times a first page, a deep keyset page and a per-email lookup with and without
+the indexes added by app/migrations.py.
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ['TESTING'] = 'true'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from peewee import SqliteDatabase, chunked
+from app import TimelinePost, timeline_page_query
+from app.migrations import migrate
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REPEAT = 20
+
+
+def populate(db, rows):
+    start = datetime.datetime(2020, 1, 1)
+    data = (
+        {
+            'name': f'User {i}',
+            'email': f'user{i % 5000}@example.com',
+            'content': f'Post number {i}',
+            # Several posts per second so created_at ties are exercised
+            'created_at': start + datetime.timedelta(seconds=i // 3),
+        }
+        for i in range(rows)
+    )
+    with db.atomic():
+        for batch in chunked(data, 5000):
+            TimelinePost.insert_many(batch).execute()
+
+
+def timed(fn):
+    best = float('inf')
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def plan(db, query):
+    sql, params = query.sql()
+    rows = db.execute_sql('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    return '; '.join(row[-1] for row in rows)
+
+
+def run(db, label):
+    middle = TimelinePost.get_by_id(ROWS // 2)
+    cursor = (middle.created_at, middle.id)
+    email = f'user{random.randrange(5000)}@example.com'
+
+    first_page = (TimelinePost.select()
+                  .order_by(TimelinePost.created_at.desc(), TimelinePost.id.desc())
+                  .limit(21))
+    by_email = TimelinePost.select().where(TimelinePost.email == email)
+
+    print(f'--- {label} ---')
+    print(f'first page plan: {plan(db, first_page)}')
+    print(f'email plan:      {plan(db, by_email)}')
+    print(f'first page:      {timed(lambda: timeline_page_query(20)):8.2f} ms')
+    print(f'deep page:       {timed(lambda: timeline_page_query(20, before=cursor)):8.2f} ms')
+    print(f'email lookup:    {timed(lambda: list(by_email.clone())):8.2f} ms')
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SqliteDatabase(os.path.join(tmp, 'bench.db'))
+        db.bind([TimelinePost], bind_refs=False, bind_backrefs=False)
+        db.connect()
+        db.create_tables([TimelinePost])
+        print(f'Populating {ROWS} rows...')
+        populate(db, ROWS)
+
+        run(db, 'without indexes')
+        migrate(db)
+        run(db, 'with migrations applied')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Time to first byte and time to first post for the /timeline page.
+
+Usage:
+    python benchmarks/bench_timeline_ttfb.py [rows]
+
+Serves the app with werkzeug's threaded server against a SQLite file holding
+`rows` posts (default 100,000) and measures, over HTTP on localhost:
+
+  * two round trips: the page shell, then GET /api/timeline_post for the
+    first page (what the browser did before the first page was rendered
+    server-side; the shell here is the current page, so this is generous)
+  * one round trip: GET /timeline with the first page embedded
+
+each uncached (a write just invalidated the caches) and cached. Localhost
+has next to no network latency; over a real connection every extra round
+trip adds one RTT on top of these numbers.
+"""
+import datetime
+import http.client
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+os.environ['TESTING'] = 'true'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from peewee import SqliteDatabase, chunked
+from werkzeug.serving import make_server
+from app import create_app, db as app_db, MODELS, TimelinePost, Counter
+from app.migrations import migrate
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+REPEAT = 50
+
+
+def populate(rows):
+    start = datetime.datetime(2020, 1, 1)
+    data = ({'name': f'User {i}', 'email': f'user{i}@example.com',
+             'content': f'Post number {i} <b>with</b> some markup & text',
+             'created_at': start + datetime.timedelta(seconds=i)}
+            for i in range(rows))
+    with app_db.atomic():
+        for batch in chunked(data, 5000):
+            TimelinePost.insert_many(batch).execute()
+
+
+def get(conn, path):
+    """Return (time to first byte, time to full body) in ms."""
+    start = time.perf_counter()
+    conn.request('GET', path)
+    response = conn.getresponse()
+    ttfb = time.perf_counter() - start
+    response.read()
+    assert response.status == 200, response.status
+    return ttfb * 1000, (time.perf_counter() - start) * 1000
+
+
+def invalidate():
+    # What a new post does to the caches, without changing the data
+    Counter.update(value=Counter.value + 1).where(Counter.name == 'timeline').execute()
+
+
+def measure(conn, paths, uncached):
+    ttfbs, totals = [], []
+    for _ in range(REPEAT):
+        if uncached:
+            invalidate()
+        total = 0.0
+        first_ttfb = None
+        for path in paths:
+            ttfb, elapsed = get(conn, path)
+            first_ttfb = ttfb if first_ttfb is None else first_ttfb
+            total += elapsed
+        ttfbs.append(first_ttfb)
+        totals.append(total)
+    return statistics.median(ttfbs), statistics.median(totals)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        app_db.initialize(SqliteDatabase(os.path.join(tmp, 'ttfb.db')))
+        app = create_app()
+        with app_db.connection_context():
+            app_db.create_tables(MODELS)
+            migrate(app_db)
+            populate(ROWS)
+            Counter.create(name='timeline', value=1)
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_port)
+        try:
+            cases = [
+                ('two round trips', ['/timeline', '/api/timeline_post?limit=20']),
+                ('one round trip ', ['/timeline']),
+            ]
+            print(f'{ROWS} posts, median of {REPEAT}')
+            for uncached in (True, False):
+                for label, paths in cases:
+                    ttfb, total = measure(conn, paths, uncached)
+                    state = 'uncached' if uncached else 'cached  '
+                    print(f'{label} {state}  first byte {ttfb:6.2f} ms   first post {total:6.2f} ms')
+        finally:
+            conn.close()
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
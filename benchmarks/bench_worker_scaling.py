@@ -0,0 +1,78 @@
+"""Requests/sec of the gunicorn setup as the worker count grows from 1 to N.
+
+Usage:
+    python benchmarks/bench_worker_scaling.py [max_workers] [seconds] [path]
+
+For each worker count it starts gunicorn with gunicorn.conf.py (TESTING mode,
+so no MySQL is needed), then hammers `path` (default /) from several client
+processes for `seconds` (default 5) and prints the throughput. The default
+page is template-rendering bound, so it shows how far we get past one core.
+"""
+import http.client
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+MAX_WORKERS = int(sys.argv[1]) if len(sys.argv) > 1 else multiprocessing.cpu_count()
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+PATH = sys.argv[3] if len(sys.argv) > 3 else '/'
+PORT = 5099
+CLIENTS = max(4, MAX_WORKERS * 2)
+
+
+def client(deadline):
+    done = 0
+    while time.time() < deadline:
+        conn = http.client.HTTPConnection('127.0.0.1', PORT)
+        conn.request('GET', PATH)
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        if response.status == 200:
+            done += 1
+    return done
+
+
+def wait_for_server():
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', PORT)
+            conn.request('GET', PATH)
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('gunicorn did not start')
+
+
+def run(workers):
+    env = dict(os.environ, TESTING='true', WEB_CONCURRENCY=str(workers),
+               GUNICORN_THREADS='1', PORT=str(PORT))
+    server = subprocess.Popen(
+        ['gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '/dev/null', 'wsgi:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server()
+        deadline = time.time() + SECONDS
+        with multiprocessing.Pool(CLIENTS) as pool:
+            total = sum(pool.map(client, [deadline] * CLIENTS))
+        return total / SECONDS
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    print(f'GET {PATH}, {CLIENTS} client processes, {SECONDS:g}s per run')
+    baseline = None
+    for workers in range(1, MAX_WORKERS + 1):
+        rps = run(workers)
+        baseline = baseline or rps
+        print(f'{workers:>3} workers: {rps:8.0f} req/s  ({rps / baseline:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
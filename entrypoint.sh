@@ -0,0 +1,17 @@
+#!/bin/bash
+
+# APP_SERVER picks the server: gunicorn (default, production), uvicorn (async
+# mode, see asgi.py) or flask (development)
+set -e
+
+if [ "${APP_SERVER:-gunicorn}" = "flask" ]; then
+    exec flask run --host=0.0.0.0
+fi
+
+if [ "${APP_SERVER}" = "uvicorn" ]; then
+    # One process: the event loop handles the connections, ASGI_THREADS the requests.
+    # X-Forwarded-For is left to TRUSTED_PROXY_COUNT, as under gunicorn.
+    exec uvicorn asgi:app --host 0.0.0.0 --port "${PORT:-5000}" --no-proxy-headers --timeout-keep-alive 5
+fi
+
+exec gunicorn -c gunicorn.conf.py wsgi:app
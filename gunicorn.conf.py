@@ -0,0 +1,26 @@
+# Gunicorn configuration for the production server.
+#
+# Workers and threads scale with the CPU count unless overridden:
+#   WEB_CONCURRENCY    number of worker processes (default: 2 * CPUs + 1)
+#   GUNICORN_THREADS   threads per worker (default: 4)
+#   GUNICORN_TIMEOUT   worker timeout in seconds (default: 30)
+#   PORT               port to listen on (default: 5000)
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+keepalive = 5
+
+# Build the app once in the master, so migrations run a single time and
+# workers share the imported code copy-on-write. create_app() leaves no open
+# database connections behind, so forking afterwards is safe.
+preload_app = True
+wsgi_app = "wsgi:app"
+
+accesslog = "-"
+errorlog = "-"
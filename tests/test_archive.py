@@ -0,0 +1,236 @@
+# tests/test_archive.py
+
+import datetime
+import json
+import os
+import tempfile
+import unittest
+os.environ['TESTING'] = 'true'
+
+from app import create_app, db, keyset_rows, timeline_cache, MODELS, TimelinePost
+from app.archive import Archive, ArchiveSegment, NdjsonBackend, TableBackend, add_checksum
+
+app = create_app()
+
+NOW = datetime.datetime(2020, 4, 15, 12, 0)
+
+
+class ArchiveTestCase(unittest.TestCase):
+    """Runs against the table backend; TestNdjsonArchive repeats it with NDJSON segments."""
+
+    def setUp(self):
+        # test_db binds TimelinePost to a database of its own
+        for model in MODELS:
+            model._meta.set_database(db)
+        if db.is_closed():
+            db.connect()
+        db.create_tables(MODELS, safe=True)
+        timeline_cache.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.original_archive = app.extensions['archive']
+        self.archive = app.extensions['archive'] = Archive(db, TimelinePost, self.make_backend(),
+                                                           after_days=30)
+        self.client = app.test_client()
+        app.config['ADMIN_TOKEN'] = 'secret'
+        # Three posts a month from January to April, two of them in the same second
+        rows = []
+        for month in range(1, 5):
+            for day, second in ((3, 0), (9, 0), (9, 0)):
+                rows.append({'name': f'User {month}-{day}', 'email': f'user{month}@example.com',
+                             'content': f'Post from {month}/{day}',
+                             'created_at': datetime.datetime(2020, month, day, 8, 0, second)})
+        TimelinePost.insert_many(rows).execute()
+
+    def make_backend(self):
+        return TableBackend(db, keyset_rows)
+
+    def tearDown(self):
+        app.extensions['archive'] = self.original_archive
+        app.config['ADMIN_TOKEN'] = None
+        for table in db.get_tables():
+            if table.startswith('timelinepost_archive_'):
+                db.execute_sql(f'DROP TABLE {table}')
+        db.drop_tables(MODELS, safe=True)
+        self.tmp.cleanup()
+
+    def walk(self, query=''):
+        """Every post id the API lists, following X-Next-Cursor."""
+        timeline_cache.clear()
+        ids = []
+        url = f'/api/timeline_post?limit=2{query}'
+        while url:
+            response = self.client.get(url)
+            assert response.status_code == 200
+            ids += [post['id'] for post in response.get_json()]
+            cursor = response.headers.get('X-Next-Cursor')
+            direction = 'after' if 'after=' in url else 'before'
+            url = f'/api/timeline_post?limit=2&{direction}={cursor}' if cursor else None
+        return ids
+
+    def test_archive_and_read_back(self):
+        before = self.walk()
+        first = self.client.get(f'/api/timeline_post/{before[-1]}').get_json()
+
+        moved = self.archive.run(now=NOW, pause=0)
+        assert moved == {'2020-01': 3, '2020-02': 3}
+        assert TimelinePost.select().count() == 6
+        assert [segment.month for segment in self.archive.segments()] == ['2020-01', '2020-02']
+
+        # Paging newest first runs on into the archive, in the same order
+        assert self.walk() == before
+        # So does paging forwards from an old cursor
+        timeline_cache.clear()
+        # (pages come newest first, so compare as sets)
+        second_oldest = self.client.get(f'/api/timeline_post?limit={len(before) - 1}').headers['X-Next-Cursor']
+        newer = self.walk(f'&after={second_oldest}')
+        assert sorted(newer, key=before.index) == before[:-2]
+
+        assert self.client.get(f'/api/timeline_post/{before[-1]}').get_json() == first
+        assert self.client.get('/api/timeline_post/999').status_code == 404
+        assert all(not problems for _, _, problems in self.archive.verify())
+
+        # Nothing left to do until the cutoff moves on
+        assert self.archive.run(now=NOW, pause=0) == {}
+        assert self.archive.run(now=NOW + datetime.timedelta(days=31), pause=0) == {'2020-03': 3}
+        assert self.walk() == before
+
+    def test_batches_and_late_posts(self):
+        # A post deleted before the run is left for the purge
+        TimelinePost.update(deleted_at=NOW).where(TimelinePost.content == 'Post from 1/3').execute()
+        pauses = []
+        assert self.archive.run(now=NOW, batch_size=2, pause=0.5, sleep=pauses.append) == \
+            {'2020-01': 2, '2020-02': 3}
+        # A full batch is followed by a pause, a short one ends the month
+        assert pauses == [0.5, 0.5]
+        assert TimelinePost.select().where(TimelinePost.deleted_at.is_null(False)).count() == 1
+
+        # An old post imported later joins its month's segment on the next run
+        TimelinePost.create(name='Late', email='late@example.com', content='Late post',
+                            created_at=datetime.datetime(2020, 1, 20))
+        assert self.archive.run(now=NOW, pause=0) == {'2020-01': 1}
+        segment = ArchiveSegment.get_by_id('2020-01')
+        assert segment.rows == 3
+        assert [row[3] for row in self.archive.backend.read(segment)] == \
+            ['Post from 1/9', 'Post from 1/9', 'Late post']
+        assert all(not problems for _, _, problems in self.archive.verify())
+
+    def export(self, after_id=0):
+        response = self.client.get(f'/api/timeline_post/export?after_id={after_id}',
+                                   headers={'Authorization': 'Bearer secret'})
+        assert response.status_code == 200
+        return [json.loads(line)['id'] for line in response.get_data(as_text=True).splitlines()]
+
+    def test_delete_moderate_and_export_archived_posts(self):
+        before = self.walk()
+        assert self.archive.run(now=NOW, pause=0) == {'2020-01': 3, '2020-02': 3}
+        # An old post imported later gets a newer id than the hot table's
+        late = TimelinePost.create(name='Late', email='late@example.com', content='Late post',
+                                   created_at=datetime.datetime(2020, 1, 20)).id
+        assert self.archive.run(now=NOW, pause=0) == {'2020-01': 1}
+        assert self.export() == sorted(before) + [late]
+        assert self.export(after_id=3) == sorted(before)[3:] + [late]
+
+        # Deleting an archived post
+        assert self.client.delete('/api/timeline_post/1').status_code == 200
+        assert self.client.get('/api/timeline_post/1').status_code == 404
+        assert self.client.delete('/api/timeline_post/1').status_code == 404
+        assert 1 not in self.walk()
+
+        # Moderation covers the archive, by id or by author
+        auth = {'Authorization': 'Bearer secret'}
+        response = self.client.post('/api/timeline_post/bulk_delete', json={'ids': [2, 7]}, headers=auth)
+        assert response.get_json() == {'deleted': 2}
+        response = self.client.post('/api/timeline_post/bulk_delete', json={'email': 'user2@example.com'},
+                                    headers=auth)
+        assert response.get_json() == {'deleted': 3}
+
+        remaining = [post_id for post_id in sorted(before) if post_id not in (1, 2, 4, 5, 6, 7)]
+        assert self.export() == remaining + [late]
+        assert sorted(self.walk()) == remaining + [late]
+        assert [(segment.month, segment.rows) for segment in self.archive.segments()] == \
+            [('2020-01', 2), ('2020-02', 0)]
+        assert all(not problems for _, _, problems in self.archive.verify())
+
+        # The emptied month takes new posts again
+        TimelinePost.create(name='Later', email='late@example.com', content='Later post',
+                            created_at=datetime.datetime(2020, 2, 20))
+        assert self.archive.run(now=NOW, pause=0) == {'2020-02': 1}
+        assert all(not problems for _, _, problems in self.archive.verify())
+
+    def test_old_imports_join_the_archive(self):
+        self.archive.run(now=NOW, pause=0)
+        body = "\n".join(json.dumps({"name": "Old", "email": "old@example.com", "content": f"Imported {day}",
+                                     "created_at": f"2020-{month:02d}-{day:02d}T08:00:00"})
+                         for month, day in ((1, 5), (3, 1)))
+        response = self.client.post('/api/timeline_post/bulk', data=body, headers={'Authorization': 'Bearer secret'})
+        assert response.get_json()['inserted'] == 2
+        # January is archived, so its import goes there; March isn't yet
+        assert ArchiveSegment.get_by_id('2020-01').rows == 4
+        assert TimelinePost.select().where(TimelinePost.email == 'old@example.com').count() == 1
+        # Pages stitched from the hot table and the archive stay in order
+        posts = {post_id: self.client.get(f'/api/timeline_post/{post_id}').get_json() for post_id in self.walk()}
+        order = [(post['created_at'], post_id) for post_id, post in posts.items()]
+        assert order == sorted(order, reverse=True)
+        assert all(not problems for _, _, problems in self.archive.verify())
+
+    def test_verify_and_cli(self):
+        runner = app.test_cli_runner()
+        original_after_days = self.archive.after_days
+        result = runner.invoke(args=['timeline', 'archive', 'run', '--after-days', '0', '--pause-ms', '0'])
+        assert result.exit_code == 0
+        self.archive.after_days = original_after_days
+        assert 'Archived 12 posts' in result.output
+        result = runner.invoke(args=['timeline', 'archive', 'verify'])
+        assert result.exit_code == 0
+        assert result.output.count(' ok') == 4
+        assert '2020-04' in runner.invoke(args=['timeline', 'archive', 'status']).output
+
+        ArchiveSegment.update(checksum='0' * 16).where(ArchiveSegment.month == '2020-02').execute()
+        result = runner.invoke(args=['timeline', 'archive', 'verify'])
+        assert result.exit_code == 1
+        assert '2020-02         3 posts  checksum mismatch' in result.output
+
+
+class TestNdjsonArchive(ArchiveTestCase):
+    def make_backend(self):
+        return NdjsonBackend(self.tmp.name)
+
+    def test_crashed_run_is_ignored_and_repaired(self):
+        self.archive.run(now=NOW, pause=0)
+        before = self.walk()
+        # A run that died after writing to the segment but before committing
+        with open(self.archive.backend.path('2020-01'), 'ab') as f:
+            f.write(b'half a gzip member')
+        assert self.walk() == before
+
+        TimelinePost.create(name='Late', email='late@example.com', content='Late post',
+                            created_at=datetime.datetime(2020, 1, 20))
+        assert self.archive.run(now=NOW, pause=0) == {'2020-01': 1}
+        assert all(not problems for _, _, problems in self.archive.verify())
+
+    def test_crashed_rewrite_is_dropped_or_finished(self):
+        self.archive.run(now=NOW, pause=0)
+        backend = self.archive.backend
+        staged = backend.staged('2020-01')
+        segment = ArchiveSegment.get_by_id('2020-01')
+        rows = backend.matching(segment, ids=[1])
+
+        # Died before the manifest committed: the segment stays as it was
+        backend.remove(segment, rows)
+        with backend.lock('2020-01'):
+            assert not os.path.exists(staged)
+        assert self.client.get('/api/timeline_post/1').status_code == 200
+
+        # Died after it committed: the rewrite is put in place
+        size = backend.remove(segment, rows)
+        ArchiveSegment.update(rows=ArchiveSegment.rows - 1, size=size,
+                              checksum=add_checksum(segment.checksum, rows, sign=-1)) \
+            .where(ArchiveSegment.month == '2020-01').execute()
+        assert self.client.get('/api/timeline_post/1').status_code == 404
+        assert not os.path.exists(staged)
+        assert self.client.get('/api/timeline_post/2').status_code == 200
+        assert all(not problems for _, _, problems in self.archive.verify())
+
+
+if __name__ == '__main__':
+    unittest.main()
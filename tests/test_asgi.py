@@ -0,0 +1,166 @@
+# tests/test_asgi.py
+
+import asyncio
+import os
+import tempfile
+import unittest
+os.environ['TESTING'] = 'true'
+
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+from app import create_app, db, MODELS
+from app.asgi import AsgiAdapter
+from app.metrics import MetricsSqliteDatabase
+
+app = create_app()
+
+
+async def asgi_request(adapter, method, path, body=b'', headers=(), receive_body=None):
+    """Drive the adapter like an ASGI server; return (status, headers, body)."""
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'method': method, 'path': path, 'root_path': '',
+             'query_string': query.encode(), 'http_version': '1.1', 'scheme': 'http',
+             'server': ('localhost', 80), 'client': ('127.0.0.1', 50000),
+             'headers': [(b'host', b'localhost'),
+                         *((name.lower().encode(), value.encode()) for name, value in headers)]}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    finished = asyncio.Event()
+
+    async def receive():
+        if receive_body is not None:
+            return await receive_body()
+        if messages:
+            return messages.pop(0)
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await adapter(scope, receive, send)
+    finished.set()
+    start = sent[0]
+    response_headers = {name.decode(): value.decode() for name, value in start['headers']}
+    return start['status'], response_headers, b''.join(m.get('body', b'') for m in sent[1:])
+
+
+def comparable(headers):
+    # Timings differ from one request to the next
+    return {name.lower(): value for name, value in headers.items() if name.lower() != 'server-timing'}
+
+
+class TestAsgiAdapter(unittest.TestCase):
+    def setUp(self):
+        # Pool threads open their own connections, which an in-memory database
+        # wouldn't share, so use a file
+        self.tmp = tempfile.TemporaryDirectory()
+        self.original_db = db.obj
+        db.initialize(MetricsSqliteDatabase(os.path.join(self.tmp.name, 'asgi.db')))
+        with db.connection_context():
+            db.create_tables(MODELS)
+        self.client = app.test_client()
+        self.adapter = AsgiAdapter(app, max_workers=2)
+
+    def tearDown(self):
+        self.adapter.executor.shutdown()
+        db.close()
+        db.initialize(self.original_db)
+        self.tmp.cleanup()
+
+    def request(self, *args, **kwargs):
+        return asyncio.run(asgi_request(self.adapter, *args, **kwargs))
+
+    def assert_same(self, method, path, **kwargs):
+        status, headers, body = self.request(method, path, **kwargs)
+        # Raw WSGI, as a sync server would see it (the test client fills in headers)
+        environ = EnvironBuilder(path, method=method, headers=list(kwargs.get('headers', ()))).get_environ()
+        app_iter, sync_status, sync_headers = run_wsgi_app(app, environ, buffered=True)
+        assert status == int(sync_status.split()[0])
+        assert body == b''.join(app_iter)
+        assert comparable(headers) == comparable(dict(sync_headers))
+        return status, headers, body
+
+    def test_matches_sync_path(self):
+        form = {'Content-Type': 'application/x-www-form-urlencoded'}
+        status, _, body = self.request('POST', '/api/timeline_post', headers=form.items(),
+                                       body=b'name=Jane+Doe&email=jane%40example.com&content=Hello+world')
+        assert status == 201
+        assert b'"content":"Hello world"' in body
+
+        status, headers, _ = self.assert_same('GET', '/api/timeline_post?limit=5')
+        assert status == 200
+        self.assert_same('GET', '/api/timeline_post', headers=[('If-None-Match', headers['etag'])])
+        self.assert_same('GET', '/api/timeline_post?limit=0')
+
+        status, _, _ = self.request('POST', '/api/timeline_post', headers=form.items(), body=b'name=Jane')
+        assert status == 400
+        status, _, _ = self.request('DELETE', '/api/timeline_post/1')
+        assert status == 200
+        status, _, _ = self.assert_same('DELETE', '/api/timeline_post/1')
+        assert status == 404
+
+    def test_streamed_response(self):
+        for i in range(3):
+            self.client.post('/api/timeline_post', data={
+                'name': f'User {i}', 'email': f'user{i}@example.com', 'content': f'Post {i}'})
+        app.config['ADMIN_TOKEN'] = 'secret'
+        try:
+            status, headers, body = self.assert_same(
+                'GET', '/api/timeline_post/export', headers=[('Authorization', 'Bearer secret')])
+        finally:
+            app.config['ADMIN_TOKEN'] = None
+        assert status == 200
+        assert 'content-length' not in headers
+        assert body.count(b'\n') == 3
+
+    def test_write_callable(self):
+        def legacy_app(environ, start_response):
+            write = start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '11')])
+            write(b'hello ')
+            return [b'world']
+        adapter = AsgiAdapter(legacy_app, max_workers=1)
+        try:
+            status, _, body = asyncio.run(asgi_request(adapter, 'GET', '/'))
+        finally:
+            adapter.executor.shutdown()
+        assert (status, body) == (200, b'hello world')
+
+    def test_slow_upload_does_not_hold_a_thread(self):
+        adapter = AsgiAdapter(app, max_workers=1)
+
+        async def scenario():
+            uploaded = asyncio.Event()
+            messages = [{'type': 'http.request', 'body': b'name=Slow', 'more_body': False}]
+
+            async def slow_receive():
+                await uploaded.wait()
+                if messages:
+                    return messages.pop()
+                await asyncio.Event().wait()
+
+            slow = asyncio.ensure_future(asgi_request(adapter, 'POST', '/api/timeline_post',
+                                                      receive_body=slow_receive))
+            await asyncio.sleep(0.01)
+            # The only pool thread is free while the slow client is still uploading
+            status, _, _ = await asyncio.wait_for(asgi_request(adapter, 'GET', '/api/timeline_post'), 5)
+            assert status == 200
+            assert not slow.done()
+            uploaded.set()
+            status, _, _ = await asyncio.wait_for(slow, 5)
+            assert status == 400
+
+        try:
+            asyncio.run(scenario())
+        finally:
+            adapter.executor.shutdown()
+
+    def test_rejects_over_max_pending(self):
+        self.adapter.max_pending = 0
+        status, headers, _ = self.request('GET', '/api/timeline_post')
+        assert status == 503
+        assert headers['retry-after'] == '1'
+
+
+if __name__ == '__main__':
+    unittest.main()
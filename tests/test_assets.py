@@ -0,0 +1,66 @@
+# tests/test_assets.py
+
+import gzip
+import os
+import tempfile
+import unittest
+
+from jinja2 import DictLoader, Environment
+
+from app.assets import AssetManifest, MissingAssetError, check_templates
+
+
+class TestAssetManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.static = self.tmp.name
+        os.makedirs(os.path.join(self.static, 'styles'))
+        self.write('styles/site.css', b'body { color: red; }\n' * 200)
+        self.write('img/photo.jpg', os.urandom(2048))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.static, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def test_fingerprinted_urls(self):
+        manifest = AssetManifest(self.static)
+        url = manifest.url('styles/site.css')
+        assert url.startswith('/assets/styles/site.') and url.endswith('.css')
+        asset = manifest.lookup(url[len('/assets/'):])
+        assert asset.mimetype == 'text/css'
+
+        # New content, new URL; the old one is gone
+        self.write('styles/site.css', b'body { color: blue; }\n' * 200)
+        manifest.refresh()
+        assert manifest.url('styles/site.css') != url
+        assert manifest.lookup(url[len('/assets/'):]) is None
+
+    def test_precompressed_variants(self):
+        manifest = AssetManifest(self.static)
+        css = manifest.lookup(manifest.url('styles/site.css')[len('/assets/'):])
+        assert gzip.decompress(css.variants['gzip']) == b'body { color: red; }\n' * 200
+        # Images are already compressed
+        photo = manifest.lookup(manifest.url('img/photo.jpg')[len('/assets/'):])
+        assert photo.variants == {}
+
+    def test_missing_assets_fail_loudly(self):
+        manifest = AssetManifest(self.static)
+        with self.assertRaises(MissingAssetError):
+            manifest.url('styles/missing.css')
+
+        env = Environment(loader=DictLoader({
+            'ok.html': "{{ asset_url('styles/site.css') }}",
+            'broken.html': '<link href="{{ asset_url("styles/timeline.css") }}">',
+        }))
+        with self.assertRaises(MissingAssetError) as error:
+            check_templates(env, manifest)
+        assert 'broken.html: styles/timeline.css' in str(error.exception)
+
+
+if __name__ == '__main__':
+    unittest.main()
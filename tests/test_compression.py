@@ -0,0 +1,148 @@
+# tests/test_compression.py
+
+import gzip
+import unittest
+import zlib
+
+from app.compression import CompressionMiddleware, StreamCompressor, add_vary, choose_encoding
+
+BODY = b'{"content": "hello world"}\n' * 200
+
+
+def make_app(body=BODY, mimetype='application/json', headers=(), stream=False):
+    def app(environ, start_response):
+        response_headers = [('Content-Type', mimetype), ('ETag', '"v1"'), *headers]
+        if stream:
+            start_response('200 OK', response_headers)
+            return iter([body[:100], body[100:]])
+        response_headers.append(('Content-Length', str(len(body))))
+        start_response('200 OK', response_headers)
+        return [body]
+    return app
+
+
+def call(app, **environ):
+    environ.setdefault('REQUEST_METHOD', 'GET')
+    environ.setdefault('PATH_INFO', '/')
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = status
+        captured['headers'] = dict(headers)
+
+    body = app(environ, start_response)
+    chunks = list(body)
+    return captured['status'], captured['headers'], chunks
+
+
+class TestCompression(unittest.TestCase):
+    def test_choose_encoding(self):
+        assert choose_encoding('gzip, deflate, br') == 'br'
+        assert choose_encoding('gzip') == 'gzip'
+        assert choose_encoding('br;q=0, gzip') == 'gzip'
+        assert choose_encoding('identity') is None
+        assert choose_encoding(None) is None
+
+    def test_add_vary(self):
+        assert add_vary('') == 'Accept-Encoding'
+        assert add_vary('Cookie') == 'Cookie, Accept-Encoding'
+        assert add_vary('accept-encoding') == 'accept-encoding'
+
+    def test_buffered_response(self):
+        middleware = CompressionMiddleware(make_app())
+        _, headers, chunks = call(middleware, HTTP_ACCEPT_ENCODING='gzip')
+        assert headers['Content-Encoding'] == 'gzip'
+        assert headers['ETag'] == '"v1+gzip"'
+        assert int(headers['Content-Length']) == len(chunks[0])
+        assert gzip.decompress(chunks[0]) == BODY
+
+        # Compressed once, then served from the cache
+        assert call(middleware, HTTP_ACCEPT_ENCODING='gzip')[2][0] is chunks[0]
+
+    def test_write_callable(self):
+        def app(environ, start_response):
+            write = start_response('200 OK', [('Content-Type', 'application/json')])
+            write(BODY[:100])
+            return [BODY[100:]]
+        _, headers, chunks = call(CompressionMiddleware(app), HTTP_ACCEPT_ENCODING='gzip')
+        assert headers['Content-Encoding'] == 'gzip'
+        # Written data goes out first, then the iterable's
+        assert zlib.decompress(b''.join(chunks), 31) == BODY
+
+    def test_ineligible_responses(self):
+        cases = [
+            (make_app(mimetype='image/png'), {}),
+            (make_app(mimetype='text/event-stream', stream=True), {}),
+            (make_app(body=b'{}'), {}),
+            (make_app(headers=[('Cache-Control', 'no-transform')]), {}),
+            (make_app(), {'REQUEST_METHOD': 'HEAD'}),
+        ]
+        for app, environ in cases:
+            _, headers, _ = call(CompressionMiddleware(app), HTTP_ACCEPT_ENCODING='gzip', **environ)
+            assert 'Content-Encoding' not in headers
+
+    def test_streamed_response(self):
+        pulled = []
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'application/x-ndjson')])
+
+            def body():
+                for i in range(3):
+                    pulled.append(i)
+                    yield b'{"id": %d}\n' % i
+            return body()
+
+        captured = []
+        body = CompressionMiddleware(app)({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'},
+                                          lambda status, headers: captured.append(dict(headers)))
+        assert captured[0]['Content-Encoding'] == 'gzip'
+        assert 'Content-Length' not in captured[0]
+        # Nothing is buffered: one chunk out per chunk in
+        first = next(body)
+        assert pulled == [0]
+        assert zlib.decompressobj(31).decompress(first) == b'{"id": 0}\n'
+        rest = b''.join(body)
+        assert gzip.decompress(first + rest) == b'{"id": 0}\n{"id": 1}\n{"id": 2}\n'
+
+    def test_stream_compressor_flushes_every_chunk(self):
+        compressor = StreamCompressor('gzip')
+        decompressor = zlib.decompressobj(31)
+        # Each chunk can be decoded as soon as it arrives
+        for data in (b'first chunk\n', b'second chunk\n'):
+            assert decompressor.decompress(compressor.chunk(data)) == data
+        decompressor.decompress(compressor.finish())
+        assert decompressor.eof
+
+    def test_conditional_get(self):
+        def app(environ, start_response):
+            if '"v1"' in [tag.strip() for tag in environ.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+                start_response('304 NOT MODIFIED', [('ETag', '"v1"')])
+                return [b'']
+            return make_app()(environ, start_response)
+
+        middleware = CompressionMiddleware(app)
+        status, headers, _ = call(middleware, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH='"v1+gzip"')
+        assert status.startswith('304')
+        assert headers['ETag'] == '"v1+gzip"'
+
+        # A tag the middleware didn't add is passed through untouched
+        status, headers, _ = call(middleware, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH='"v1"')
+        assert headers['ETag'] == '"v1"'
+
+        # A tag for another encoding doesn't validate this one
+        status, headers, _ = call(middleware, HTTP_ACCEPT_ENCODING='br', HTTP_IF_NONE_MATCH='"v1+gzip"')
+        assert status.startswith('200')
+        assert (headers['Content-Encoding'], headers['ETag']) == ('br', '"v1+br"')
+        status, headers, body = call(middleware, HTTP_IF_NONE_MATCH='"v1+gzip"')
+        assert status.startswith('200')
+        assert 'Content-Encoding' not in headers and b''.join(body) == BODY
+        # Only the matching suffix is stripped from a list of tags
+        status, headers, _ = call(middleware, HTTP_ACCEPT_ENCODING='br',
+                                  HTTP_IF_NONE_MATCH='"v0+br", "v1+gzip", "v1+br"')
+        assert status.startswith('304')
+        assert headers['ETag'] == '"v1+br"'
+
+
+if __name__ == '__main__':
+    unittest.main()
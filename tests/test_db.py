@@ -1,9 +1,13 @@
 # test_db.py
 
+import os
+import tempfile
 import unittest
 from peewee import *
 
-from app import TimelinePost
+from app import TimelinePost, post_content_hash
+from app.migrations import backfill_content_hash, migrate, migration_status, MIGRATIONS
+from app.pool import StatsPooledSqliteDatabase
 
 MODELS = [TimelinePost]
 
@@ -37,3 +41,61 @@ class TestTimelinePost(unittest.TestCase):
             email='jame@example.com', content='Hello world, I\'m Jane!')
         assert second_post.id == 2
         # TODO: Get timeline posts and assert that they are correct
+
+    def test_migrations(self):
+        # First run applies everything and creates the indexes
+        applied = migrate(test_db)
+        assert applied == [name for _, name, _ in MIGRATIONS]
+        indexes = {index.name for index in test_db.get_indexes('timelinepost')}
+        assert 'timelinepost_created_at_id' in indexes
+        assert 'timelinepost_email_deleted_at' in indexes
+        assert 'timelinepost_deleted_at_created_at_id' in indexes
+        assert 'timelinepost_content_hash_created_at' in indexes
+        assert 'timelinepost_provisional_id' in indexes
+        assert 'timelinepost_fts' in test_db.get_tables()
+        assert 'idempotency_keys' in test_db.get_tables()
+
+        # Second run is a no-op and the status reports everything applied
+        assert migrate(test_db) == []
+        assert all(m['applied_at'] is not None for m in migration_status(test_db))
+
+    def test_deleted_at_migration(self):
+        # A table from before soft deletes gets the column added in place
+        test_db.drop_tables(MODELS)
+        test_db.execute_sql("CREATE TABLE timelinepost (id INTEGER PRIMARY KEY, name VARCHAR(255), "
+                            "email VARCHAR(255), content TEXT, created_at DATETIME)")
+        test_db.execute_sql("INSERT INTO timelinepost VALUES (1, 'John', 'john@example.com', 'Hi', "
+                            "'2020-01-01 00:00:00')")
+        assert 'timelinepost_deleted_at' in migrate(test_db)
+        assert 'deleted_at' in {column.name for column in test_db.get_columns('timelinepost')}
+        assert TimelinePost.get_by_id(1).deleted_at is None
+        # Existing posts are hashed by the migration that adds the column
+        assert TimelinePost.get_by_id(1).content_hash == post_content_hash('john@example.com', 'Hi')
+
+    def test_content_hash_backfill(self):
+        # Id ranges with gaps, and rows hashed already are left alone
+        for post_id in (1, 2, 3, 7, 8):
+            TimelinePost.create(id=post_id, name='John', email=f'john{post_id}@example.com', content='Hi')
+        TimelinePost.update(content_hash='kept').where(TimelinePost.id == 2).execute()
+        backfill_content_hash(test_db, batch_size=2)
+        hashes = {post.id: post.content_hash for post in TimelinePost.select()}
+        assert hashes.pop(2) == 'kept'
+        assert hashes == {post_id: post_content_hash(f'john{post_id}@example.com', 'Hi') for post_id in hashes}
+
+    def test_pool_stats(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pool_db = StatsPooledSqliteDatabase(os.path.join(tmp, 'pool.db'),
+                                                max_connections=2)
+            assert pool_db.pool_stats()['checkouts'] == 0
+
+            pool_db.connect()
+            stats = pool_db.pool_stats()
+            assert stats['in_use'] == 1
+            assert stats['checkouts'] == 1
+
+            # Closing returns the connection to the pool instead of dropping it
+            pool_db.close()
+            stats = pool_db.pool_stats()
+            assert stats['in_use'] == 0
+            assert stats['idle'] == 1
+            pool_db.close_all()
@@ -0,0 +1,94 @@
+# tests/test_events.py
+
+import unittest
+
+from app.events import EventRelay, Subscriber, sse_frame
+
+
+class FakeLog:
+    """Stands in for the timeline_events table."""
+
+    def __init__(self):
+        self.events = []
+        self.polls = 0
+
+    def append(self, kind):
+        event_id = len(self.events) + 1
+        self.events.append((event_id, sse_frame(event_id, kind, '{}')))
+        return event_id
+
+    def poll(self, after_id, limit):
+        self.polls += 1
+        return [event for event in self.events if event[0] > after_id][:limit]
+
+
+class TestSubscriber(unittest.TestCase):
+    def test_skips_events_already_sent(self):
+        subscriber = Subscriber(last_id=2)
+        for event_id in (1, 2, 3, 3, 4):
+            subscriber.push(event_id, f'frame {event_id}')
+        assert subscriber.next_frame(0) == 'frame 3'
+        assert subscriber.next_frame(0) == 'frame 4'
+        assert subscriber.next_frame(0) is None
+
+    def test_slow_subscriber_is_reset(self):
+        subscriber = Subscriber(last_id=0, max_pending=3)
+        for event_id in range(1, 9):
+            subscriber.push(event_id, sse_frame(event_id, 'created', '{}'))
+        # Memory stays bounded: a reset replaced everything that piled up
+        frames = []
+        while (frame := subscriber.next_frame(0)) is not None:
+            frames.append(frame)
+        assert frames == [sse_frame(7, 'reset', '{}'), sse_frame(8, 'created', '{}')]
+
+
+class TestEventRelay(unittest.TestCase):
+    def test_fan_out(self):
+        log = FakeLog()
+        log.append('created')
+        relay = EventRelay(log.poll, interval=None)
+        first, second = relay.subscribe(1), relay.subscribe(1)
+        assert len(relay) == 2
+        log.append('created')
+        log.append('deleted')
+        relay.poll()
+        for subscriber in (first, second):
+            assert subscriber.next_frame(0) == sse_frame(2, 'created', '{}')
+            assert subscriber.next_frame(0) == sse_frame(3, 'deleted', '{}')
+
+        relay.unsubscribe(first)
+        log.append('created')
+        relay.poll()
+        assert first.next_frame(0) is None
+        assert second.next_frame(0) == sse_frame(4, 'created', '{}')
+
+    def test_late_subscriber_rewinds(self):
+        log = FakeLog()
+        relay = EventRelay(log.poll, interval=None)
+        early = relay.subscribe(0)
+        log.append('created')
+        log.append('created')
+        relay.poll()
+        # Joined at event 1, after the relay had already read event 2
+        late = relay.subscribe(1)
+        relay.poll()
+        assert late.next_frame(0) == sse_frame(2, 'created', '{}')
+        assert early.next_frame(0) == sse_frame(1, 'created', '{}')
+        assert early.next_frame(0) == sse_frame(2, 'created', '{}')
+        assert early.next_frame(0) is None
+
+    def test_background_polling(self):
+        log = FakeLog()
+        relay = EventRelay(log.poll, interval=60)
+        subscriber = relay.subscribe(0)
+        log.append('created')
+        relay.notify()
+        assert subscriber.next_frame(5) == sse_frame(1, 'created', '{}')
+        relay.unsubscribe(subscriber)
+        relay.stop()
+        relay._background.thread.join(5)
+        assert not relay._background.thread.is_alive()
+
+
+if __name__ == '__main__':
+    unittest.main()
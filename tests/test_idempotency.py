@@ -0,0 +1,107 @@
+# test_idempotency.py
+
+import os
+import unittest
+from unittest import mock
+from peewee import SqliteDatabase
+
+from app.idempotency import DatabaseBackend, IdempotencyEntry, MemoryBackend
+
+
+class BackendTests:
+    """Run against every backend; make_backends() returns two views of the same storage."""
+
+    def make_backends(self):
+        raise NotImplementedError
+
+    def test_begin_finish_replay(self):
+        first, second = self.make_backends()
+        assert first.begin('key', 'fp', 1000.0, 60) is None
+        # A repeat while the first request runs sees it in progress, from any worker
+        entry = second.begin('key', 'fp', 1001.0, 60)
+        assert entry.fingerprint == 'fp'
+        assert entry.status is None
+
+        first.finish('key', 201, {'Content-Type': 'application/json'}, b'{"id": 1}', 1002.0, 3600)
+        entry = second.begin('key', 'other', 1003.0, 60)
+        assert (entry.fingerprint, entry.status, entry.headers, entry.body) == \
+            ('fp', 201, {'Content-Type': 'application/json'}, b'{"id": 1}')
+
+        # Once the TTL is up the key is free again
+        assert second.begin('key', 'fp2', 1002.0 + 3600, 60) is None
+        assert first.begin('key', 'fp', 1002.0 + 3601, 60).fingerprint == 'fp2'
+
+    def test_release_and_lock_timeout(self):
+        first, second = self.make_backends()
+        assert first.begin('key', 'fp', 1000.0, 60) is None
+        first.release('key')
+        assert second.begin('key', 'fp', 1000.0, 60) is None
+        # A request that never finished (its worker died) stops holding the key
+        assert first.begin('key', 'fp', 1059.0, 60).status is None
+        assert first.begin('key', 'fp', 1060.0, 60) is None
+
+        # Releasing never drops a stored response
+        first.finish('key', 200, {}, b'ok', 1061.0, 3600)
+        first.release('key')
+        assert second.begin('key', 'fp', 1062.0, 60).status == 200
+
+
+class TestMemoryBackend(BackendTests, unittest.TestCase):
+    def make_backends(self):
+        backend = MemoryBackend()
+        return backend, backend
+
+    def test_memory_is_bounded(self):
+        backend = MemoryBackend(max_keys=10)
+        for i in range(1000):
+            backend.begin(f'key{i}', 'fp', 1000.0, 60)
+            backend.finish(f'key{i}', 201, {}, b'{}', 1000.0, 3600)
+        assert len(backend) == 10
+        # The oldest keys went first
+        assert backend.begin('key999', 'fp', 1000.0, 60).status == 201
+        assert backend.begin('key0', 'fp', 1000.0, 60) is None
+
+    def test_expired_keys_are_dropped(self):
+        backend = MemoryBackend()
+        for i in range(5):
+            backend.begin(f'key{i}', 'fp', 1000.0, 60)
+            backend.finish(f'key{i}', 201, {}, b'{}', 1000.0, 10)
+        backend.begin('late', 'fp', 1011.0, 60)
+        assert len(backend) == 1
+
+
+class TestDatabaseBackend(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.db = SqliteDatabase(':memory:')
+        with self.db.bind_ctx([IdempotencyEntry]):
+            self.db.create_tables([IdempotencyEntry])
+
+    def tearDown(self):
+        self.db.close()
+
+    def make_backends(self):
+        return DatabaseBackend(self.db), DatabaseBackend(self.db)
+
+    def test_expired_rows_are_purged(self):
+        backend = DatabaseBackend(self.db, purge_every=5)
+        for i in range(5):
+            backend.begin(f'key{i}', 'fp', 1000.0 + i * 100, 60)
+        assert IdempotencyEntry.select().count() == 1
+
+    def test_app_backend_locks_on_sqlite(self):
+        # create_app() hands the backend its DatabaseProxy, not the SqliteDatabase
+        from app import create_app, db
+        with mock.patch.dict(os.environ, {'TESTING': 'true', 'IDEMPOTENCY_BACKEND': 'database'}):
+            keys = create_app().extensions['idempotency']
+        assert isinstance(keys.backend, DatabaseBackend)
+        db.create_tables([IdempotencyEntry], safe=True)
+        try:
+            with mock.patch.object(db.obj, 'begin', wraps=db.obj.begin) as begin:
+                assert keys.begin('key', 'fp') is None
+            begin.assert_called_once_with('IMMEDIATE')
+        finally:
+            db.drop_tables([IdempotencyEntry])
+
+
+if __name__ == '__main__':
+    unittest.main()
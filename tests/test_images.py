@@ -0,0 +1,92 @@
+# tests/test_images.py
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+os.environ['TESTING'] = 'true'
+
+from app import create_app
+from app.images import PIL_AVAILABLE, ImageVariants, page_savings
+
+if PIL_AVAILABLE:
+    from PIL import Image
+
+
+@unittest.skipUnless(PIL_AVAILABLE, "Pillow is not installed")
+class TestImageVariants(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.static = self.tmp.name
+        os.makedirs(os.path.join(self.static, 'img'))
+        self.source = os.path.join(self.static, 'img', 'photo.jpg')
+        Image.new('RGB', (800, 400), (30, 120, 200)).save(self.source, quality=95)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_build_variants(self):
+        images = ImageVariants(self.static, widths=(200, 400, 1600))
+        assert images.build() > 0
+        image = images.images['img/photo.jpg']
+        jpegs = image.variants['image/jpeg']
+        # Never upscaled; the original width is always there
+        assert [v.width for v in jpegs] == [200, 400, 800]
+        assert jpegs[0].height == 100
+        assert list(image.variants)[-1] == 'image/jpeg'
+        for variants in image.variants.values():
+            for variant in variants:
+                assert os.path.exists(os.path.join(self.static, variant.name))
+
+        # Cached on disk: nothing to encode, or even decode, the second time
+        with mock.patch('app.images.Image.open', side_effect=AssertionError('decoded')):
+            again = ImageVariants(self.static, widths=(200, 400, 1600))
+            assert again.build() == 0
+        assert [(v.width, v.height) for v in again.images['img/photo.jpg'].variants['image/jpeg']] == \
+            [(200, 100), (400, 200), (800, 400)]
+        # ...until the source changes, or a variant goes missing
+        os.remove(os.path.join(self.static, jpegs[0].name))
+        assert ImageVariants(self.static, widths=(200, 400, 1600)).build() == 1
+        Image.new('RGB', (800, 400), (200, 30, 30)).save(self.source)
+        mtime = os.path.getmtime(self.source) + 10
+        os.utime(self.source, (mtime, mtime))
+        assert ImageVariants(self.static, widths=(200, 400, 1600)).build() > 0
+
+    def test_best_variant(self):
+        images = ImageVariants(self.static, widths=(200, 400))
+        images.build()
+        assert images.best_variant('img/photo.jpg', 300, ('image/jpeg',)).width == 400
+        assert images.best_variant('img/photo.jpg', 5000, ('image/jpeg',)).width == 800
+        assert images.best_variant('img/photo.jpg', 300, ('image/gif',)) is None
+
+
+class TestResponsiveImageMarkup(unittest.TestCase):
+    def test_picture_markup(self):
+        app = create_app()
+        with app.test_request_context():
+            html = app.jinja_env.from_string(
+                "{{ responsive_image('img/image.jpeg', 500, alt='A \"photo\"', class_='wide') }}"
+            ).render()
+        assert 'alt="A &#34;photo&#34;"' in html
+        assert 'class-="wide"' not in html and 'class="wide"' in html
+        assert 'loading="lazy"' in html
+        if not PIL_AVAILABLE:
+            assert html.startswith('<img src="/assets/img/image.')
+            return
+
+        assert html.startswith('<picture data-image="img/image.jpeg" data-max-width="500">')
+        assert '<source type="image/webp"' in html
+        assert 'sizes="(max-width: 500px) 100vw, 500px"' in html
+        assert ' 640w' in html
+        # The space is reserved before the image loads
+        image = app.extensions['images'].images['img/image.jpeg']
+        assert f'width="500" height="{round(image.height * 500 / image.width)}"' in html
+
+        # Mobile and desktop both download far less than the original
+        original, downloaded = page_savings(html, app.extensions['images'])
+        assert original == os.path.getsize(os.path.join(app.static_folder, 'img', 'image.jpeg'))
+        assert all(size < original / 2 for size in downloaded.values())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# tests/test_metrics.py
+
+import threading
+import unittest
+
+from app.metrics import SWEEP_EVERY, MetricsRegistry, format_labels
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_counters_and_histograms(self):
+        registry = MetricsRegistry()
+        registry.inc('rate_limit_rejections_total', (('limiter', 'timeline_post'),))
+        registry.inc('rate_limit_rejections_total', (('limiter', 'timeline_post'),))
+        registry.observe_query(0.002)
+        registry.observe_query(0.3)
+
+        assert registry.value('rate_limit_rejections_total', limiter='timeline_post') == 2
+        assert registry.value('db_queries_total') == 2
+        assert registry.value('db_query_duration_seconds') == 2
+
+        text = registry.render()
+        assert '# TYPE rate_limit_rejections_total counter\n' in text
+        assert 'rate_limit_rejections_total{limiter="timeline_post"} 2\n' in text
+        assert '# TYPE db_query_duration_seconds histogram\n' in text
+        # Buckets are cumulative
+        assert 'db_query_duration_seconds_bucket{le="0.001"} 0\n' in text
+        assert 'db_query_duration_seconds_bucket{le="0.0025"} 1\n' in text
+        assert 'db_query_duration_seconds_bucket{le="0.5"} 2\n' in text
+        assert 'db_query_duration_seconds_bucket{le="+Inf"} 2\n' in text
+        assert 'db_query_duration_seconds_count 2\n' in text
+
+    def test_threads_record_into_their_own_shards(self):
+        registry = MetricsRegistry()
+
+        def work():
+            for _ in range(1000):
+                registry.inc('db_queries_total')
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert registry.value('db_queries_total') == 8000
+
+        # Shards of exited threads are folded in, nothing is lost
+        registry.snapshot()
+        assert registry._shards == []
+        assert registry.value('db_queries_total') == 8000
+
+    def test_gauges(self):
+        registry = MetricsRegistry()
+        registry.gauge('queue_depth', 'Items waiting.', lambda: 3)
+        registry.gauge('pool_in_use', 'Not pooled.', lambda: None)
+        text = registry.render()
+        assert '# TYPE queue_depth gauge\nqueue_depth 3\n' in text
+        assert 'pool_in_use' not in text
+
+    def test_label_escaping(self):
+        assert format_labels((('route', 'a"b\\c\n'),)) == '{route="a\\"b\\\\c\\n"}'
+
+    def test_sweep_bounds_shards(self):
+        registry = MetricsRegistry()
+        for _ in range(SWEEP_EVERY * 2):
+            thread = threading.Thread(target=registry.inc, args=('db_queries_total',))
+            thread.start()
+            thread.join()
+        assert len(registry._shards) <= SWEEP_EVERY
+        assert registry.value('db_queries_total') == SWEEP_EVERY * 2
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# tests/test_profiling.py
+
+import json
+import os
+import pstats
+import tempfile
+import unittest
+
+from flask import Flask, jsonify
+from peewee import Model, CharField
+
+from app.metrics import MetricsSqliteDatabase, registry
+from app.profiling import Profiler, slow_query_log
+
+db = MetricsSqliteDatabase(':memory:')
+
+
+class Item(Model):
+    name = CharField()
+
+    class Meta:
+        database = db
+
+
+def make_app(profiler):
+    app = Flask(__name__)
+    profiler.init_app(app)
+
+    @app.route('/items/<name>')
+    def items(name):
+        return jsonify([item.name for item in Item.select().where(Item.name == name)])
+    return app
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db.connect()
+        db.create_tables([Item])
+        Item.create(name='a')
+
+    def tearDown(self):
+        registry.query_listener = None
+        db.close()
+        self.tmp.cleanup()
+
+    def test_disabled_adds_nothing(self):
+        app = make_app(Profiler())
+        assert registry.query_listener is None
+        assert not app.before_request_funcs and not app.after_request_funcs
+        response = app.test_client().get('/items/a')
+        assert 'X-Profile' not in response.headers
+
+    def test_profiled_request(self):
+        profiler = Profiler(sample_rate=1, directory=self.tmp.name, cprofile=True)
+        response = make_app(profiler).test_client().get('/items/a?x=1')
+        name = response.headers['X-Profile']
+        assert name.endswith('-GET-items_name')
+
+        with open(os.path.join(self.tmp.name, f'{name}.json')) as f:
+            report = json.load(f)
+        assert report['path'] == '/items/a?x=1'
+        assert report['route'] == '/items/<name>'
+        assert report['status'] == 200
+        [query] = report['queries']
+        assert 'FROM "item"' in query['sql']
+        assert query['params'] == ['a']
+        assert query['ms'] >= 0
+
+        stats = pstats.Stats(os.path.join(self.tmp.name, f'{name}.pstats'))
+        assert any(func[2] == 'items' for func in stats.stats)
+
+    def test_failed_request_stops_the_profiler(self):
+        profiler = Profiler(sample_rate=1, directory=self.tmp.name, cprofile=True)
+        app = make_app(profiler)
+        app.testing = True
+
+        @app.route('/fail')
+        def fail():
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            app.test_client().get('/fail')
+        # The exception skipped after_request; teardown still collected it
+        assert profiler._local.profile is None
+        [report] = [name for name in os.listdir(self.tmp.name) if name.endswith('.json')]
+        with open(os.path.join(self.tmp.name, report)) as f:
+            report = json.load(f)
+        assert (report['route'], report['status']) == ('/fail', 500)
+        assert 'boom' in report['error']
+        # The next request can profile again
+        assert 'X-Profile' in app.test_client().get('/items/a').headers
+
+    def test_sampling(self):
+        samples = iter([0.9, 0.1])
+        profiler = Profiler(sample_rate=0.5, directory=self.tmp.name, sample=lambda: next(samples))
+        client = make_app(profiler).test_client()
+        assert 'X-Profile' not in client.get('/items/a').headers
+        assert 'X-Profile' in client.get('/items/a').headers
+        assert len(os.listdir(self.tmp.name)) == 1
+
+    def test_slow_query_log(self):
+        log_file = os.path.join(self.tmp.name, 'slow.log')
+        profiler = Profiler(slow_query_ms=0, slow_query_file=log_file)
+        app = make_app(profiler)
+        # Slow queries are logged without profiling requests
+        assert not app.before_request_funcs
+        with self.assertLogs('app.slow_queries', 'WARNING') as logs:
+            app.test_client().get('/items/b')
+        assert 'slow query' in logs.output[0] and '["b"]' in logs.output[0]
+
+        app.test_client().get('/items/c')
+        handler = slow_query_log.handlers[-1]
+        slow_query_log.removeHandler(handler)
+        handler.close()
+        with open(log_file) as f:
+            assert '["c"]' in f.read()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# test_ratelimit.py
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+from peewee import SqliteDatabase
+
+from app.ratelimit import (RateLimiter, MemoryBackend, MmapBackend,
+                           DatabaseBackend, RateLimitEntry, parse_rate)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_parse_rate(self):
+        assert parse_rate('1/minute') == (1, 60)
+        assert parse_rate('5/30') == (5, 30.0)
+        with self.assertRaises(ValueError):
+            parse_rate('nonsense')
+
+    def test_one_per_minute(self):
+        limiter = RateLimiter(1, 60, clock=self.clock)
+        assert limiter.hit('1.2.3.4') == (True, 0.0)
+        allowed, retry_after = limiter.hit('1.2.3.4')
+        assert not allowed
+        assert retry_after == 60
+        # Other clients are unaffected
+        assert limiter.hit('5.6.7.8')[0]
+
+        self.clock.now = 30
+        allowed, retry_after = limiter.hit('1.2.3.4')
+        assert not allowed
+        assert retry_after == 30
+
+        self.clock.now = 60
+        assert limiter.hit('1.2.3.4')[0]
+
+    def test_burst(self):
+        limiter = RateLimiter(3, 60, clock=self.clock)
+        assert [limiter.hit('ip')[0] for _ in range(4)] == [True, True, True, False]
+        # One request's worth of capacity comes back every 20 seconds
+        self.clock.now = 20
+        assert limiter.hit('ip')[0]
+        assert not limiter.hit('ip')[0]
+
+    def test_expired_keys_are_dropped(self):
+        limiter = RateLimiter(1, 60, clock=self.clock)
+        for i in range(100):
+            limiter.hit(f'10.0.0.{i}')
+        assert len(limiter) == 100
+        self.clock.now = 61
+        limiter.hit('10.0.1.1')
+        assert len(limiter) == 1
+
+    def test_memory_is_bounded(self):
+        limiter = RateLimiter(1, 60, backend=MemoryBackend(max_keys=10), clock=self.clock)
+        for i in range(1000):
+            limiter.hit(f'10.0.{i // 256}.{i % 256}')
+        assert len(limiter) == 10
+
+
+class SharedBackendTests:
+    """Two limiters over the same storage must enforce a single limit."""
+
+    def make_backends(self):
+        raise NotImplementedError
+
+    def test_shared_limit(self):
+        clock = FakeClock()
+        clock.now = 1000.0
+        first, second = self.make_backends()
+        worker_a = RateLimiter(2, 60, name='timeline_post', backend=first, clock=clock)
+        worker_b = RateLimiter(2, 60, name='timeline_post', backend=second, clock=clock)
+        assert worker_a.hit('1.2.3.4')[0]
+        assert worker_b.hit('1.2.3.4')[0]
+        allowed, retry_after = worker_a.hit('1.2.3.4')
+        assert not allowed
+        assert retry_after == 30
+        # A different limiter over the same storage has its own counters
+        other = RateLimiter(1, 60, name='other', backend=second, clock=clock)
+        assert other.hit('1.2.3.4')[0]
+
+        clock.now += 30
+        assert worker_b.hit('1.2.3.4')[0]
+
+
+class TestMmapBackend(SharedBackendTests, unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_backends(self):
+        path = os.path.join(self.tmp.name, 'ratelimit')
+        return MmapBackend(path, slots=64), MmapBackend(path, slots=64)
+
+    def test_full_table_evicts(self):
+        backend = MmapBackend(os.path.join(self.tmp.name, 'small'), slots=4, probes=4)
+        limiter = RateLimiter(1, 60, backend=backend)
+        for i in range(100):
+            assert limiter.hit(f'10.0.0.{i}')[0]
+        assert len(backend) == 4
+
+
+class TestDatabaseBackend(SharedBackendTests, unittest.TestCase):
+    def setUp(self):
+        self.db = SqliteDatabase(':memory:')
+        with self.db.bind_ctx([RateLimitEntry]):
+            self.db.create_tables([RateLimitEntry])
+
+    def tearDown(self):
+        self.db.close()
+
+    def make_backends(self):
+        return DatabaseBackend(self.db), DatabaseBackend(self.db)
+
+    def test_app_backend_locks_on_sqlite(self):
+        # create_app() hands the backend its DatabaseProxy, not the SqliteDatabase
+        from app import create_app, db
+        with mock.patch.dict(os.environ, {'TESTING': 'true', 'RATE_LIMIT_BACKEND': 'database'}):
+            limiter = create_app().extensions['rate_limiters']['timeline_post']
+        assert isinstance(limiter.backend, DatabaseBackend)
+        db.create_tables([RateLimitEntry], safe=True)
+        try:
+            with mock.patch.object(db.obj, 'begin', wraps=db.obj.begin) as begin:
+                assert limiter.hit('1.2.3.4')[0]
+            begin.assert_called_once_with('IMMEDIATE')
+        finally:
+            db.drop_tables([RateLimitEntry])
+
+
+if __name__ == '__main__':
+    unittest.main()
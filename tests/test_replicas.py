@@ -0,0 +1,166 @@
+# tests/test_replicas.py
+
+import os
+import sqlite3
+import tempfile
+import unittest
+os.environ['TESTING'] = 'true'
+
+from app import create_app, db, read_database, replica_state, timeline_cache, write_replica_heartbeat, MODELS
+from app.metrics import MetricsSqliteDatabase, registry
+from app.replicas import ReplicaRouter
+from app.search import create_search_index
+
+app = create_app()
+
+FORM = {'name': 'Jane Doe', 'email': 'jane@example.com', 'content': 'Hello world'}
+
+
+class TestReplicaRouter(unittest.TestCase):
+    """SQLite files stand in for MySQL; replicate() copies the primary like replication would."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.original_db = db.obj
+        # test_db binds TimelinePost to a database of its own
+        for model in MODELS:
+            model._meta.set_database(db)
+        db.initialize(MetricsSqliteDatabase(self.path('primary')))
+        with db.connection_context():
+            db.create_tables(MODELS)
+            create_search_index(db)
+        timeline_cache.clear()
+        self.now = 1000.0
+
+    def tearDown(self):
+        app.extensions.pop('replicas', None)
+        db.close()
+        db.initialize(self.original_db)
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, f'{name}.db')
+
+    def use_replicas(self, *names, **kwargs):
+        self.router = ReplicaRouter(db, [MetricsSqliteDatabase(self.path(name)) for name in names],
+                                    read_state=replica_state, write_heartbeat=write_replica_heartbeat,
+                                    check_interval=None, clock=lambda: self.now, **kwargs)
+        app.extensions['replicas'] = self.router
+        # Replication starts from a copy of the primary
+        self.replicate(*names)
+        return self.router
+
+    def replicate(self, *names):
+        db.close()
+        self.router.close()
+        source = sqlite3.connect(self.path('primary'))
+        for name in names:
+            target = sqlite3.connect(self.path(name))
+            source.backup(target)
+            target.close()
+        source.close()
+
+    def sync(self, *names):
+        """A heartbeat reaches `names`, then the router checks one second later."""
+        self.router.check()
+        self.replicate(*names)
+        self.now += 1
+        self.router.check()
+
+    def readers(self, count, **headers):
+        picked = []
+        for _ in range(count):
+            with app.test_request_context(headers=headers):
+                picked.append(read_database())
+        return picked
+
+    def test_round_robin_over_fresh_replicas(self):
+        router = self.use_replicas('r1', 'r2')
+        first, second = (replica.database for replica in router.replicas)
+        # Never checked: lag unknown, so everything reads from the primary
+        assert self.readers(2) == [db, db]
+
+        self.sync('r1', 'r2')
+        assert router.usable() == 2
+        assert self.readers(4) == [first, second, first, second]
+
+        # r2 stops replicating and falls more than max_lag behind
+        self.now += 10
+        self.sync('r1')
+        assert router.usable() == 1
+        assert self.readers(3) == [first, first, first]
+
+    def test_stale_replica_served_and_reported(self):
+        self.use_replicas('r1')
+        self.sync('r1')
+        client = app.test_client()
+        assert client.post('/api/timeline_post', data=FORM).status_code == 201
+
+        # Another client reads the replica, which hasn't seen the post yet
+        response = app.test_client().get('/api/timeline_post')
+        assert response.get_json() == []
+        assert response.headers['ETag'] == '"timeline-0"'
+        # Still within max_lag: behind by one write is fine for anyone else
+        assert self.router.usable() == 1
+
+    def test_read_your_own_writes(self):
+        self.use_replicas('r1')
+        self.sync('r1')
+        client = app.test_client()
+        self.now += 1
+        response = client.post('/api/timeline_post', data=FORM)
+        assert response.status_code == 201
+        assert 'last_write=' in response.headers['Set-Cookie']
+
+        # The replica's heartbeat predates the write: the writer reads the primary
+        assert [post['content'] for post in client.get('/api/timeline_post').get_json()] == ['Hello world']
+        assert self.readers(1) == [self.router.replicas[0].database]
+
+        # Once a heartbeat written after the post has replicated, the replica will do
+        self.sync('r1')
+        with app.test_request_context(headers={'Cookie': response.headers['Set-Cookie'].split(';')[0]}):
+            assert read_database() is self.router.replicas[0].database
+        assert client.get('/api/timeline_post').get_json()[0]['content'] == 'Hello world'
+
+    def test_reads_never_go_back_in_time(self):
+        self.use_replicas('r1')
+        self.sync('r1')
+        assert app.test_client().post('/api/timeline_post', data=FORM).status_code == 201
+
+        # A client that saw version 1 (from the primary) isn't sent to a
+        # replica still at version 0
+        etag = 'timeline-1'
+        with app.test_request_context(headers={'If-None-Match': f'"{etag}"'}):
+            assert read_database() is db
+        response = app.test_client().get('/api/timeline_post', headers={'If-None-Match': f'"{etag}"'})
+        assert response.status_code == 304
+        response = app.test_client().get('/timeline', headers={'If-None-Match': '"timeline-page-1"'})
+        assert response.status_code == 304
+
+    def test_failover_to_primary(self):
+        router = self.use_replicas('r1', retry_after=30)
+        assert app.test_client().post('/api/timeline_post', data=FORM).status_code == 201
+        self.sync('r1')
+        assert self.readers(1) == [router.replicas[0].database]
+
+        # The replica loses its data: the read is retried on the primary
+        os.remove(self.path('r1'))
+        failovers = registry.value('db_replica_failovers_total')
+        for path in ('/api/timeline_post', '/api/timeline_post/search?q=hello'):
+            response = app.test_client().get(path)
+            assert response.status_code == 200
+            assert response.get_json()[0]['content'] == 'Hello world'
+        assert registry.value('db_replica_failovers_total') == failovers + 1
+        assert router.usable() == 0
+        assert self.readers(1) == [db]
+
+        # Restored from a copy, checked again (and back in rotation) once
+        # retry_after has passed
+        self.replicate('r1')
+        self.now += 31
+        self.sync('r1')
+        assert self.readers(1) == [router.replicas[0].database]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# tests/test_writebehind.py
+
+import threading
+import time
+import unittest
+
+from app.writebehind import QueueFull, WriteBehindQueue
+
+
+class TestWriteBehindQueue(unittest.TestCase):
+    def test_flushes_full_batches(self):
+        batches = []
+        write_queue = WriteBehindQueue(batches.append, batch_size=3, flush_interval=5)
+        for i in range(6):
+            write_queue.submit(i)
+        deadline = time.monotonic() + 5
+        while len(batches) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Full batches go out without waiting for the interval
+        assert batches == [[0, 1, 2], [3, 4, 5]]
+        write_queue.stop(5)
+
+    def test_flushes_partial_batch_after_interval(self):
+        batches = []
+        write_queue = WriteBehindQueue(batches.append, batch_size=100, flush_interval=0.01)
+        write_queue.submit('a')
+        deadline = time.monotonic() + 5
+        while not batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert batches == [['a']]
+        write_queue.stop(5)
+
+    def test_stop_drains_queue(self):
+        flushed = []
+        write_queue = WriteBehindQueue(flushed.extend, batch_size=10, flush_interval=60)
+        for i in range(25):
+            write_queue.submit(i)
+        write_queue.stop(5)
+        assert flushed == list(range(25))
+        stats = write_queue.stats()
+        assert stats['depth'] == 0
+        assert stats['enqueued'] == stats['flushed'] == 25
+
+    def test_backpressure(self):
+        release = threading.Event()
+        write_queue = WriteBehindQueue(lambda batch: release.wait(5), max_size=2, batch_size=1,
+                                       flush_interval=0.01)
+        accepted = rejected = 0
+        for i in range(10):
+            try:
+                write_queue.submit(i)
+                accepted += 1
+            except QueueFull:
+                rejected += 1
+        # At most one batch in flight plus the queue's capacity
+        assert accepted <= 3
+        assert rejected == write_queue.stats()['rejected'] == 10 - accepted
+        release.set()
+        write_queue.stop(5)
+
+    def test_failed_flush_is_retried_then_dropped(self):
+        attempts = []
+
+        def flaky(batch):
+            attempts.append(batch)
+            if len(attempts) < 2:
+                raise RuntimeError('database is down')
+
+        write_queue = WriteBehindQueue(flaky, retries=1, retry_delay=0)
+        write_queue.submit('x')
+        write_queue.stop(5)
+        assert len(attempts) == 2
+        assert write_queue.stats()['flushed'] == 1
+
+        write_queue = WriteBehindQueue(lambda batch: 1 / 0, retries=1, retry_delay=0)
+        write_queue.submit('y')
+        write_queue.stop(5)
+        stats = write_queue.stats()
+        assert stats['flushed'] == 0
+        assert stats['dropped'] == 1
+
+
+if __name__ == '__main__':
+    unittest.main()